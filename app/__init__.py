@@ -68,6 +68,14 @@ def create_app(config_class_string):
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(scheduler_api)
 
+    # 7. 啟動 Webhook 背景處理佇列（需在藍圖註冊後，handler 才已綁定事件處理函式）
+    from .services.webhook_queue import init_webhook_queue
+    init_webhook_queue(app, handler)
+
+    # 8. 背景預熱 Speech / Gemini client（PREWARM_AI_CLIENTS）
+    from .services.client_registry import start_warm_up
+    start_warm_up(app)
+
     # 建立必要的資料夾 (如果不存在)
     # 這裡假設您的 `app.py` 中的 uploads 資料夾是需要的
     uploads_path = os.path.join(app.static_folder, 'uploads')
@@ -1,10 +1,10 @@
 # app/routes/auth.py
 
 import uuid
-import requests
 from flask import Blueprint, request, redirect, session, current_app, jsonify
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi, PushMessageRequest, TextMessage
 from config import Config
+from app.utils.http_client import get_http_client
 
 auth_bp = Blueprint('auth', __name__)
 @auth_bp.route("/login")
@@ -107,7 +107,7 @@ def auth_callback():
         current_app.logger.info(f"Payload: {dict(token_payload)}")
         current_app.logger.info(f"====================")
         
-        response = requests.post(token_url, data=token_payload)
+        response = get_http_client().post(token_url, data=token_payload, timeout=10)
         
         current_app.logger.info(f"Token response status: {response.status_code}")
         if response.status_code != 200:
@@ -119,7 +119,7 @@ def auth_callback():
         
         profile_url = "https://api.line.me/v2/profile"
         headers = {'Authorization': f'Bearer {access_token}'}
-        profile_response = requests.get(profile_url, headers=headers)
+        profile_response = get_http_client().get(profile_url, headers=headers, timeout=10)
         profile_response.raise_for_status()
         profile = profile_response.json()
         
@@ -2,15 +2,15 @@
 
 import io
 import base64
-import requests
-import concurrent.futures
-from PIL import Image
 from flask import current_app
 from linebot.models import TextSendMessage, FlexSendMessage
 from linebot.v3.messaging import Configuration, ApiClient, MessagingApi, MessagingApiBlob, ReplyMessageRequest, TextMessage, FlexMessage, FlexContainer
 from app import line_bot_api
 from ...services.user_service import UserService
+from ...services.pill_detection import DetectionBackend, get_pill_detection_orchestrator
 from ...utils.flex import pill as flex_pill
+from ...utils.image_pipeline import PreparedImage
+from ...utils.http_client import get_http_client
 
 # 條件導入 kevin_model_handler，避免導入失敗影響整個模組
 try:
@@ -38,18 +38,21 @@ def get_available_models():
     models = {}
     
     # 只有當 URL 存在時才加入模型
+    # *_HEDGE_URL 為選用的備援端點，主要端點回應過慢時送出對沖請求
     yolo_v12_url = os.environ.get('YOLO_V12_URL')
     if yolo_v12_url:
         models["1"] = {
             "name": "yolov12",
-            "url": yolo_v12_url
+            "url": yolo_v12_url,
+            "hedge_url": os.environ.get('YOLO_V12_HEDGE_URL')
         }
     
     yolo_v11_url = os.environ.get('YOLO_V11_URL')
     if yolo_v11_url:
         models["2"] = {
             "name": "yolov11", 
-            "url": yolo_v11_url
+            "url": yolo_v11_url,
+            "hedge_url": os.environ.get('YOLO_V11_HEDGE_URL')
         }
     
     if not models:
@@ -81,10 +84,13 @@ class PillDetectionClient:
             print(f"PIL 图片转换失败: {str(e)}")
             raise
     
-    def detect_pills(self, pil_image):
-        """检测药丸"""
+    def detect_pills(self, image):
+        """检测药丸（image 可為 PreparedImage 或 PIL Image）"""
         try:
-            image_base64 = self._pil_image_to_base64(pil_image)
+            if isinstance(image, PreparedImage):
+                image_base64 = image.base64
+            else:
+                image_base64 = self._pil_image_to_base64(image)
             payload = {"image": image_base64}
             
             if self.use_all_models and len(self.base_urls) > 1:
@@ -96,13 +102,16 @@ class PillDetectionClient:
             print(f"药丸检测失败: {str(e)}")
             raise
     
+    def _post_detect(self, url, payload):
+        response = get_http_client().post(f"{url}/api/detect", json=payload, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+    
     def _detect_with_single_model(self, payload):
         """单模型检测"""
         url = self.base_urls[0]
         try:
-            response = requests.post(f"{url}/api/detect", json=payload, timeout=self.timeout)
-            response.raise_for_status()
-            result = response.json()
+            result = self._post_detect(url, payload)
             result['detection_mode'] = 'single'
             result['model_name'] = '药丸检测模型'
             
@@ -117,22 +126,24 @@ class PillDetectionClient:
             raise
     
     def _detect_with_all_models(self, payload):
-        """多模型检测"""
+        """多模型检测（透過共用調度器同時送出）"""
+        backends = [
+            DetectionBackend(f"模型{i+1}", lambda _image, url=url: self._post_detect(url, payload), breaker_key=url)
+            for i, url in enumerate(self.base_urls)
+        ]
+        report = get_pill_detection_orchestrator().detect(None, backends)
+        for name, error in report['errors'].items():
+            print(f"{name} 检测失败: {error}")
+        
         all_results = []
         successful_models = []
-        
-        for i, url in enumerate(self.base_urls):
-            try:
-                response = requests.post(f"{url}/api/detect", json=payload, timeout=self.timeout)
-                response.raise_for_status()
-                result = response.json()
+        for i, (backend, url) in enumerate(zip(backends, self.base_urls)):
+            if backend.name in report['successful_models']:
+                result = report['results'][report['successful_models'].index(backend.name)]
                 result['model_source'] = url
                 result['model_index'] = i + 1
                 all_results.append(result)
-                successful_models.append(f"模型{i+1}")
-            except Exception as e:
-                print(f"模型 {i+1} 检测失败: {str(e)}")
-                continue
+                successful_models.append(backend.name)
         
         if not all_results:
             raise Exception("所有模型都无法进行检测")
@@ -187,6 +198,31 @@ class PillDetectionClient:
         
         return merged_result
 
+def _build_detection_backends(model_ids, kevin_name="Transformer"):
+    """依模型 ID（"1"、"2" 為 YOLO，"3" 為 kevin 模型）建立調度器使用的 backend，略過未設定的模型。"""
+    backends = []
+    for model_id in model_ids:
+        if model_id == '3':
+            if KEVIN_MODEL_AVAILABLE:
+                backends.append(DetectionBackend(
+                    kevin_name,
+                    lambda image: kevin_model_handler.detect_pills(image_bytes=image.jpeg_bytes),
+                    breaker_key='kevin'
+                ))
+            continue
+        model_info = AVAILABLE_MODELS.get(model_id)
+        if not model_info:
+            continue
+        hedge_url = model_info.get('hedge_url')
+        backends.append(DetectionBackend(
+            model_info['name'],
+            PillDetectionClient([model_info['url']], use_all_models=False).detect_pills,
+            breaker_key=model_info['url'],
+            hedge=PillDetectionClient([hedge_url], use_all_models=False).detect_pills if hedge_url else None,
+            hedge_key=hedge_url
+        ))
+    return backends
+
 def _standardize_and_get_db_info(raw_results):
     """标准化检测结果并从数据库获取药品信息"""
     if not raw_results:
@@ -229,26 +265,21 @@ def _standardize_and_get_db_info(raw_results):
         pill_details = []  # 初始化為空列表
         if drug_id_prefixes:
             from ...utils.db import DB
-            # 使用前綴匹配查詢藥品詳細資訊
-            pill_details = []
-            print(f"    - 調試: 查詢前綴 {drug_id_prefixes}")
+            # 一次解析所有前綴，取得 prefix -> 藥品詳細資訊
+            details_by_prefix = DB.get_pills_details_by_prefixes(drug_id_prefixes)
             for prefix in drug_id_prefixes:
-                # 查詢所有以此前綴開頭的藥品
-                matching_pills = DB.get_pills_details_by_prefix(prefix)
-                print(f"    - 調試: 前綴 '{prefix}' 找到 {len(matching_pills)} 個藥品")
-                pill_details.extend(matching_pills)
-            print(f"    - 調試: 總共找到 {len(pill_details)} 個藥品詳細資訊")
+                pill_details.extend(details_by_prefix.get(prefix, []))
+            print(f"    - 調試: 查詢前綴 {drug_id_prefixes}，共找到 {len(pill_details)} 個藥品詳細資訊")
             
-            # 将数据库信息合并到检测结果中 (前十碼匹配)
+            # 将数据库信息合并到检测结果中 (前十碼匹配，每個前十碼取第一筆)
+            detail_by_db_prefix = {}
+            for pill_detail in pill_details:
+                detail_by_db_prefix.setdefault(str(pill_detail.get('drug_id', ''))[:10], pill_detail)
             for detection in detections:
-                detected_drug_id = str(detection.get('drug_id', ''))
-                detected_prefix = detected_drug_id[:10]
-                for pill_detail in pill_details:
-                    db_drug_id = str(pill_detail.get('drug_id', ''))
-                    db_prefix = db_drug_id[:10]
-                    if detected_prefix == db_prefix:
-                        detection.update(pill_detail)
-                        break
+                detected_prefix = str(detection.get('drug_id', ''))[:10]
+                pill_detail = detail_by_db_prefix.get(detected_prefix)
+                if pill_detail:
+                    detection.update(pill_detail)
         
         standardized_result = {
             'detections': detections,
@@ -336,22 +367,26 @@ def handle(event):
             
             # 从数据库查询药品详细信息，支援前綴匹配
             from ...utils.db import DB
-            pill_details_list = []
+            drug_ids = [
+                drug_id for drug_id in drug_ids
+                if drug_id != 'unknown' and not drug_id.startswith('Detected:') and not drug_id.startswith('檢測到:')
+            ]
+            
+            # 先嘗試完整匹配，沒有完整匹配的再一次以前綴批次查詢
+            exact_matches = {detail['drug_id']: detail for detail in DB.get_pills_details_by_ids(drug_ids)}
+            missing_prefixes = [
+                drug_id[:10] if len(drug_id) >= 10 else drug_id
+                for drug_id in drug_ids if drug_id not in exact_matches
+            ]
+            prefix_matches = DB.get_pills_details_by_prefixes(missing_prefixes) if missing_prefixes else {}
             
+            pill_details_list = []
             for drug_id in drug_ids:
-                if drug_id == 'unknown' or drug_id.startswith('Detected:') or drug_id.startswith('檢測到:'):
-                    continue
-                    
-                # 先嘗試完整匹配
-                exact_match = DB.get_pills_details_by_ids([drug_id])
-                if exact_match:
-                    pill_details_list.extend(exact_match)
+                if drug_id in exact_matches:
+                    pill_details_list.append(exact_matches[drug_id])
                 else:
-                    # 如果沒有完整匹配，嘗試前綴匹配
                     prefix = drug_id[:10] if len(drug_id) >= 10 else drug_id
-                    prefix_matches = DB.get_pills_details_by_prefix(prefix)
-                    if prefix_matches:
-                        pill_details_list.extend(prefix_matches[:3])  # 最多取前3個匹配結果
+                    pill_details_list.extend(prefix_matches.get(prefix, [])[:3])  # 最多取前3個匹配結果
             
             print(f"    - 調試: 找到 {len(pill_details_list)} 個藥品詳細資訊")
             
@@ -375,7 +410,6 @@ def handle(event):
 def start_loading_animation(user_id, seconds=55):
     """启动 LINE Chat Loading 动画"""
     try:
-        import requests
         from flask import current_app
         
         loading_url = "https://api.line.me/v2/bot/chat/loading/start"
@@ -388,7 +422,7 @@ def start_loading_animation(user_id, seconds=55):
             "loadingSeconds": min(max(seconds, 10), 60)
         }
         
-        response = requests.post(loading_url, headers=headers, json=data)
+        response = get_http_client().post(loading_url, headers=headers, json=data, timeout=5)
         if response.status_code == 202:
             print(f"✅ 已為用戶 {user_id} 啟動載入動畫 ({data['loadingSeconds']} 秒)")
         else:
@@ -430,7 +464,10 @@ def handle_image_message(event):
         image_bytes = message_content if isinstance(message_content, bytes) else b"".join(message_content.iter_content())
         if not image_bytes:
             raise ValueError("下載的圖片內容為空。")
-        img_pil = Image.open(io.BytesIO(image_bytes)).convert('RGB')
+        # 保留原始 bytes，最多做一次縮圖/重新編碼，所有模型共用同一份上傳內容
+        prepared_image = PreparedImage(image_bytes, max_dimension=Config.PILL_IMAGE_MAX_DIMENSION)
+        print(f"    - 圖片 {prepared_image.width}x{prepared_image.height}，上傳 {len(prepared_image.jpeg_bytes)} bytes"
+              f"{'（已重新編碼）' if prepared_image.reencoded else '（沿用原始檔）'}")
         step1_end = time.time()
         step1_duration = step1_end - step1_start
         print(f"    - 步驟 1-2: 圖片處理完畢。耗時: {step1_duration:.2f} 秒")
@@ -464,28 +501,26 @@ def handle_image_message(event):
             raw_result = None
             print(f"    - 單一模型辨識，模型ID: {selected_model}")
             
-            if selected_model == '3':
-                print("    - 使用單一模型: kevin模型")
-                if KEVIN_MODEL_AVAILABLE:
-                    raw_result = kevin_model_handler.detect_pills(pil_image=img_pil)
-                else:
-                    print(f"    - ❌ kevin模型不可用，KEVIN_MODEL_AVAILABLE = {KEVIN_MODEL_AVAILABLE}")
-                    print(f"    - 🔄 自動切換到高精度模型作為備用")
-                    # 自動使用高精度模型作為備用
-                    model_info = AVAILABLE_MODELS["1"]
-                    client = PillDetectionClient([model_info['url']], use_all_models=False)
-                    raw_result = client.detect_pills(img_pil)
-                    if raw_result: 
-                        raw_result['model_name'] = f"{model_info['name']} (kevin模型備用)"
-            elif selected_model in AVAILABLE_MODELS:
-                model_info = AVAILABLE_MODELS[selected_model]
-                print(f"    - 使用單一模型: {model_info['name']}")
-                client = PillDetectionClient([model_info['url']], use_all_models=False)
-                raw_result = client.detect_pills(img_pil)
-                if raw_result: raw_result['model_name'] = model_info['name']
+            if selected_model == '3' and not KEVIN_MODEL_AVAILABLE:
+                print(f"    - ❌ kevin模型不可用，KEVIN_MODEL_AVAILABLE = {KEVIN_MODEL_AVAILABLE}")
+                print(f"    - 🔄 自動切換到高精度模型作為備用")
+                # 自動使用高精度模型作為備用
+                backends = _build_detection_backends(["1"])
+                for backend in backends:
+                    backend.name = f"{backend.name} (kevin模型備用)"
+            else:
+                backends = _build_detection_backends([selected_model], kevin_name="Transformer模型")
+            
+            detection_report = get_pill_detection_orchestrator().detect(
+                prepared_image, backends, image_digest=prepared_image.digest, image_hash=prepared_image.dhash
+            ) if backends else None
+            if detection_report and detection_report['results']:
+                raw_result = detection_report['results'][0]
             
             if not raw_result or not raw_result.get('success'):
-                raise Exception(f"模型處理失敗: {raw_result.get('error', '未知錯誤')}")
+                errors = detection_report['errors'] if detection_report else {}
+                error = (raw_result or {}).get('error') or next(iter(errors.values()), '未知錯誤')
+                raise Exception(f"模型處理失敗: {error}")
             
             all_results_for_carousel, total_elapsed_time = _standardize_and_get_db_info([raw_result])
             step3_end = time.time()
@@ -504,51 +539,19 @@ def handle_image_message(event):
 
         else: # detection_mode == 'multi'
             # --- ✨ 多模型並行辨識邏輯 (包含 kevin 模型) ---
+            # 共用調度器同時送出，超過延遲預算的模型不再等待，斷路中的模型直接略過
             print("    - 使用多模型同時辨識 (高精度 + 高速度 + kevin模型)")
-            all_raw_results = []
-            successful_models = []
-            failed_models = []
-            total_models = 0
-            
-            with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
-                # 準備要執行的任務
-                future_to_model = {}
-                
-                # 任務1: 高精度模型
-                client1 = PillDetectionClient([AVAILABLE_MODELS["1"]["url"]], use_all_models=False)
-                future1 = executor.submit(client1.detect_pills, img_pil)
-                future_to_model[future1] = AVAILABLE_MODELS["1"]["name"]
-                total_models += 1
-                
-                # 任務2: 高速度模型
-                client2 = PillDetectionClient([AVAILABLE_MODELS["2"]["url"]], use_all_models=False)
-                future2 = executor.submit(client2.detect_pills, img_pil)
-                future_to_model[future2] = AVAILABLE_MODELS["2"]["name"]
-                total_models += 1
-                
-                # 任務3: kevin模型 (如果可用)
-                if KEVIN_MODEL_AVAILABLE:
-                    future3 = executor.submit(kevin_model_handler.detect_pills, img_pil)
-                    future_to_model[future3] = "Transformer"
-                    total_models += 1
-
-                # 等待所有任務完成並收集結果
-                for future in concurrent.futures.as_completed(future_to_model):
-                    model_name = future_to_model[future]
-                    try:
-                        result = future.result()
-                        if result and result.get('success'):
-                            # 為每個模型的結果加上名稱，以便後續處理
-                            result['model_name'] = model_name
-                            all_raw_results.append(result)
-                            successful_models.append(model_name)
-                            print(f"    - ✅ 模型 '{model_name}' 辨識成功")
-                        else:
-                            failed_models.append(model_name)
-                            print(f"    - ❌ 模型 '{model_name}' 辨識失敗或無結果: {result.get('error') if result else '無回應'}")
-                    except Exception as exc:
-                        failed_models.append(model_name)
-                        print(f"    - ❌ 模型 '{model_name}' 執行時發生嚴重錯誤: {exc}")
+            backends = _build_detection_backends(["1", "2", "3"])
+            detection_report = get_pill_detection_orchestrator().detect(prepared_image, backends, image_digest=prepared_image.digest, image_hash=prepared_image.dhash)
+            
+            all_raw_results = detection_report['results']
+            successful_models = detection_report['successful_models']
+            failed_models = (detection_report['failed_models'] + detection_report['timed_out_models']
+                             + detection_report['skipped_models'])
+            for model_name in successful_models:
+                print(f"    - ✅ 模型 '{model_name}' 辨識成功")
+            for model_name in failed_models:
+                print(f"    - ❌ 模型 '{model_name}' 辨識失敗或無結果: {detection_report['errors'].get(model_name)}")
             
             # 將所有成功模型的結果合併並標準化
             all_results_for_carousel, total_elapsed_time = _standardize_and_get_db_info(all_raw_results)
@@ -558,7 +561,7 @@ def handle_image_message(event):
             
             # 記錄模型狀態供後續使用
             models_status = {
-                'total': total_models,
+                'total': len(backends),
                 'successful': len(successful_models),
                 'failed': len(failed_models),
                 'successful_models': successful_models,
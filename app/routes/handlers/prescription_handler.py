@@ -5,7 +5,6 @@ from linebot.models import TextSendMessage, ImageMessage, FlexSendMessage, Postb
 from urllib.parse import parse_qs, unquote
 import time
 import traceback
-import base64
 from app import line_bot_api
 
 from app.services.user_service import UserService
@@ -13,11 +12,12 @@ from app.services import prescription_service
 from app.utils.flex import prescription as flex_prescription, general as flex_general
 from app.utils.flex.prescription import create_prescription_model_choice
 from app.utils.db import DB
+from app.utils.blob_store import get_blob_store
+from app.utils.http_client import get_http_client
 
 def start_loading_animation(user_id, seconds=10):
     """启动 LINE Chat Loading 动画"""
     try:
-        import requests
         from flask import current_app
         
         loading_url = "https://api.line.me/v2/bot/chat/loading/start"
@@ -30,7 +30,7 @@ def start_loading_animation(user_id, seconds=10):
             "loadingSeconds": min(max(seconds, 10), 60)
         }
         
-        response = requests.post(loading_url, headers=headers, json=data)
+        response = get_http_client().post(loading_url, headers=headers, json=data, timeout=5)
         if response.status_code == 202:
             print(f"✅ 已為用戶 {user_id} 啟動藥單分析載入動畫")
         else:
@@ -379,6 +379,8 @@ def handle_text_message(event, user_id):
             
             # 執行同步分析
             prescription_service.PrescriptionService.trigger_analysis(user_id, task_id)
+            # 分析結果需在回覆前寫回，LIFF 編輯頁才讀得到
+            UserService.flush_event_state()
             
             # 獲取分析結果
             updated_state = UserService.get_user_complex_state(user_id)
@@ -442,24 +444,28 @@ def handle_image_message(reply_token, message_id, user_id):
         
         print(f"📥 [藥單辨識] 圖片下載完成，大小: {len(image_bytes)} bytes")
         
-        # 將圖片轉為base64並儲存到狀態
-        image_b64 = base64.b64encode(image_bytes).decode('utf-8')
+        # 圖片原檔存入 blob store，狀態中只保留雜湊
+        image_ref = get_blob_store().put(image_bytes)
         
         # 生成任務ID
         import time
         task_id = f"task_{int(time.time())}"
         
         # 更新用戶狀態
-        state["last_task"]["image_bytes_list"] = [image_b64]
+        state["last_task"]["image_refs"] = [image_ref]
+        state["last_task"].pop("image_bytes_list", None)
         state["last_task"]["task_id"] = task_id
         state["state_info"]["state"] = "PROCESSING"
         UserService.set_user_complex_state(user_id, state)
+        # 分析耗時較長，先寫回 PROCESSING 狀態
+        UserService.flush_event_state()
         
         print(f"💾 [藥單辨識] 狀態已更新，任務ID: {task_id}")
         
         # 執行同步分析
         try:
             prescription_service.PrescriptionService.trigger_analysis(user_id, task_id)
+            UserService.flush_event_state()
             print(f"🔄 [藥單辨識] 分析完成")
             
             # 獲取分析結果
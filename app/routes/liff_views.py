@@ -2,7 +2,6 @@
 
 from flask import Blueprint, request, jsonify, render_template, current_app
 import requests
-import base64
 import traceback
 
 # 從服務層導入邏輯
@@ -12,6 +11,8 @@ from ..utils.helpers import convert_minguo_to_gregorian
 
 # 導入數據庫操作類別
 from ..utils.db import DB
+from ..utils.blob_store import get_blob_store
+from ..utils.http_client import get_http_client
 
 # 移除 start_loading_animation 函數，現在在 prescription_handler 中處理
 
@@ -33,12 +34,13 @@ def _verify_line_id_token(id_token: str) -> str | None:
         client_id = config_value or env_value
         current_app.logger.info(f"🔧 使用配置的 client_id: {client_id}")
         
-        response = requests.post(
+        response = get_http_client().post(
             'https://api.line.me/oauth2/v2.1/verify',
             data={
                 'id_token': id_token,
                 'client_id': client_id
-            }
+            },
+            timeout=10
         )
         
         current_app.logger.info(f"🔍 LINE API 回應狀態: {response.status_code}")
@@ -230,8 +232,10 @@ def upload_multiple_prescriptions():
         if state.get("last_task", {}).get("task_id") != task_id:
              return jsonify({"status": "error", "message": "任務ID不匹配，請重新操作。"}), 400
 
-        image_b64_list = [base64.b64encode(p.read()).decode('utf-8') for p in photos]
-        state["last_task"]["image_bytes_list"] = image_b64_list
+        # 圖片原檔存入 blob store，狀態中只保留雜湊
+        store = get_blob_store()
+        state["last_task"]["image_refs"] = [store.put(p.read()) for p in photos]
+        state["last_task"].pop("image_bytes_list", None)
         state.pop("state_info", None) 
         UserService.set_user_complex_state(user_id, state)
         
@@ -20,6 +20,8 @@ except ImportError:
     pill_handler = None
 
 from app.services.user_service import UserService
+from app.services.profile_cache import profile_cache
+from app.services.webhook_queue import get_webhook_dispatcher, register_event_handler, WebhookQueueFullError
 from app.services.voice_service import VoiceService
 from app.services.ai_processor import parse_text_based_reminder
 from app.utils.flex import general as flex_general
@@ -34,6 +36,23 @@ def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     current_app.logger.info("Request body: " + body)
+
+    # 非同步模式：驗證簽章後放入佇列，立即回覆 LINE 平台
+    dispatcher = get_webhook_dispatcher()
+    if dispatcher:
+        try:
+            dispatcher.submit(body, signature)
+        except InvalidSignatureError:
+            abort(400)
+        except WebhookQueueFullError as e:
+            current_app.logger.error(f"Webhook 佇列已滿: {e}")
+            abort(503)
+        except Exception as e:
+            current_app.logger.error(f"Webhook 事件入列時發生錯誤: {e}")
+            traceback.print_exc()
+            abort(500)
+        return 'OK'
+
     try:
         handler.handle(body, signature)
     except InvalidSignatureError:
@@ -45,9 +64,17 @@ def callback():
     return 'OK'
 
 
-@handler.add(MessageEvent, message=(TextMessage, ImageMessage, AudioMessage))
+@register_event_handler(handler, MessageEvent, message=(TextMessage, ImageMessage, AudioMessage))
 def handle_message_dispatcher(event):
-    """處理文字訊息的分發器"""
+    """處理文字訊息的分發器（事件期間的使用者狀態統一由快取提供，結束時一次寫回）"""
+    UserService.begin_event(event.source.user_id)
+    try:
+        _dispatch_message(event)
+    finally:
+        UserService.end_event()
+
+
+def _dispatch_message(event):
     user_id = event.source.user_id
     
     # 確保用戶存在
@@ -95,7 +122,7 @@ def handle_message_dispatcher(event):
         
         # 下載並處理語音檔案
         download_start_time = time.time()
-        audio_content = VoiceService.download_audio_content(event.message.id, line_bot_api)
+        audio_content = VoiceService.download_audio_stream(event.message.id, line_bot_api)
         download_time = time.time() - download_start_time
         
         if not audio_content:
@@ -105,7 +132,7 @@ def handle_message_dispatcher(event):
                 TextSendMessage(text="❌ 無法下載語音檔案，請重新錄製"))
             return
         
-        current_app.logger.info(f"[語音處理] 音檔下載完成，大小: {len(audio_content)} bytes，耗時: {download_time:.3f}秒")
+        current_app.logger.info(f"[語音處理] 音檔下載與轉換完成，大小: {audio_content.source_size} bytes，耗時: {download_time:.3f}秒")
         
         # 處理語音輸入
         processing_start_time = time.time()
@@ -1566,13 +1593,16 @@ def handle_login_request(event):
         current_app.logger.error(f"登入請求處理錯誤: {e}")
         line_bot_api.reply_message(event.reply_token, TextSendMessage(text="登入功能暫時無法使用，請稍後再試。"))
 
-@handler.add(FollowEvent)
+@register_event_handler(handler, FollowEvent)
 def handle_follow_event(event):
     """處理用戶第一次加入 Bot 的事件 - 顯示個人資料蒐集聲明"""
     try:
         user_id = event.source.user_id
         current_app.logger.info(f"新用戶加入: {user_id}")
         
+        # 加入（或解除封鎖）時重新取得 Profile，清掉負向快取與舊的顯示名稱
+        profile_cache.refresh(user_id)
+        
         # 建立或獲取用戶資料
         user_name = UserService.get_or_create_user(user_id)
         
@@ -1601,8 +1631,16 @@ def handle_follow_event(event):
         except Exception as fallback_error:
             current_app.logger.error(f"發送備用歡迎訊息也失敗: {fallback_error}")
 
-@handler.add(PostbackEvent)
+@register_event_handler(handler, PostbackEvent)
 def handle_postback_dispatcher(event):
+    UserService.begin_event(event.source.user_id)
+    try:
+        _dispatch_postback(event)
+    finally:
+        UserService.end_event()
+
+
+def _dispatch_postback(event):
     from urllib.parse import parse_qs, unquote
     
     data_str = event.postback.data
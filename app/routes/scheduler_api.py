@@ -2,7 +2,7 @@
 # Cloud Scheduler 調用的 API 端點
 
 from flask import Blueprint, jsonify, request, current_app
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
 
 scheduler_api = Blueprint('scheduler_api', __name__)
@@ -21,16 +21,25 @@ def check_reminders_endpoint():
             current_app.logger.warning(f"未授權的提醒檢查請求: {request.remote_addr}")
             return jsonify({'error': 'Unauthorized'}), 401
         
+        # 分片參數：?shard=i&of=N，讓多個 Cloud Scheduler 工作分攤同一分鐘的提醒
+        shard = request.args.get('shard', type=int)
+        shard_count = request.args.get('of', type=int)
+        if shard is not None or shard_count is not None:
+            if shard is None or not shard_count or shard_count < 1 or not 0 <= shard < shard_count:
+                return jsonify({'error': 'Invalid shard parameters, expected ?shard=i&of=N with 0 <= i < N'}), 400
+        
         # 執行提醒檢查邏輯
         from app.services.reminder_service import check_and_send_reminders
         
         current_app.logger.info("開始執行排程提醒檢查...")
-        check_and_send_reminders(current_app)
+        report = check_and_send_reminders(current_app, shard=shard, shard_count=shard_count)
         
         return jsonify({
             'status': 'success',
             'timestamp': datetime.now().isoformat(),
-            'message': 'Reminders checked successfully'
+            'message': 'Reminders checked successfully',
+            'shard': f"{shard}/{shard_count}" if shard_count and shard_count > 1 else None,
+            'report': {k: v for k, v in report.items() if k != 'failures'} if report else None
         })
         
     except Exception as e:
@@ -41,13 +50,63 @@ def check_reminders_endpoint():
             'error': str(e)
         }), 500
 
+@scheduler_api.route('/api/reminder-dispatch-stats', methods=['GET'])
+def reminder_dispatch_stats():
+    """
+    查詢最近幾天的提醒發送統計（來自 reminder_dispatch_log）
+    """
+    auth_header = request.headers.get('Authorization')
+    expected_token = f"Bearer {os.environ.get('REMINDER_SECRET_TOKEN', 'default-secret')}"
+    if auth_header != expected_token:
+        return jsonify({'error': 'Unauthorized'}), 401
+    
+    try:
+        from app.utils.db import DB
+        import pytz
+        
+        days = max(1, min(request.args.get('days', 7, type=int), 90))
+        today = datetime.now(pytz.timezone('Asia/Taipei')).date()
+        start_date = today - timedelta(days=days - 1)
+        
+        stats = []
+        for row in DB.get_dispatch_stats(start_date, today):
+            stats.append({
+                'date': row['local_date'].isoformat(),
+                'total': int(row['total'] or 0),
+                'sent': int(row['sent'] or 0),
+                'failed': int(row['failed'] or 0),
+                'pending': int(row['pending'] or 0),
+                'avg_send_seconds': float(row['avg_send_seconds']) if row['avg_send_seconds'] is not None else None
+            })
+        
+        return jsonify({
+            'status': 'success',
+            'timestamp': datetime.now().isoformat(),
+            'stats': stats
+        })
+    except Exception as e:
+        current_app.logger.error(f"查詢提醒發送統計失敗: {str(e)}")
+        return jsonify({
+            'status': 'error',
+            'timestamp': datetime.now().isoformat(),
+            'error': str(e)
+        }), 500
+
 @scheduler_api.route('/api/health-detailed', methods=['GET'])
 def health_check_detailed():
     """
     詳細的健康檢查端點，包含資料庫連線狀態
     """
     try:
-        from app.utils.db import get_db_connection
+        from app.utils.db import get_db_connection, get_pool
+        from app.services.webhook_queue import get_webhook_dispatcher
+        from app.services.profile_cache import profile_cache
+        from app.utils.drug_catalog import drug_catalog
+        from app.services.pill_detection import get_pill_detection_orchestrator
+        from app.utils.http_client import get_http_client
+        from app.services.voice_cache import voice_cache
+        from app.services import client_registry
+        dispatcher = get_webhook_dispatcher()
         
         # 檢查資料庫連線
         db_status = 'unknown'
@@ -79,6 +138,14 @@ def health_check_detailed():
             'status': 'healthy',
             'timestamp': datetime.now().isoformat(),
             'database': db_status,
+            'db_pool': get_pool().stats(),
+            'webhook_queue': dispatcher.stats() if dispatcher else None,
+            'profile_cache': profile_cache.stats(),
+            'drug_catalog': drug_catalog.stats(),
+            'pill_detection': get_pill_detection_orchestrator().stats(),
+            'http_hosts': get_http_client().stats(),
+            'voice_cache': voice_cache.stats(),
+            'ai_clients': client_registry.stats(),
             'environment': env_status,
             'is_cloud_run': os.environ.get('K_SERVICE') is not None,
             'version': '1.0.0'
@@ -10,27 +10,12 @@ import concurrent.futures
 from typing import List, Dict, Any, Tuple
 import google.generativeai as genai
 from google.generativeai import types
-import pymysql
-
-def get_all_drugs_from_db(db_config: dict):
-    """從資料庫獲取所有藥物資訊"""
-    try:
-        connection = pymysql.connect(**db_config)
-        with connection.cursor() as cursor:
-            cursor.execute("SELECT drug_id, drug_name_zh, drug_name_en, main_use, side_effects FROM drug_info")
-            return cursor.fetchall()
-    except Exception as e:
-        print(f"資料庫查詢失敗: {e}")
-        return []
-    finally:
-        if 'connection' in locals():
-            connection.close()
+from .client_registry import get_gemini_model
 
 def analyze_prescription_with_ai(image_data: str, api_key: str) -> dict:
     """使用 Gemini AI 分析藥單圖片"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = get_gemini_model("gemini-1.5-flash", api_key)
 
         prompt = """
 你是一個專業的藥單分析助手。請分析以下藥單圖片中的資訊，並以JSON格式回傳結果。
@@ -90,8 +75,7 @@ def analyze_prescription_with_ai(image_data: str, api_key: str) -> dict:
 def match_drugs_with_database(prescription_data: dict, drug_database: list, api_key: str) -> dict:
     """使用 AI 將藥單中的藥物與資料庫進行匹配"""
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = get_gemini_model("gemini-1.5-flash", api_key)
 
         prompt = f"""
 你是一個專業的藥物資料庫匹配助手。請將以下從藥單識別出的藥物資訊與提供的藥物資料庫進行匹配。
@@ -152,6 +136,65 @@ def match_drugs_with_database(prescription_data: dict, drug_database: list, api_
         print(f"AI 匹配失敗: {e}")
         return {"error": f"AI 匹配失敗: {str(e)}"}
 
+def match_medications_locally(analysis_result: dict, api_key: str = None) -> dict:
+    """
+    以本地比對引擎為藥物填入 matched_drug_id 與 confidence_score。
+    信心低於 DRUG_MATCH_ACCEPT_SCORE 的藥物，以前 k 名候選交給 AI 判斷；AI 失敗時保留本地結果。
+    """
+    from .drug_matcher import get_drug_matcher
+    from ..utils.drug_catalog import drug_catalog
+    from config import Config
+
+    accept_score = Config.DRUG_MATCH_ACCEPT_SCORE
+    min_score = Config.DRUG_MATCH_MIN_SCORE
+    top_k = Config.DRUG_MATCH_TOP_K
+
+    started = time.monotonic()
+    matcher = get_drug_matcher(drug_catalog.snapshot())
+    medications = analysis_result.get('medications', [])
+    uncertain = []  # (藥物, 候選清單)
+
+    for med in medications:
+        drug_id, score, reason, candidates = matcher.match(
+            med.get('drug_name_zh'), med.get('drug_name_en'), top_k=top_k
+        )
+        med['matched_drug_id'] = drug_id if score >= min_score else None
+        med['confidence_score'] = score
+        med['match_method'] = f"local:{reason}"
+        if score < accept_score and candidates:
+            uncertain.append((med, candidates))
+
+    print(f"[DrugMatcher] 本地比對 {len(medications)} 種藥物，{len(uncertain)} 種需 AI 確認 "
+          f"({(time.monotonic() - started) * 1000:.1f} ms)")
+
+    if uncertain and api_key:
+        shortlist_ids = []
+        for _, candidates in uncertain:
+            for drug_id, _, _ in candidates:
+                if drug_id not in shortlist_ids:
+                    shortlist_ids.append(drug_id)
+        shortlist = [matcher.drugs[drug_id].to_info_dict() for drug_id in shortlist_ids]
+        prescription_data = {'medications': [
+            {'drug_name_zh': med.get('drug_name_zh'), 'drug_name_en': med.get('drug_name_en'),
+             'main_use': med.get('main_use')}
+            for med, _ in uncertain
+        ]}
+        match_result = match_drugs_with_database(prescription_data, shortlist, api_key)
+        if not match_result.get('error'):
+            matched_medications = match_result.get('matched_medications', [])
+            for (med, _), matched_med in zip(uncertain, matched_medications):
+                drug_id = matched_med.get('matched_drug_id')
+                # 只接受候選清單內的結果，避免 AI 自行編造 drug_id
+                if drug_id in shortlist_ids:
+                    med['matched_drug_id'] = drug_id
+                    med['confidence_score'] = matched_med.get('confidence_score', 0.8)
+                    med['match_method'] = 'llm_shortlist'
+                elif drug_id in (None, 'null'):
+                    med['matched_drug_id'] = None
+                    med['match_method'] = 'llm_shortlist'
+
+    return analysis_result
+
 def parse_text_based_reminder_ultra_fast(text: str) -> dict:
     """
     超快速本地解析用藥提醒，避免API調用
@@ -237,8 +280,7 @@ def parse_text_based_reminder(text: str, api_key: str) -> dict:
         return None
 
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel("gemini-1.5-flash")
+        model = get_gemini_model("gemini-1.5-flash", api_key)
 
         prompt = f"""
 你是一個專業的用藥提醒分析助手。請分析以下文字，提取用藥提醒的相關資訊。
@@ -316,21 +358,9 @@ def run_analysis(image_bytes_list, db_config, api_key):
         if analysis_result.get('error'):
             raise RuntimeError(analysis_result['error'])
         
-        # 獲取藥物資料庫
-        drug_database = get_all_drugs_from_db(db_config)
-        
-        # 進行藥物匹配
+        # 本地比對藥名，只有低信心的藥物才交給 AI（且只提供候選清單）
         if analysis_result.get('medications'):
-            match_result = match_drugs_with_database(analysis_result, drug_database, api_key)
-            
-            if not match_result.get('error'):
-                # 更新藥物資訊
-                matched_medications = match_result.get('matched_medications', [])
-                for i, med in enumerate(analysis_result.get('medications', [])):
-                    if i < len(matched_medications):
-                        matched_med = matched_medications[i]
-                        med['matched_drug_id'] = matched_med.get('matched_drug_id')
-                        med['confidence_score'] = matched_med.get('confidence_score', 0.8)
+            match_medications_locally(analysis_result, api_key)
         
         # 添加統計資訊
         medications = analysis_result.get('medications', [])
@@ -379,22 +409,3 @@ def run_analysis(image_bytes_list, db_config, api_key):
             'error': str(e)
         }
         return error_result, usage_info
-
-# 其他輔助函數
-def _preprocess_voice_text(text: str) -> str:
-    """預處理語音轉文字的常見錯誤"""
-    corrections = {
-        '亮血壓': '量血壓',
-        '記體重': '記體重', 
-        '血壓要': '血壓藥',
-        '血糖要': '血糖藥',
-        '胃要': '胃藥',
-        '西西': 'ml',
-        'CC': 'ml'
-    }
-    
-    corrected = text
-    for wrong, correct in corrections.items():
-        corrected = corrected.replace(wrong, correct)
-    
-    return corrected
\ No newline at end of file
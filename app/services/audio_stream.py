@@ -0,0 +1,173 @@
+# app/services/audio_stream.py
+
+"""
+串流式音檔轉換：把 LINE 下載中的音檔區塊直接送進 ffmpeg，邊下載邊轉成語音辨識用的 LINEAR16。
+
+- 每則語音訊息只啟動一個 ffmpeg 子行程（stdin -> stdout），輸出 s16le / 16 kHz / 單聲道原始 PCM，
+  不經過 pydub 整檔解碼、重新取樣與 WAV 匯出
+- 下載區塊在寫入 ffmpeg 的同時計算快取鍵值（md5），不先累積成 BytesIO
+- 原始區塊只以 list 保留，供 ffmpeg 無法處理（未安裝、moov 在檔尾等）時交給 pydub 備用流程，需要時才合併
+- 轉換逾時（VOICE_FFMPEG_TIMEOUT）會結束子行程
+- 可傳入 on_pcm 回呼，ffmpeg 每輸出一段 PCM 就交給串流語音辨識，辨識與下載、轉換同時進行
+"""
+
+import hashlib
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+
+SAMPLE_RATE = 16000
+CHUNK_SIZE = 16 * 1024
+# 每次交給串流辨識的 PCM 大小（16kHz 16-bit 單聲道約 256ms）
+PCM_CHUNK_SIZE = 8 * 1024
+
+_ffmpeg_path = None
+_ffmpeg_checked = False
+
+
+def get_ffmpeg_path():
+    """回傳 ffmpeg 執行檔路徑；找不到時回傳 None（結果只查詢一次）。"""
+    global _ffmpeg_path, _ffmpeg_checked
+    if not _ffmpeg_checked:
+        from config import Config
+        _ffmpeg_path = shutil.which(Config.FFMPEG_BINARY)
+        _ffmpeg_checked = True
+    return _ffmpeg_path
+
+
+class StreamedAudio:
+    """一則語音訊息的下載與轉換結果。"""
+    __slots__ = ('source_key', 'source_size', 'pcm', 'error', 'transcript', '_chunks', '_source_bytes')
+
+    def __init__(self, source_key, source_size, chunks, pcm=None, error=None):
+        self.source_key = source_key
+        self.source_size = source_size
+        self.pcm = pcm
+        self.error = error
+        self.transcript = None      # 串流辨識的結果（有啟用且成功時）
+        self._chunks = chunks
+        self._source_bytes = None
+
+    @property
+    def source_bytes(self):
+        """原始音檔內容；只在備用流程需要時才合併區塊。"""
+        if self._source_bytes is None:
+            self._source_bytes = b''.join(self._chunks)
+            self._chunks = [self._source_bytes]
+        return self._source_bytes
+
+
+class DownloadError(Exception):
+    pass
+
+
+def stream_to_pcm(chunks, sample_rate=SAMPLE_RATE, timeout=None, on_pcm=None):
+    """
+    將音檔區塊串流送入 ffmpeg 轉為 16-bit PCM。
+
+    Args:
+        chunks: 音檔 bytes 區塊的 iterator（例如 LINE Content.iter_content()）
+        sample_rate: 輸出取樣率
+        timeout: 整體逾時秒數，預設為 Config.VOICE_FFMPEG_TIMEOUT
+        on_pcm: 每讀到一段 PCM（最多 PCM_CHUNK_SIZE bytes）時呼叫，參數為該段 bytes
+
+    Returns:
+        StreamedAudio；ffmpeg 轉換失敗時 pcm 為 None、error 為原因
+
+    Raises:
+        DownloadError: 讀取音檔區塊失敗（下載中斷）
+    """
+    if timeout is None:
+        from config import Config
+        timeout = Config.VOICE_FFMPEG_TIMEOUT
+
+    hasher = hashlib.md5()
+    kept = []
+    size = 0
+
+    ffmpeg = get_ffmpeg_path()
+    if not ffmpeg:
+        try:
+            for chunk in chunks:
+                hasher.update(chunk)
+                kept.append(chunk)
+                size += len(chunk)
+        except Exception as e:
+            raise DownloadError(str(e)) from e
+        return StreamedAudio(hasher.hexdigest(), size, kept, error='ffmpeg_unavailable')
+
+    # stderr 寫入暫存檔，避免錯誤訊息塞滿 pipe 造成 ffmpeg 卡住
+    stderr_file = tempfile.TemporaryFile()
+    process = subprocess.Popen(
+        [ffmpeg, '-hide_banner', '-loglevel', 'error', '-i', 'pipe:0',
+         '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', '-acodec', 'pcm_s16le', 'pipe:1'],
+        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=stderr_file
+    )
+    download_error = []
+
+    def feed():
+        nonlocal size
+        writable = True
+        try:
+            for chunk in chunks:
+                hasher.update(chunk)
+                kept.append(chunk)
+                size += len(chunk)
+                if writable:
+                    try:
+                        process.stdin.write(chunk)
+                    except (BrokenPipeError, OSError):
+                        # ffmpeg 已提前結束；繼續讀完區塊供備用流程使用
+                        writable = False
+        except Exception as e:
+            download_error.append(e)
+            process.kill()
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    timed_out = threading.Event()
+
+    def kill():
+        timed_out.set()
+        process.kill()
+
+    deadline = time.monotonic() + timeout
+    feeder = threading.Thread(target=feed, daemon=True)
+    killer = threading.Timer(timeout, kill)
+    feeder.start()
+    killer.start()
+    try:
+        buffer = bytearray()
+        while True:
+            piece = process.stdout.read1(PCM_CHUNK_SIZE)
+            if not piece:
+                break
+            buffer += piece
+            if on_pcm is not None:
+                on_pcm(piece)
+        pcm = bytes(buffer)
+        returncode = process.wait()
+        # ffmpeg 被結束後寫入端會立即失敗，只剩讀完下載區塊，多給一點寬限時間
+        feeder.join(max(0.0, deadline - time.monotonic()) + 1.0)
+        stderr_file.seek(0)
+        stderr = stderr_file.read()
+    finally:
+        killer.cancel()
+        stderr_file.close()
+
+    if download_error:
+        raise DownloadError(str(download_error[0])) from download_error[0]
+    if feeder.is_alive():
+        raise DownloadError(f"下載音檔逾時（{timeout} 秒）")
+    if timed_out.is_set():
+        return StreamedAudio(hasher.hexdigest(), size, kept, error=f"ffmpeg timeout ({timeout}s)")
+    if returncode != 0 or not pcm:
+        reason = stderr.decode('utf-8', 'replace').strip().splitlines()
+        return StreamedAudio(hasher.hexdigest(), size, kept,
+                             error=f"ffmpeg exit {returncode}: {reason[-1] if reason else 'no output'}")
+    return StreamedAudio(hasher.hexdigest(), size, kept, pcm=pcm)
@@ -0,0 +1,156 @@
+# app/services/client_registry.py
+
+"""
+行程共用的外部 AI 服務 client。
+
+- Speech-to-Text：整個行程只建立一個 SpeechClient（gRPC channel + 憑證探索只做一次），
+  channel 設定 keepalive，閒置時也維持連線；連線狀態以 gRPC connectivity 回呼記錄
+- Gemini：genai.configure 只在 API 金鑰改變時呼叫，GenerativeModel 依模型名稱快取
+- 全部延遲建立且執行緒安全；create_app 可在背景預熱（PREWARM_AI_CLIENTS），
+  讓第一則語音訊息不用負擔建立 client 與 TLS 握手的時間
+- 建立耗時與 channel 狀態可由 /api/health-detailed 查看
+"""
+
+import os
+import threading
+import time
+
+_lock = threading.Lock()
+
+_speech_client = None
+_speech_state = {
+    'created': False,
+    'create_ms': None,
+    'connectivity': None,
+    'keepalive': False,
+    'error': None,
+}
+
+_gemini_api_key = None
+_gemini_models = {}
+_gemini_create_ms = {}
+
+
+def _on_connectivity_change(connectivity):
+    _speech_state['connectivity'] = getattr(connectivity, 'name', str(connectivity))
+
+
+def _build_speech_client():
+    """建立帶 keepalive 的 SpeechClient；自訂 transport 失敗時退回預設建構方式。"""
+    from google.cloud import speech
+    from config import Config
+
+    keepalive_ms = Config.SPEECH_KEEPALIVE_SECONDS * 1000
+    if keepalive_ms > 0:
+        try:
+            from google.cloud.speech_v1.services.speech.transports import SpeechGrpcTransport
+            channel = SpeechGrpcTransport.create_channel(options=[
+                ('grpc.keepalive_time_ms', keepalive_ms),
+                ('grpc.keepalive_timeout_ms', 10000),
+                ('grpc.keepalive_permit_without_calls', 1),
+                ('grpc.http2.max_pings_without_data', 0),
+            ])
+            _speech_state['keepalive'] = True
+            return speech.SpeechClient(transport=SpeechGrpcTransport(channel=channel))
+        except Exception as e:
+            print(f"[ClientRegistry] 無法建立 keepalive channel，改用預設設定: {e}")
+    _speech_state['keepalive'] = False
+    return speech.SpeechClient()
+
+
+def get_speech_client():
+    """取得行程共用的 SpeechClient。"""
+    global _speech_client
+    if _speech_client is None:
+        with _lock:
+            if _speech_client is None:
+                started = time.monotonic()
+                try:
+                    client = _build_speech_client()
+                except Exception as e:
+                    _speech_state['error'] = str(e)
+                    raise
+                _speech_state['create_ms'] = round((time.monotonic() - started) * 1000, 1)
+                _speech_state['created'] = True
+                _speech_state['error'] = None
+                try:
+                    client.transport.grpc_channel.subscribe(_on_connectivity_change, try_to_connect=True)
+                except Exception:
+                    pass
+                _speech_client = client
+    return _speech_client
+
+
+def get_gemini_model(model_name, api_key=None):
+    """
+    取得快取的 GenerativeModel。
+
+    Args:
+        model_name: 模型名稱，例如 'gemini-1.5-flash'
+        api_key: Gemini API 金鑰，預設讀取 GEMINI_API_KEY
+
+    Returns:
+        GenerativeModel；沒有 API 金鑰時返回 None
+    """
+    global _gemini_api_key
+    api_key = api_key or os.environ.get('GEMINI_API_KEY')
+    if not api_key:
+        return None
+    model = _gemini_models.get(model_name) if api_key == _gemini_api_key else None
+    if model is not None:
+        return model
+    with _lock:
+        import google.generativeai as genai
+        if api_key != _gemini_api_key:
+            genai.configure(api_key=api_key)
+            _gemini_api_key = api_key
+            _gemini_models.clear()
+        model = _gemini_models.get(model_name)
+        if model is None:
+            started = time.monotonic()
+            model = genai.GenerativeModel(model_name)
+            _gemini_create_ms[model_name] = round((time.monotonic() - started) * 1000, 1)
+            _gemini_models[model_name] = model
+    return model
+
+
+def warm_up(gemini_models=('gemini-1.5-flash', 'gemini-2.5-flash'), speech_enabled=True, connect_timeout=5):
+    """預先建立 client 並等待 Speech gRPC channel 連線完成；失敗只記錄，不影響啟動。"""
+    started = time.monotonic()
+    if speech_enabled:
+        try:
+            import grpc
+            client = get_speech_client()
+            grpc.channel_ready_future(client.transport.grpc_channel).result(timeout=connect_timeout)
+        except Exception as e:
+            print(f"[ClientRegistry] Speech client 預熱失敗: {e or type(e).__name__}")
+    for model_name in gemini_models:
+        try:
+            get_gemini_model(model_name)
+        except Exception as e:
+            print(f"[ClientRegistry] Gemini 模型 {model_name} 預熱失敗: {e}")
+    print(f"[ClientRegistry] AI client 預熱完成 ({(time.monotonic() - started) * 1000:.0f} ms)")
+
+
+def start_warm_up(app):
+    """在背景執行緒預熱 client，不阻塞 create_app。"""
+    if not app.config.get('PREWARM_AI_CLIENTS', True):
+        return None
+    thread = threading.Thread(
+        target=warm_up,
+        kwargs={'speech_enabled': app.config.get('SPEECH_TO_TEXT_ENABLED', True)},
+        name='ai-client-warmup',
+        daemon=True
+    )
+    thread.start()
+    return thread
+
+
+def stats():
+    return {
+        'speech': dict(_speech_state),
+        'gemini': {
+            'configured': _gemini_api_key is not None,
+            'models': {name: {'create_ms': _gemini_create_ms.get(name)} for name in _gemini_models},
+        },
+    }
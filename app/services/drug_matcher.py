@@ -0,0 +1,195 @@
+# app/services/drug_matcher.py
+
+"""
+本地藥名比對引擎。
+
+取代把整個 drug_info 表塞進 Gemini prompt 的比對方式：
+- 中英文藥名正規化（全半形、大小寫、去除劑量與劑型字樣）
+- 以 trigram 倒排索引產生候選，再以 Dice 係數與編輯距離評分
+- 中文名另建拼音索引（需安裝 pypinyin），同音異字的辨識錯誤也能比對到
+- 低信心的藥物才交給 LLM，且只提供前 k 名候選，而不是整張藥物表
+"""
+
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+try:
+    from pypinyin import lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+# 劑量、劑型等不影響藥物辨識的字樣
+_STRENGTH_RE = re.compile(r'\d+(?:\.\d+)?\s*(?:mg|mcg|μg|ug|g|ml|iu|%|毫克|公克|微克|毫升)(?:/\S+)?', re.IGNORECASE)
+_EN_FORM_RE = re.compile(r'\b(?:f\.?c\.?|film[- ]coated|tablets?|tabs?|capsules?|caps?|injection|syrup|solution|oral)\b', re.IGNORECASE)
+_ZH_FORMS = ('持續性藥效錠', '膜衣錠', '糖衣錠', '腸溶錠', '口溶錠', '發泡錠', '緩釋錠', '舌下錠',
+             '軟膠囊', '膠囊', '內服液', '口服液', '糖漿', '懸液', '注射液', '軟膏', '乳膏', '錠', '片', '粒')
+_KEEP_RE = re.compile(r'[^0-9a-z\u4e00-\u9fff]')
+_CJK_RE = re.compile(r'[\u4e00-\u9fff]')
+
+
+def normalize_drug_name(name):
+    """正規化藥名：NFKC、轉小寫、去除劑量/劑型字樣與符號。"""
+    if not name:
+        return ''
+    text = unicodedata.normalize('NFKC', str(name)).lower()
+    text = _STRENGTH_RE.sub(' ', text)
+    text = _EN_FORM_RE.sub(' ', text)
+    text = _KEEP_RE.sub('', text)
+    for form in _ZH_FORMS:
+        if text.endswith(form) and len(text) > len(form):
+            text = text[:-len(form)]
+            break
+    return text
+
+
+def to_pinyin_key(text):
+    """中文轉為不含聲調的拼音字串；無法轉換時回傳空字串。"""
+    if lazy_pinyin is None or not text or not _CJK_RE.search(text):
+        return ''
+    return ''.join(lazy_pinyin(text))
+
+
+def _trigrams(text):
+    padded = f"^{text}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _edit_distance(a, b):
+    """Levenshtein 距離（兩列動態規劃）。"""
+    if a == b:
+        return 0
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _similarity(query, query_grams, key, key_grams):
+    """綜合 trigram Dice 係數、編輯距離與包含關係的相似度（0~1）。"""
+    if query == key:
+        return 1.0
+    dice = 2 * len(query_grams & key_grams) / (len(query_grams) + len(key_grams))
+    edit = 1 - _edit_distance(query, key) / max(len(query), len(key))
+    score = max(dice, edit)
+    shorter, longer = sorted((query, key), key=len)
+    if len(shorter) >= 2 and shorter in longer:
+        score = max(score, 0.75 + 0.25 * len(shorter) / len(longer))
+    return score
+
+
+class _NameIndex:
+    """正規化名稱的 trigram 倒排索引。"""
+
+    def __init__(self):
+        self.keys = []                      # (正規化名稱, trigram 集合, drug_id)
+        self.exact = {}                     # 正規化名稱 -> drug_id
+        self.postings = defaultdict(list)   # trigram -> keys 索引
+
+    def add(self, key, drug_id):
+        if not key or key in self.exact:
+            return
+        grams = _trigrams(key)
+        position = len(self.keys)
+        self.keys.append((key, grams, drug_id))
+        self.exact[key] = drug_id
+        for gram in grams:
+            self.postings[gram].append(position)
+
+    def search(self, query, limit):
+        """回傳 {drug_id: score}，只對 trigram 重疊最多的 limit 個候選計算完整分數。"""
+        if not query:
+            return {}
+        if query in self.exact:
+            return {self.exact[query]: 1.0}
+        query_grams = _trigrams(query)
+        overlap = defaultdict(int)
+        for gram in query_grams:
+            for position in self.postings.get(gram, ()):
+                overlap[position] += 1
+        shortlist = sorted(overlap, key=overlap.get, reverse=True)[:limit]
+        scores = {}
+        for position in shortlist:
+            key, grams, drug_id = self.keys[position]
+            score = _similarity(query, query_grams, key, grams)
+            if score > scores.get(drug_id, 0):
+                scores[drug_id] = score
+        return scores
+
+
+class DrugMatcher:
+    # 拼音比對只代表發音相同，分數略為折減
+    PHONETIC_WEIGHT = 0.92
+
+    def __init__(self, records, candidate_limit=50):
+        """records 為藥品目錄的 DrugRecord（需有 drug_id / drug_name_zh / drug_name_en 屬性）。"""
+        self.candidate_limit = candidate_limit
+        self.drugs = {}
+        self._names = _NameIndex()
+        self._phonetic = _NameIndex()
+        for record in records:
+            drug_id = record.drug_id
+            if not drug_id:
+                continue
+            self.drugs[drug_id] = record
+            zh_key = normalize_drug_name(record.drug_name_zh)
+            self._names.add(zh_key, drug_id)
+            self._names.add(normalize_drug_name(record.drug_name_en), drug_id)
+            self._phonetic.add(to_pinyin_key(zh_key), drug_id)
+
+    def __len__(self):
+        return len(self.drugs)
+
+    def candidates(self, name_zh=None, name_en=None, top_k=5):
+        """回傳依分數排序的 [(drug_id, score, reason)]，最多 top_k 筆。"""
+        best = {}
+
+        def consider(scores, reason, weight=1.0):
+            for drug_id, score in scores.items():
+                score *= weight
+                if score > best.get(drug_id, (0, None))[0]:
+                    best[drug_id] = (score, reason)
+
+        zh_key = normalize_drug_name(name_zh)
+        en_key = normalize_drug_name(name_en)
+        consider(self._names.search(zh_key, self.candidate_limit), 'name_zh')
+        consider(self._names.search(en_key, self.candidate_limit), 'name_en')
+        pinyin_key = to_pinyin_key(zh_key)
+        if pinyin_key:
+            consider(self._phonetic.search(pinyin_key, self.candidate_limit), 'pinyin', self.PHONETIC_WEIGHT)
+
+        ranked = sorted(best.items(), key=lambda item: item[1][0], reverse=True)[:top_k]
+        return [(drug_id, round(score, 3), reason) for drug_id, (score, reason) in ranked]
+
+    def match(self, name_zh=None, name_en=None, top_k=5):
+        """回傳 (drug_id, confidence_score, reason, candidates)；沒有候選時 drug_id 為 None。"""
+        candidates = self.candidates(name_zh, name_en, top_k)
+        if not candidates:
+            return None, 0.0, 'no_candidate', []
+        drug_id, score, reason = candidates[0]
+        return drug_id, score, reason, candidates
+
+
+_matcher = None
+_matcher_source = None
+_matcher_lock = threading.Lock()
+
+def get_drug_matcher(snapshot):
+    """取得行程共用的 DrugMatcher；藥品目錄快照更換（版本改變）時才重建索引。"""
+    global _matcher, _matcher_source
+    if _matcher is not None and _matcher_source is snapshot:
+        return _matcher
+    with _matcher_lock:
+        if _matcher is None or _matcher_source is not snapshot:
+            started = time.monotonic()
+            _matcher = DrugMatcher(snapshot.records())
+            _matcher_source = snapshot
+            print(f"[DrugMatcher] 已建立 {len(_matcher)} 種藥物的比對索引 ({(time.monotonic() - started) * 1000:.0f} ms)")
+    return _matcher
@@ -4,6 +4,7 @@ import random
 import string
 from ..utils.db import DB
 from .user_service import UserService
+from .profile_cache import profile_cache
 from app import line_bot_api
 from linebot.models import TextSendMessage
 
@@ -58,11 +59,7 @@ class FamilyService:
             UserService.delete_user_simple_state(binder_id)
             return "error", "❌ 綁定失敗：您與此使用者已經綁定過了。"
 
-        try:
-            binder_profile = line_bot_api.get_profile(binder_id)
-            binder_name = binder_profile.display_name
-        except Exception:
-            binder_name = "新家人"
+        binder_name = profile_cache.get_display_name(binder_id, default="新家人")
 
         # 【邏輯強化】使用新的 DB 函式，同步建立綁定關係和成員
         if not DB.add_family_binding(inviter_id, binder_id, binder_name, relation_type):
@@ -75,11 +72,7 @@ class FamilyService:
         UserService.delete_user_simple_state(binder_id)
 
         # 獲取邀請者的姓名
-        try:
-            inviter_profile = line_bot_api.get_profile(inviter_id)
-            inviter_name = inviter_profile.display_name
-        except Exception:
-            inviter_name = "家人"
+        inviter_name = profile_cache.get_display_name(inviter_id, default="家人")
 
         # 使用 PushMessage 通知邀請者
         try:
@@ -9,6 +9,7 @@ from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional
 import google.generativeai as genai
 from flask import current_app
+from .client_registry import get_gemini_model
 
 
 class HealthAnalysisService:
@@ -18,8 +19,7 @@ class HealthAnalysisService:
         """初始化服務"""
         self.api_key = os.environ.get('GEMINI_API_KEY')
         if self.api_key:
-            genai.configure(api_key=self.api_key)
-            self.model = genai.GenerativeModel("gemini-1.5-flash")
+            self.model = get_gemini_model("gemini-1.5-flash", self.api_key)
         else:
             self.model = None
             current_app.logger.warning("未設定 GEMINI_API_KEY，AI 分析功能將無法使用")
@@ -0,0 +1,373 @@
+# app/services/pill_detection.py
+
+"""
+藥丸辨識的多模型調度器。
+
+- 所有模型（YOLO v12/v11、kevin 模型）在行程共用的執行緒池上同時送出
+- 延遲預算：超過 budget 秒仍未完成的模型不再等待，回傳當下已完成的結果
+- 對沖請求（hedging）：主要端點超過 hedge_after 秒未回應時，對備援端點再送一次，取先成功者
+- 每個端點一個斷路器：連續失敗達門檻後暫停呼叫一段時間，死掉的端點不再每次拖 60 秒
+- 辨識結果快取：以（模型, 圖片內容雜湊）為鍵，重傳相同的照片直接回傳先前結果（可設定以 perceptual hash 近似比對）；
+  單一模型算過的結果在多模型模式也會沿用
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+class CircuitBreaker:
+    """closed -> 連續失敗 failure_threshold 次 -> open -> reset_timeout 秒後 half-open（放行一個試探請求）。"""
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=60):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return 'closed'
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self._state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    print(f"[PillDetection] 斷路器開啟: {self.name}（連續失敗 {self._failures} 次）")
+                self._opened_at = time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            return {'state': self._state(), 'consecutive_failures': self._failures}
+
+
+class DetectionResultCache:
+    """
+    LRU + TTL 的辨識結果快取。
+
+    完全相同的照片以內容雜湊（image_digest，jpeg_bytes 的 SHA-256）比對；dhash 只用於近似比對，
+    因為不同藥丸在相似的構圖下（例如同一個素色托盤）可能得到相同的 dhash。
+    max_distance 預設為 0（不做近似比對）；大於 0 時，dhash 的漢明距離在 max_distance 以內視為同一張照片，
+    調高前請確認誤判率。近似比對以分段索引（鴿籠原理：距離 <= d 時 d+1 段中至少一段完全相同）
+    找出候選，不在鎖內掃描全部項目。
+    """
+
+    def __init__(self, max_size=256, ttl=1800, max_distance=0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._bands = max_distance + 1 if max_distance else 0
+        self._band_width = -(-64 // self._bands) if self._bands else 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (model_key, image_digest) -> (result, expires_at, image_hash)
+        self._band_index = {}           # (model_key, 段落編號, 段落值) -> {image_digest}
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _band_keys(self, model_key, image_hash):
+        if not self._bands or image_hash is None:
+            return []
+        mask = (1 << self._band_width) - 1
+        return [(model_key, i, (image_hash >> (i * self._band_width)) & mask) for i in range(self._bands)]
+
+    def _remove(self, key):
+        """刪除項目與其索引（需持有鎖）。"""
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for band_key in self._band_keys(key[0], entry[2]):
+            digests = self._band_index.get(band_key)
+            if digests is not None:
+                digests.discard(key[1])
+                if not digests:
+                    del self._band_index[band_key]
+
+    def _find_near(self, model_key, image_hash, now):
+        """以分段索引找出 dhash 距離在 max_distance 以內且未過期的項目（需持有鎖）。"""
+        candidates = set()
+        for band_key in self._band_keys(model_key, image_hash):
+            candidates.update(self._band_index.get(band_key, ()))
+        for candidate_digest in candidates:
+            key = (model_key, candidate_digest)
+            entry = self._entries.get(key)
+            if (entry is not None and entry[1] > now
+                    and bin(entry[2] ^ image_hash).count('1') <= self.max_distance):
+                return key, entry
+        return None, None
+
+    def get(self, model_key, image_digest, image_hash=None):
+        """回傳結果的複本；未命中時回傳 None。"""
+        now = time.monotonic()
+        with self._lock:
+            key = (model_key, image_digest)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= now:
+                self._remove(key)
+                entry = None
+            near = False
+            if entry is None and self.max_distance and image_hash is not None:
+                key, entry = self._find_near(model_key, image_hash, now)
+                near = entry is not None
+            if entry is None:
+                self.misses += 1
+                return None
+            if near:
+                self.near_hits += 1
+            else:
+                self.hits += 1
+            self._entries.move_to_end(key)
+            return copy.deepcopy(entry[0])
+
+    def put(self, model_key, image_digest, image_hash, result):
+        with self._lock:
+            key = (model_key, image_digest)
+            self._remove(key)
+            self._entries[key] = (copy.deepcopy(result), time.monotonic() + self.ttl, image_hash)
+            for band_key in self._band_keys(model_key, image_hash):
+                self._band_index.setdefault(band_key, set()).add(image_digest)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+            }
+
+
+class DetectionBackend:
+    """一個辨識模型：detect(image) 回傳結果 dict（含 success）；hedge 為選用的備援端點呼叫。"""
+    __slots__ = ('name', 'detect', 'breaker_key', 'hedge', 'hedge_key')
+
+    def __init__(self, name, detect, breaker_key=None, hedge=None, hedge_key=None):
+        self.name = name
+        self.detect = detect
+        self.breaker_key = breaker_key or name
+        self.hedge = hedge
+        self.hedge_key = hedge_key or f"{self.breaker_key}#hedge"
+
+
+class _Attempt:
+    __slots__ = ('backend', 'future', 'breaker', 'is_hedge')
+
+    def __init__(self, backend, future, breaker, is_hedge):
+        self.backend = backend
+        self.future = future
+        self.breaker = breaker
+        self.is_hedge = is_hedge
+
+
+def _is_success(result):
+    return bool(result) and isinstance(result, dict) and result.get('success', True) is not False
+
+
+class PillDetectionOrchestrator:
+    def __init__(self, max_workers=12, budget_seconds=65, hedge_after=None,
+                 failure_threshold=3, reset_timeout=60, cache=None):
+        self.budget_seconds = budget_seconds
+        self.cache = cache
+        self.hedge_after = hedge_after
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='pill-detect')
+        self._breakers = {}
+        self._breakers_lock = threading.Lock()
+
+    def breaker(self, key):
+        with self._breakers_lock:
+            breaker = self._breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key, self.failure_threshold, self.reset_timeout)
+                self._breakers[key] = breaker
+            return breaker
+
+    def _submit(self, backend, func, breaker, is_hedge, image, image_digest, image_hash):
+        future = self._executor.submit(func, image)
+
+        # 即使結果超過預算才回來，也要更新斷路器與結果快取
+        def record(done):
+            try:
+                result = done.result()
+                ok = _is_success(result)
+            except Exception:
+                ok = False
+            (breaker.record_success if ok else breaker.record_failure)()
+            if ok and self.cache is not None and image_digest is not None:
+                self.cache.put(backend.breaker_key, image_digest, image_hash, result)
+
+        future.add_done_callback(record)
+        return _Attempt(backend, future, breaker, is_hedge)
+
+    def detect(self, image, backends, budget_seconds=None, image_digest=None, image_hash=None):
+        """
+        同時呼叫所有 backends，等待全部完成或延遲預算用盡。
+        有 image_digest（內容雜湊）時先查結果快取（image_hash 為 dhash，供近似比對），命中的模型不再呼叫（結果帶 cached=True）。
+        回傳 dict：results（成功結果，依 backends 順序，已設定 model_name）、
+        successful_models、failed_models、timed_out_models、skipped_models、errors、elapsed_time。
+        """
+        started = time.monotonic()
+        budget = self.budget_seconds if budget_seconds is None else budget_seconds
+        deadline = started + budget
+        report = {
+            'results': [], 'successful_models': [], 'failed_models': [],
+            'timed_out_models': [], 'skipped_models': [], 'errors': {}, 'elapsed_time': 0
+        }
+
+        outcomes = {}       # backend.name -> 成功結果
+        failed = set()
+        attempts = []       # 進行中的 _Attempt
+        hedge_due = {}      # backend.name -> 送出對沖請求的時間
+        last_errors = {}
+
+        for backend in backends:
+            if self.cache is not None and image_digest is not None:
+                cached = self.cache.get(backend.breaker_key, image_digest, image_hash)
+                if cached is not None:
+                    cached['model_name'] = backend.name
+                    cached['cached'] = True
+                    outcomes[backend.name] = cached
+                    continue
+            breaker = self.breaker(backend.breaker_key)
+            if breaker.allow():
+                attempts.append(self._submit(backend, backend.detect, breaker, False, image, image_digest, image_hash))
+                if backend.hedge and self.hedge_after is not None:
+                    hedge_due[backend.name] = started + self.hedge_after
+            elif backend.hedge and self.breaker(backend.hedge_key).allow():
+                # 主要端點斷路中，直接改用備援端點
+                attempts.append(self._submit(backend, backend.hedge, self.breaker(backend.hedge_key), True, image, image_digest, image_hash))
+            else:
+                report['skipped_models'].append(backend.name)
+                report['errors'][backend.name] = '端點暫時停用（斷路器開啟）'
+
+        def backend_pending(name):
+            return any(a.backend.name == name for a in attempts)
+
+        while attempts or hedge_due:
+            now = time.monotonic()
+            if now >= deadline:
+                break
+
+            # 主要端點逾時未回應：送出對沖請求
+            for backend in backends:
+                due = hedge_due.get(backend.name)
+                if due is not None and now >= due:
+                    del hedge_due[backend.name]
+                    if backend.name not in outcomes and backend.name not in failed:
+                        hedge_breaker = self.breaker(backend.hedge_key)
+                        if hedge_breaker.allow():
+                            print(f"[PillDetection] {backend.name} 尚未取得結果，送出對沖請求")
+                            attempts.append(self._submit(backend, backend.hedge, hedge_breaker, True, image, image_digest, image_hash))
+                        elif not backend_pending(backend.name):
+                            failed.add(backend.name)
+                            report['errors'][backend.name] = last_errors.get(backend.name, '端點暫時停用（斷路器開啟）')
+
+            next_wake = min([deadline] + list(hedge_due.values()))
+            done, _ = wait([a.future for a in attempts], timeout=max(0, next_wake - time.monotonic()),
+                           return_when=FIRST_COMPLETED)
+            for attempt in [a for a in attempts if a.future in done]:
+                attempts.remove(attempt)
+                name = attempt.backend.name
+                if name in outcomes:
+                    continue
+                try:
+                    result = attempt.future.result()
+                    error = None if _is_success(result) else (result or {}).get('error', '無結果')
+                except Exception as e:
+                    result, error = None, str(e)
+                if error is not None:
+                    last_errors[name] = error
+                if error is None:
+                    result['model_name'] = name
+                    if attempt.is_hedge:
+                        result['hedged'] = True
+                    outcomes[name] = result
+                    hedge_due.pop(name, None)
+                elif not backend_pending(name) and name not in hedge_due:
+                    failed.add(name)
+                    report['errors'][name] = error
+
+            # 尚有對沖請求可送的模型，主要請求失敗時立即送出
+            for name in list(hedge_due):
+                if name not in outcomes and not backend_pending(name):
+                    hedge_due[name] = time.monotonic()
+
+        for backend in backends:
+            name = backend.name
+            if name in outcomes:
+                report['results'].append(outcomes[name])
+                report['successful_models'].append(name)
+            elif name in failed:
+                report['failed_models'].append(name)
+            elif name not in report['skipped_models']:
+                report['timed_out_models'].append(name)
+                report['errors'].setdefault(name, f"超過 {budget:g} 秒未完成")
+
+        report['elapsed_time'] = round(time.monotonic() - started, 2)
+        return report
+
+    def stats(self):
+        with self._breakers_lock:
+            breakers = {key: breaker.stats() for key, breaker in self._breakers.items()}
+        return {'breakers': breakers, 'result_cache': self.cache.stats() if self.cache is not None else None}
+
+
+_orchestrator = None
+_orchestrator_lock = threading.Lock()
+
+def get_pill_detection_orchestrator():
+    """取得行程共用的 PillDetectionOrchestrator。"""
+    global _orchestrator
+    if _orchestrator is None:
+        with _orchestrator_lock:
+            if _orchestrator is None:
+                from config import Config
+                hedge_after = Config.PILL_DETECT_HEDGE_AFTER
+                _orchestrator = PillDetectionOrchestrator(
+                    max_workers=Config.PILL_DETECT_WORKERS,
+                    budget_seconds=Config.PILL_DETECT_BUDGET_SECONDS,
+                    hedge_after=float(hedge_after) if hedge_after else None,
+                    failure_threshold=Config.PILL_DETECT_BREAKER_THRESHOLD,
+                    reset_timeout=Config.PILL_DETECT_BREAKER_RESET_SECONDS,
+                    cache=DetectionResultCache(
+                        max_size=Config.PILL_RESULT_CACHE_SIZE,
+                        ttl=Config.PILL_RESULT_CACHE_TTL,
+                        max_distance=Config.PILL_RESULT_CACHE_MAX_DISTANCE
+                    ) if Config.PILL_RESULT_CACHE_SIZE > 0 else None
+                )
+    return _orchestrator
@@ -1,16 +1,48 @@
 # --- 請用此版本【完整覆蓋】您的 app/services/prescription_service.py ---
 
 import base64
+import threading
+import time
 import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from ..utils.db import DB
 from .user_service import UserService
 from . import ai_processor
 from ..utils.helpers import convert_minguo_to_gregorian
+from ..utils.blob_store import get_blob_store
+from ..utils.drug_catalog import drug_catalog
+from ..utils.http_client import get_http_client
 from flask import current_app
+from config import Config
 # 移除不再需要的 line_bot_api 和 flex 導入
 # from app import line_bot_api
 # from ..utils.flex import prescription as flex_prescription
 
+_ocr_executor = None
+_ocr_executor_lock = threading.Lock()
+
+def _get_ocr_executor():
+    """多圖 OCR 共用的執行緒池，大小為 OCR_MAX_PARALLEL。"""
+    global _ocr_executor
+    if _ocr_executor is None:
+        with _ocr_executor_lock:
+            if _ocr_executor is None:
+                _ocr_executor = ThreadPoolExecutor(
+                    max_workers=max(1, Config.OCR_MAX_PARALLEL),
+                    thread_name_prefix='ocr'
+                )
+    return _ocr_executor
+
+OCR_API_BASE_URL = "https://gpu-test-543976352117.us-central1.run.app"
+
+def _retry_after_seconds(response):
+    """解析 Retry-After 標頭（秒數）；沒有或無法解析時回傳 None。"""
+    value = response.headers.get('Retry-After')
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
 class PrescriptionService:
     """處理藥單分析與藥歷相關的業務邏輯"""
 
@@ -26,12 +58,21 @@ class PrescriptionService:
         if not last_task_info or last_task_info.get("task_id") != task_id:
             raise ValueError("找不到對應的分析任務，請重新操作。")
         
+        # 新流程只在狀態中保存圖片雜湊；image_bytes_list (base64) 為舊版狀態的相容格式
+        image_refs = last_task_info.get("image_refs", [])
         image_b64_list = last_task_info.get("image_bytes_list", [])
-        if not image_b64_list:
+        if not image_refs and not image_b64_list:
             raise ValueError("分析任務中缺少圖片資料，請重新操作。")
         
+        if image_refs:
+            store = get_blob_store()
+            image_bytes_list = [store.get(key) for key in image_refs]
+            if any(data is None for data in image_bytes_list):
+                raise ValueError("藥單圖片已過期或遺失，請重新上傳。")
+        
         try:
-            image_bytes_list = [base64.b64decode(b64_str) for b64_str in image_b64_list]
+            if not image_refs:
+                image_bytes_list = [base64.b64decode(b64_str) for b64_str in image_b64_list]
             
             api_key = current_app.config['GEMINI_API_KEY']
             db_config = {
@@ -106,83 +147,163 @@ class PrescriptionService:
             traceback.print_exc()
     
     @staticmethod
-    def call_ocr_api_multiple(image_bytes_list, user_id=None, member_name=None):
-        """調用組員的 OCR API 進行多圖快速識別"""
-        print(f"[OCR API Multi] 開始處理 {len(image_bytes_list)} 張圖片")
-        
+    def _run_ocr_multiple(ocr_func, image_bytes_list, user_id, member_name, tag, max_parallel):
+        """
+        並行處理多張藥單圖片並依圖片順序合併結果。
+        回傳 (combined_result, stats)；stats 含每張圖片的執行時間與失敗的圖片編號。
+        """
+        total = len(image_bytes_list)
+        image_timeout = Config.OCR_IMAGE_TIMEOUT
+        max_parallel = max(1, min(max_parallel, total))
+        print(f"[{tag}] 開始處理 {total} 張圖片（並行上限 {max_parallel}）")
+
+        started_at = {}  # 圖片索引 -> 實際開始執行的時間（由 worker 執行緒設定）
+
+        def run(image_bytes, index=None):
+            started = time.monotonic()
+            if index is not None:
+                started_at[index] = started
+            try:
+                result, usage_info = ocr_func(image_bytes, user_id, member_name)
+            except Exception as e:
+                result, usage_info = None, {"error": str(e)}
+            return result, usage_info, time.monotonic() - started
+
+        outcomes = [None] * total
+        if max_parallel == 1:
+            for i, image_bytes in enumerate(image_bytes_list):
+                outcomes[i] = run(image_bytes)
+        else:
+            # 同時最多 max_parallel 張。執行緒池為行程共用，送出後可能要排隊：
+            # - 已開始執行的圖片，自開始起 image_timeout 秒內未完成即視為逾時
+            # - 送出後 image_timeout 秒仍未開始的圖片取消，記為未執行，而不是逾時
+            # future.cancel() 只能取消尚未開始的工作；逾時的呼叫仍會在背景執行完，結果直接捨棄
+            executor = _get_ocr_executor()
+            pending = {}  # future -> (圖片索引, 排隊截止時間)
+            next_index = 0
+
+            def deadline_of(index, queue_deadline):
+                started = started_at.get(index)
+                return queue_deadline if started is None else started + image_timeout
+
+            while next_index < total or pending:
+                while next_index < total and len(pending) < max_parallel:
+                    future = executor.submit(run, image_bytes_list[next_index], next_index)
+                    pending[future] = (next_index, time.monotonic() + image_timeout)
+                    next_index += 1
+
+                nearest = min(deadline_of(index, queue_deadline) for index, queue_deadline in pending.values())
+                done, _ = wait(pending, timeout=max(0, nearest - time.monotonic()), return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, _ = pending.pop(future)
+                    outcomes[index] = future.result()
+
+                now = time.monotonic()
+                for future, (index, queue_deadline) in list(pending.items()):
+                    started = started_at.get(index)
+                    if started is None:
+                        if queue_deadline <= now and future.cancel():
+                            pending.pop(future)
+                            outcomes[index] = (None, {"error": f"等待 {image_timeout:g} 秒仍未開始執行", "not_started": True}, 0.0)
+                    elif started + image_timeout <= now:
+                        pending.pop(future)
+                        outcomes[index] = (None, {"error": f"超過 {image_timeout:g} 秒未完成"}, image_timeout)
+
         all_medications = []
         combined_result = {
             "clinic_name": None,
-            "doctor_name": None, 
+            "doctor_name": None,
             "visit_date": None,
             "days_supply": None,
             "medications": []
         }
-        
-        total_execution_time = 0
-        
-        for i, image_bytes in enumerate(image_bytes_list):
-            print(f"[OCR API Multi] 處理第 {i+1}/{len(image_bytes_list)} 張圖片")
-            
-            result, usage_info = PrescriptionService.call_ocr_api(
-                image_bytes, user_id, member_name
-            )
-            
+        failed_images = []
+        not_started_images = []
+        image_times = []
+
+        # 依圖片順序合併，維持「使用第一張圖片的資訊，或更新為非空值」的規則
+        for i, (result, usage_info, elapsed) in enumerate(outcomes):
+            image_times.append(round(elapsed, 2))
             if result and isinstance(result, dict):
-                # 合併全域資訊（使用第一張圖片的資訊，或更新為非空值）
-                if i == 0 or not combined_result["clinic_name"]:
-                    combined_result["clinic_name"] = result.get("clinic_name")
-                if i == 0 or not combined_result["doctor_name"]:
-                    combined_result["doctor_name"] = result.get("doctor_name")
-                if i == 0 or not combined_result["visit_date"]:
-                    combined_result["visit_date"] = result.get("visit_date")
-                if i == 0 or not combined_result["days_supply"]:
-                    combined_result["days_supply"] = result.get("days_supply")
-                
+                for field in ("clinic_name", "doctor_name", "visit_date", "days_supply"):
+                    if i == 0 or not combined_result[field]:
+                        combined_result[field] = result.get(field)
+
                 # 合併藥物列表
-                medications = result.get("medications", [])
-                for med in medications:
+                for med in result.get("medications", []):
                     med["source_image"] = i + 1  # 標記來源圖片
                     all_medications.append(med)
-                
-                # 累計執行時間
-                if usage_info and "execution_time" in usage_info:
-                    total_execution_time += usage_info["execution_time"]
             else:
-                print(f"[OCR API Multi] 第 {i+1} 張圖片處理失敗")
-        
+                error = usage_info.get("error") if isinstance(usage_info, dict) else None
+                print(f"[{tag}] 第 {i+1} 張圖片處理失敗: {error}")
+                failed_images.append(i + 1)
+                if isinstance(usage_info, dict) and usage_info.get("not_started"):
+                    not_started_images.append(i + 1)
+
         combined_result["medications"] = all_medications
         combined_result["successful_match_count"] = len([med for med in all_medications if med.get('matched_drug_id')])
-        
-        # 建立合併的使用統計
-        combined_usage_info = {
-            "model": "ocr_api_multiple",
-            "version": "api_ocr_multi",
-            "execution_time": total_execution_time,
-            "images_processed": len(image_bytes_list),
-            "total_medications": len(all_medications),
-            "api_calls_used": len(image_bytes_list),
+
+        print(f"[{tag}] 完成處理，共識別 {len(all_medications)} 種藥物")
+        return combined_result, {
+            "image_times": image_times,
+            "summed_execution_time": round(sum(image_times), 2),
+            "failed_images": failed_images,
+            "not_started_images": not_started_images,
+            "max_parallel": max_parallel,
+        }
+
+    @staticmethod
+    def _build_multi_usage_info(model, version, image_count, combined_result, stats, started):
+        """建立多圖處理的使用統計：execution_time 為實際經過時間，summed_execution_time 為各圖片時間總和。"""
+        failed = len(stats["failed_images"])
+        if failed == 0:
+            api_status = "success"
+        elif failed < image_count:
+            api_status = "partial"
+        else:
+            api_status = "failed"
+        return {
+            "model": model,
+            "version": version,
+            "execution_time": round(time.monotonic() - started, 2),
+            "summed_execution_time": stats["summed_execution_time"],
+            "image_times": stats["image_times"],
+            "images_processed": image_count - failed,
+            "failed_images": stats["failed_images"],
+            "not_started_images": stats["not_started_images"],
+            "total_medications": len(combined_result["medications"]),
+            "api_calls_used": image_count,
             "total_tokens": 0,
             "token_savings": "100%",
-            "api_status": "success",
-            "processing_mode": "sequential_multi_image"
+            "api_status": api_status,
+            "max_parallel": stats["max_parallel"],
+            "processing_mode": "parallel_multi_image" if stats["max_parallel"] > 1 else "sequential_multi_image"
         }
-        
-        print(f"[OCR API Multi] 完成處理，共識別 {len(all_medications)} 種藥物")
+
+    @staticmethod
+    def call_ocr_api_multiple(image_bytes_list, user_id=None, member_name=None):
+        """調用組員的 OCR API 進行多圖快速識別"""
+        started = time.monotonic()
+        # 非同步結果以 line_user_id 輪詢，並行數由 OCR_API_MAX_PARALLEL 控制（預設 1）
+        combined_result, stats = PrescriptionService._run_ocr_multiple(
+            PrescriptionService.call_ocr_api, image_bytes_list, user_id, member_name,
+            "OCR API Multi", Config.OCR_API_MAX_PARALLEL
+        )
+        combined_usage_info = PrescriptionService._build_multi_usage_info(
+            "ocr_api_multiple", "api_ocr_multi", len(image_bytes_list), combined_result, stats, started
+        )
         return combined_result, combined_usage_info
 
     @staticmethod
     def call_ocr_api(image_bytes, user_id=None, member_name=None):
         """調用組員的 OCR API 進行快速識別"""
         import requests
-        import json
         
         try:
             # 組員的 OCR API 端點（正確的路徑）
-            api_url = "https://gpu-test-543976352117.us-central1.run.app/api/v1/analyze?photo="
+            api_url = f"{OCR_API_BASE_URL}/api/v1/analyze?photo="
             
-            print(f"[OCR API] 開始調用 API: {api_url}")
-            print(f"[OCR API] 用戶ID: {user_id}, 成員: {member_name}")
+            print(f"[OCR API] 開始調用 API，用戶ID: {user_id}, 成員: {member_name}")
             
             # 準備請求資料（正確的欄位名稱和格式）
             files = {
@@ -194,10 +315,8 @@ class PrescriptionService:
                 'member': member_name or '本人'
             }
             
-            print(f"[OCR API] 發送資料: {data}")
-            
-            # 發送請求
-            response = requests.post(
+            started = time.monotonic()
+            response = get_http_client().post(
                 api_url,
                 files=files,
                 data=data,
@@ -210,30 +329,24 @@ class PrescriptionService:
                 if response.status_code == 200:
                     # 同步回應，直接處理結果
                     api_result = response.json()
-                    print(f"[OCR API] 同步獲得結果")
                 elif response.status_code == 202:
-                    # 異步處理，需要輪詢結果
-                    print(f"[OCR API] 異步處理，開始輪詢結果...")
-                    print(f"[DEBUG] POST回應內容: {response.text}")
-                    print(f"[DEBUG] POST回應headers: {dict(response.headers)}")
-                    
-                    # 等待一段時間再開始輪詢，給組員系統處理時間
-                    import time
-                    print(f"[DEBUG] 等待10秒讓組員系統處理...")
-                    time.sleep(10)
-                    
-                    api_result = PrescriptionService.poll_ocr_result(user_id)
+                    # 異步處理：不再固定等待 10 秒，直接以退避間隔輪詢
+                    api_result = PrescriptionService.poll_ocr_result(
+                        user_id,
+                        result_url=PrescriptionService._ocr_result_url_from_response(response),
+                        retry_after=_retry_after_seconds(response)
+                    )
                     if not api_result:
                         return None, {"error": "輪詢結果超時或失敗"}
                 
                 # 轉換 API 結果為統一格式
                 analysis_result = PrescriptionService.convert_api_result_to_standard_format(api_result)
                 
-                # 建立使用統計
+                # 建立使用統計（execution_time 含輪詢等待時間）
                 usage_info = {
                     "model": "ocr_api",
                     "version": "api_ocr",
-                    "execution_time": response.elapsed.total_seconds(),
+                    "execution_time": round(time.monotonic() - started, 2),
                     "api_response_time": response.elapsed.total_seconds(),
                     "total_tokens": 0,  # API 不消耗 TOKEN
                     "token_savings": "100%",  # API 不消耗 TOKEN
@@ -245,7 +358,7 @@ class PrescriptionService:
                 
             else:
                 print(f"[OCR API] API 調用失敗: {response.status_code}")
-                print(f"[OCR API] 回應內容: {response.text}")
+                print(f"[OCR API] 回應內容: {response.text[:500]}")
                 return None, {"error": f"API 調用失敗: {response.status_code}"}
                 
         except requests.exceptions.Timeout:
@@ -256,143 +369,99 @@ class PrescriptionService:
             return None, {"error": f"API 調用錯誤: {str(e)}"}
     
     @staticmethod
-    def poll_ocr_result(user_id, max_retries=20, polling_interval=10):
-        """輪詢組員OCR API獲取異步處理結果"""
+    def _ocr_result_url_from_response(response):
+        """若 202 回應提供了結果位置（Location 標頭或 JSON 中的 result_url），優先使用。"""
+        location = response.headers.get('Location')
+        if not location:
+            try:
+                body = response.json()
+                location = body.get('result_url') if isinstance(body, dict) else None
+            except ValueError:
+                location = None
+        if location and location.startswith('/'):
+            location = OCR_API_BASE_URL + location
+        return location
+
+    @staticmethod
+    def poll_ocr_result(user_id, result_url=None, retry_after=None, deadline_seconds=None,
+                        initial_interval=0.5, max_interval=5.0, backoff_factor=1.6):
+        """
+        輪詢組員OCR API獲取異步處理結果。
+        間隔從 initial_interval 起以 backoff_factor 倍數增加至 max_interval，
+        伺服器回傳 Retry-After 時以其為準；超過 deadline_seconds 即放棄。
+        """
         import requests
-        import time
         
         # 輪詢端點
-        result_url = f"https://gpu-test-543976352117.us-central1.run.app/api/v1/result/{user_id}"
+        result_url = result_url or f"{OCR_API_BASE_URL}/api/v1/result/{user_id}"
+        if deadline_seconds is None:
+            deadline_seconds = Config.OCR_POLL_DEADLINE
         
-        print(f"[OCR API] 開始輪詢結果 - URL: {result_url}")
-        print(f"[OCR API] 最大重試次數: {max_retries}, 間隔: {polling_interval}秒")
-        print(f"[DEBUG] 輪詢用的user_id: '{user_id}'")
-        print(f"[DEBUG] 輪詢用的user_id長度: {len(user_id) if user_id else 0}")
+        client = get_http_client()
+        started = time.monotonic()
+        deadline = started + deadline_seconds
+        interval = initial_interval
+        attempts = 0
+        last_status = None
         
-        for i in range(max_retries):
+        # 提交後的第一次輪詢只在伺服器要求時才等待
+        if retry_after:
+            time.sleep(min(retry_after, max(0, deadline - time.monotonic())))
+        
+        while time.monotonic() < deadline:
+            attempts += 1
+            remaining = deadline - time.monotonic()
             try:
-                print(f"[OCR API] 輪詢第 {i+1}/{max_retries} 次...")
-                print(f"[DEBUG] 完整輪詢URL: {result_url}")
-                
-                response = requests.get(result_url, timeout=10)
-                
-                print(f"[DEBUG] 輪詢回應狀態: {response.status_code}")
-                print(f"[DEBUG] 輪詢回應headers: {dict(response.headers)}")
-                print(f"[DEBUG] 輪詢回應內容: {response.text}")
+                response = client.get(result_url, timeout=min(10, max(1, remaining)))
                 
                 if response.status_code == 200:
-                    try:
-                        result = response.json()
-                        print(f"[DEBUG] 結果JSON結構: {list(result.keys()) if isinstance(result, dict) else type(result)}")
-                        print(f"[OCR API] 結果預覽: {str(result)[:200]}...")
-                        
-                        # 檢查JSON中的status字段
-                        if result.get("status") == "completed":
-                            print(f"[OCR API] 輪詢成功獲得完成結果")
-                            return result.get("data")  # 返回data部分
-                        elif result.get("status") == "error":
-                            print(f"[OCR API] 組員API處理失敗: {result.get('message', '未知錯誤')}")
-                            return None
-                        elif result.get("status") == "processing":
-                            print(f"[OCR API] 任務仍在處理中，繼續等待...")
-                        else:
-                            print(f"[OCR API] 收到未知狀態: {result.get('status')}")
-                            print(f"[DEBUG] 完整回應: {result}")
-                        # 如果不是completed，繼續輪詢
-                    except Exception as json_error:
-                        print(f"[DEBUG] JSON解析錯誤: {json_error}")
-                        print(f"[DEBUG] 原始回應: {response.text}")
-                    
-                elif response.status_code == 404:
-                    print(f"[OCR API] 結果尚未準備好 (404)，繼續等待...")
+                    result = response.json()
+                    status = result.get("status")
+                    if status == "completed":
+                        print(f"[OCR API] 輪詢取得結果（第 {attempts} 次，{time.monotonic() - started:.1f} 秒）")
+                        return result.get("data")  # 返回data部分
+                    if status == "error":
+                        print(f"[OCR API] 組員API處理失敗: {result.get('message', '未知錯誤')}")
+                        return None
+                    if status != "processing" and status != last_status:
+                        print(f"[OCR API] 收到未知狀態: {status}")
+                    last_status = status
                     
-                elif response.status_code == 202:
-                    print(f"[OCR API] 任務仍在處理中 (202)，繼續等待...")
+                elif response.status_code in (202, 404):
+                    # 任務仍在處理中 / 結果尚未準備好
+                    pass
                     
                 else:
-                    print(f"[OCR API] 輪詢收到意外狀態碼: {response.status_code}")
-                    print(f"[OCR API] 回應內容: {response.text}")
+                    if response.status_code != last_status:
+                        print(f"[OCR API] 輪詢收到意外狀態碼: {response.status_code}")
+                    last_status = response.status_code
                 
-                # 等待下次輪詢
-                if i < max_retries - 1:  # 最後一次不需要等待
-                    print(f"[OCR API] 等待 {polling_interval} 秒後重試...")
-                    time.sleep(polling_interval)
+                wait_for = _retry_after_seconds(response) or interval
                     
             except requests.exceptions.Timeout:
-                print(f"[OCR API] 輪詢第 {i+1} 次超時")
-                
+                print(f"[OCR API] 輪詢第 {attempts} 次超時")
+                wait_for = interval
             except Exception as e:
-                print(f"[OCR API] 輪詢第 {i+1} 次發生錯誤: {e}")
-                import traceback
-                traceback.print_exc()
+                print(f"[OCR API] 輪詢第 {attempts} 次發生錯誤: {e}")
+                wait_for = interval
+            
+            interval = min(max_interval, interval * backoff_factor)
+            time.sleep(max(0, min(wait_for, deadline - time.monotonic())))
         
-        print(f"[OCR API] 輪詢超時，已重試 {max_retries} 次")
+        print(f"[OCR API] 輪詢超時（{deadline_seconds:g} 秒，共 {attempts} 次）")
         return None
     
     @staticmethod
     def call_fastapi_ocr_multiple(image_bytes_list, user_id=None, member_name=None):
-        """調用組員B的 FastAPI OCR 進行多圖快速識別"""
-        print(f"[FastAPI OCR Multi] 開始處理 {len(image_bytes_list)} 張圖片")
-        
-        all_medications = []
-        combined_result = {
-            "clinic_name": None,
-            "doctor_name": None, 
-            "visit_date": None,
-            "days_supply": None,
-            "medications": []
-        }
-        
-        total_execution_time = 0
-        
-        for i, image_bytes in enumerate(image_bytes_list):
-            print(f"[FastAPI OCR Multi] 處理第 {i+1}/{len(image_bytes_list)} 張圖片")
-            
-            result, usage_info = PrescriptionService.call_fastapi_ocr(
-                image_bytes, user_id, member_name
-            )
-            
-            if result and isinstance(result, dict):
-                # 合併全域資訊（使用第一張圖片的資訊，或更新為非空值）
-                if i == 0 or not combined_result["clinic_name"]:
-                    combined_result["clinic_name"] = result.get("clinic_name")
-                if i == 0 or not combined_result["doctor_name"]:
-                    combined_result["doctor_name"] = result.get("doctor_name")
-                if i == 0 or not combined_result["visit_date"]:
-                    combined_result["visit_date"] = result.get("visit_date")
-                if i == 0 or not combined_result["days_supply"]:
-                    combined_result["days_supply"] = result.get("days_supply")
-                
-                # 合併藥物列表
-                medications = result.get("medications", [])
-                for med in medications:
-                    med["source_image"] = i + 1  # 標記來源圖片
-                    all_medications.append(med)
-                
-                # 累計執行時間
-                if usage_info and "execution_time" in usage_info:
-                    total_execution_time += usage_info["execution_time"]
-            else:
-                print(f"[FastAPI OCR Multi] 第 {i+1} 張圖片處理失敗")
-        
-        combined_result["medications"] = all_medications
-        combined_result["successful_match_count"] = len([med for med in all_medications if med.get('matched_drug_id')])
-        
-        # 建立合併的使用統計
-        combined_usage_info = {
-            "model": "fastapi_ocr_multiple",
-            "version": "fastapi_ocr_multi",
-            "execution_time": total_execution_time,
-            "images_processed": len(image_bytes_list),
-            "total_medications": len(all_medications),
-            "api_calls_used": len(image_bytes_list),
-            "total_tokens": 0,
-            "token_savings": "100%",
-            "api_status": "success",
-            "processing_mode": "sequential_multi_image"
-        }
-        
-        print(f"[FastAPI OCR Multi] 完成處理，共識別 {len(all_medications)} 種藥物")
+        """調用組員B的 FastAPI OCR 進行多圖快速識別（並行）"""
+        started = time.monotonic()
+        combined_result, stats = PrescriptionService._run_ocr_multiple(
+            PrescriptionService.call_fastapi_ocr, image_bytes_list, user_id, member_name,
+            "FastAPI OCR Multi", Config.OCR_MAX_PARALLEL
+        )
+        combined_usage_info = PrescriptionService._build_multi_usage_info(
+            "fastapi_ocr_multiple", "fastapi_ocr_multi", len(image_bytes_list), combined_result, stats, started
+        )
         return combined_result, combined_usage_info
 
     @staticmethod
@@ -428,7 +497,7 @@ class PrescriptionService:
             print(f"[DEBUG] FastAPI完整請求資料: files={list(files.keys())}, data={data}")
             
             # 發送請求（FastAPI是同步處理，直接返回結果）
-            response = requests.post(
+            response = get_http_client().post(
                 api_url,
                 files=files,
                 data=data,
@@ -595,16 +664,16 @@ class PrescriptionService:
         if not record:
             return None
         
-        all_drugs_info = {d['drug_id']: d for d in DB.get_all_drug_info()}
+        drugs_by_id = drug_catalog.snapshot().by_id
         
         for med in record.get("medications", []):
             if not isinstance(med, dict): continue
             matched_id = med.get('matched_drug_id')
-            drug_info = all_drugs_info.get(matched_id)
+            drug_info = drugs_by_id.get(matched_id)
             
             if drug_info:
-                if not med.get('main_use'): med['main_use'] = drug_info.get('main_use')
-                if not med.get('side_effects'): med['side_effects'] = drug_info.get('side_effects')
+                if not med.get('main_use'): med['main_use'] = drug_info.main_use
+                if not med.get('side_effects'): med['side_effects'] = drug_info.side_effects
         
         return record
 
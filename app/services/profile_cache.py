@@ -0,0 +1,143 @@
+# app/services/profile_cache.py
+
+"""
+LINE 使用者 Profile 快取（LRU + TTL）。
+
+- 成功取得的顯示名稱快取 PROFILE_CACHE_TTL 秒
+- 使用者封鎖 Bot 或不存在（LINE 回傳 404）時做負向快取，PROFILE_CACHE_NEGATIVE_TTL 秒內不再查詢
+- 同一使用者同時有多個事件時只發出一次請求（single-flight），其餘等待結果
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from linebot.exceptions import LineBotApiError
+
+from config import Config
+
+_MISSING = object()
+
+
+class _Flight:
+    __slots__ = ('event', 'result')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+
+
+class ProfileCache:
+    def __init__(self, max_size=1000, ttl=3600, negative_ttl=300, fetch_timeout=10):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.fetch_timeout = fetch_timeout
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # user_id -> (display_name 或 None, expires_at)
+        self._inflight = {}             # user_id -> _Flight
+
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        self.fetch_errors = 0
+
+    def _lookup(self, user_id):
+        """查詢快取（需持有鎖）；未命中或已過期時回傳 _MISSING。"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return _MISSING
+        name, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[user_id]
+            return _MISSING
+        self._entries.move_to_end(user_id)
+        return name
+
+    def _store(self, user_id, name, ttl):
+        with self._lock:
+            self._entries[user_id] = (name, time.monotonic() + ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def _fetch(self, user_id):
+        """向 LINE 取得顯示名稱，並依結果寫入正向或負向快取。"""
+        from app import line_bot_api
+        try:
+            profile = line_bot_api.get_profile(user_id)
+            name = profile.display_name if profile else None
+            self._store(user_id, name, self.ttl if name else self.negative_ttl)
+            return name
+        except LineBotApiError as e:
+            if e.status_code == 404:
+                # 使用者已封鎖或不存在
+                self._store(user_id, None, self.negative_ttl)
+            else:
+                with self._lock:
+                    self.fetch_errors += 1
+                print(f"取得 LINE Profile 失敗 ({user_id}): {e.status_code}")
+            return None
+        except Exception as e:
+            with self._lock:
+                self.fetch_errors += 1
+            print(f"取得 LINE Profile 失敗 ({user_id}): {e}")
+            return None
+
+    def get_display_name(self, user_id, default=None):
+        """取得使用者顯示名稱；查無資料時回傳 default。"""
+        with self._lock:
+            name = self._lookup(user_id)
+            if name is not _MISSING:
+                if name is None:
+                    self.negative_hits += 1
+                else:
+                    self.hits += 1
+                return name if name is not None else default
+
+            self.misses += 1
+            flight = self._inflight.get(user_id)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[user_id] = flight
+
+        if not leader:
+            flight.event.wait(self.fetch_timeout)
+            return flight.result if flight.result is not None else default
+
+        try:
+            flight.result = self._fetch(user_id)
+        finally:
+            with self._lock:
+                self._inflight.pop(user_id, None)
+            flight.event.set()
+        return flight.result if flight.result is not None else default
+
+    def refresh(self, user_id, default=None):
+        """捨棄既有快取並重新向 LINE 取得（例如使用者重新加入好友時）。"""
+        self.invalidate(user_id)
+        return self.get_display_name(user_id, default)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'fetch_errors': self.fetch_errors,
+            }
+
+
+profile_cache = ProfileCache(
+    max_size=Config.PROFILE_CACHE_SIZE,
+    ttl=Config.PROFILE_CACHE_TTL,
+    negative_ttl=Config.PROFILE_CACHE_NEGATIVE_TTL
+)
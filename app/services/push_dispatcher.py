@@ -0,0 +1,168 @@
+# app/services/push_dispatcher.py
+
+"""
+LINE 推播的並行發送引擎（供排程器每分鐘的提醒使用）。
+
+- 共用的有界 ThreadPoolExecutor 並行發送
+- Token bucket 限制每秒請求數，避免超過 LINE Messaging API 的速率上限
+- 遇到 429 / 5xx / 網路錯誤時以帶抖動的指數退避重試；每個工作帶固定的
+  X-Line-Retry-Key，重試不會造成重複推播（LINE 回 409 視為已送達）
+- 每個 tick 產生發送報告：sent / failed / late（超過期限才送出）
+"""
+
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import requests
+from linebot.exceptions import LineBotApiError
+
+
+class TokenBucket:
+    """執行緒安全的 token bucket 速率限制器。"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """取得一個 token，不足時阻塞等待。"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_for = (1 - self._tokens) / self.rate
+            time.sleep(wait_for)
+
+
+class PushJob:
+    """一次推播請求：收件者（單一 user_id 走 push，列表走 multicast）、訊息列表與來源提醒。"""
+    __slots__ = ('to', 'messages', 'kind', 'reminder_ids', 'meta', 'retry_key')
+
+    def __init__(self, to, messages, kind='reminder', reminder_ids=None, meta=None):
+        self.to = to
+        self.messages = messages if isinstance(messages, list) else [messages]
+        self.kind = kind
+        self.reminder_ids = reminder_ids or []
+        self.meta = meta or {}
+        self.retry_key = str(uuid.uuid4())
+
+    @property
+    def recipient_count(self):
+        return len(self.to) if isinstance(self.to, list) else 1
+
+
+class PushDispatcher:
+    def __init__(self, max_workers=8, rate_per_sec=100, burst=None,
+                 max_attempts=4, backoff_base=0.5, backoff_max=8.0):
+        self.max_workers = max_workers
+        self.bucket = TokenBucket(rate_per_sec, burst)
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='line-push')
+
+    @staticmethod
+    def _is_retryable(e):
+        if isinstance(e, LineBotApiError):
+            return e.status_code == 429 or e.status_code >= 500
+        return isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+    def _backoff_delay(self, attempt, e):
+        # 優先遵守伺服器的 Retry-After
+        headers = getattr(e, 'headers', None) or {}
+        retry_after = headers.get('Retry-After') or headers.get('retry-after')
+        if retry_after:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        # Full jitter: 0 ~ min(max, base * 2^attempt)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def _send(self, api, job):
+        if isinstance(job.to, list):
+            api.multicast(job.to, job.messages, retry_key=job.retry_key)
+        else:
+            api.push_message(job.to, job.messages, retry_key=job.retry_key)
+
+    def _run_job(self, api, job):
+        """發送單一工作，回傳 (status, attempts, error)。"""
+        attempt = 0
+        while True:
+            attempt += 1
+            self.bucket.acquire()
+            try:
+                self._send(api, job)
+                return 'sent', attempt, None
+            except Exception as e:
+                if isinstance(e, LineBotApiError) and e.status_code == 409:
+                    # 同一個 retry key 已被 LINE 接受，代表先前的請求其實已送達
+                    return 'sent', attempt, None
+                if attempt >= self.max_attempts or not self._is_retryable(e):
+                    status = getattr(e, 'status_code', None)
+                    return 'failed', attempt, f"{status}: {e}" if status else str(e)
+                time.sleep(self._backoff_delay(attempt, e))
+
+    def dispatch(self, api, jobs, deadline_seconds=55):
+        """
+        並行發送所有工作並等待完成。
+        deadline_seconds 之後才完成的工作會被計為 late（仍會送出）。
+        """
+        started = time.monotonic()
+        deadline = started + deadline_seconds
+        report = {
+            'total': len(jobs), 'recipients': sum(job.recipient_count for job in jobs), 'sent': 0, 'failed': 0, 'late': 0,
+            'retries': 0, 'elapsed_ms': 0, 'failures': []
+        }
+        if not jobs:
+            return report
+
+        def run(job):
+            status, attempts, error = self._run_job(api, job)
+            return job, status, attempts, error, time.monotonic()
+
+        futures = [self._executor.submit(run, job) for job in jobs]
+        wait(futures)
+
+        for future in futures:
+            job, status, attempts, error, finished_at = future.result()
+            report['retries'] += max(0, attempts - 1)
+            if status == 'sent':
+                report['sent'] += 1
+                if finished_at > deadline:
+                    report['late'] += 1
+            else:
+                report['failed'] += 1
+                report['failures'].append({
+                    'to': job.to, 'kind': job.kind,
+                    'reminder_ids': job.reminder_ids, 'meta': job.meta, 'error': error
+                })
+        report['elapsed_ms'] = round((time.monotonic() - started) * 1000, 1)
+        return report
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+def get_push_dispatcher(app):
+    """取得行程共用的 PushDispatcher（設定與 PUSH_TICK_DEADLINE_SECONDS 同樣讀取 app.config）。"""
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = PushDispatcher(
+                    max_workers=app.config.get('PUSH_MAX_WORKERS', 8),
+                    rate_per_sec=app.config.get('PUSH_RATE_PER_SEC', 100),
+                    max_attempts=app.config.get('PUSH_MAX_ATTEMPTS', 4)
+                )
+    return _dispatcher
@@ -1,13 +1,12 @@
 # app/services/reminder_service.py
 
-import schedule
-import time
 import traceback
-from datetime import datetime
+from datetime import datetime, timedelta
 from flask import current_app
 from ..utils.db import DB
 from app import line_bot_api
 from linebot.models import TextSendMessage
+from .push_dispatcher import PushJob, get_push_dispatcher
 
 class ReminderService:
     """處理用藥提醒的建立、查詢、刪除與排程發送"""
@@ -347,8 +346,58 @@ class ReminderService:
 
 # --- 背景排程器相關函式 ---
 
-def check_and_send_reminders(app):
-    """使用 app_context 並呼叫 send_reminder_logic"""
+def _minute_of_day(value):
+    """將 time_slot 欄位（TIME 會以 timedelta 回傳）轉成一天中的第幾分鐘。"""
+    if value is None:
+        return None
+    if hasattr(value, 'total_seconds'):
+        return int(value.total_seconds()) // 60 % 1440
+    if hasattr(value, 'hour'):
+        return value.hour * 60 + value.minute
+    try:
+        parts = str(value).split(':')
+        return int(parts[0]) * 60 + int(parts[1])
+    except (ValueError, IndexError):
+        return None
+
+def _slot_for_minute(reminder_data: dict, minute_of_day: int):
+    """找出提醒是第幾個時段在這一分鐘到期（同一分鐘多個時段時取第一個）。"""
+    for i in range(1, 6):
+        if _minute_of_day(reminder_data.get(f'time_slot_{i}')) == minute_of_day:
+            return i
+    return 0
+
+def _collect_due_minutes(now_minute, catchup_minutes, has_due=None, shard_key='all'):
+    """
+    回傳本次要處理的分鐘：目前這一分鐘，加上補發視窗內尚未處理過的分鐘。
+    has_due(minute_of_day) 可排除確定沒有提醒的分鐘（本地計時器提供）。
+    該分片尚無任何 tick 紀錄（首次部署，無法得知哪些分鐘已推播過）或查詢失敗時不補發。
+    """
+    window_start = now_minute - timedelta(minutes=catchup_minutes)
+    processed = DB.get_processed_dispatch_ticks(window_start, now_minute, shard_key)
+    if processed is None:
+        catchup_minutes = 0
+    minutes = []
+    for offset in range(catchup_minutes, -1, -1):
+        minute = now_minute - timedelta(minutes=offset)
+        if has_due and not has_due(minute.hour * 60 + minute.minute):
+            continue
+        if minute == now_minute or minute not in processed:
+            minutes.append(minute)
+    return minutes
+
+def check_and_send_reminders(app, has_due=None, shard=None, shard_count=None):
+    """
+    使用 app_context 查詢到期提醒，並透過 PushDispatcher 並行發送。
+    每筆提醒先寫入發送紀錄（INSERT IGNORE）再發送，重複觸發同一分鐘不會重複推播；
+    停機後會補發 REMINDER_CATCHUP_MINUTES 分鐘內漏掉的提醒。
+    有提醒發送失敗的分鐘不會標記為已處理，補發視窗內下一次執行會重新認領並重送失敗的提醒。
+    發送紀錄無法寫入時本次不發送，也不標記分鐘，交給下一次執行補發，避免之後重複推播。
+    指定 shard / shard_count 時只處理 recorder_id 雜湊落在該分片的提醒。
+    """
+    sharded = bool(shard_count and shard_count > 1)
+    shard_key = f"{shard}/{shard_count}" if sharded else 'all'
+    log_prefix = f"[分片 {shard_key}]" if sharded else ""
     with app.app_context():
         try:
             from app import line_bot_api as bot_api
@@ -358,9 +407,10 @@ def check_and_send_reminders(app):
             taipei_tz = pytz.timezone('Asia/Taipei')
             current_time_taipei = datetime.now(taipei_tz)
             current_time_str = current_time_taipei.strftime("%H:%M")
+            now_minute = current_time_taipei.replace(second=0, microsecond=0, tzinfo=None)
             
             # 添加更詳細的日誌
-            print(f"[{current_time_str}] 開始檢查提醒（台北時間）...")
+            print(f"[{current_time_str}]{log_prefix} 開始檢查提醒（台北時間）...")
             print(f"UTC時間: {datetime.utcnow().strftime('%H:%M')}")
             
             # 檢查 bot_api 是否正確初始化
@@ -368,16 +418,93 @@ def check_and_send_reminders(app):
                 print(f"[{current_time_str}] 錯誤：line_bot_api 未正確初始化")
                 return
             
-            reminders = DB.get_reminders_for_scheduler(current_time_str)
-            print(f"[{current_time_str}] 找到 {len(reminders)} 筆到期提醒")
+            use_ledger = DB.ensure_dispatch_ledger_tables()
+            if use_ledger:
+                minutes = _collect_due_minutes(now_minute, app.config.get('REMINDER_CATCHUP_MINUTES', 5), has_due, shard_key)
+            elif has_due and not has_due(now_minute.hour * 60 + now_minute.minute):
+                minutes = []
+            else:
+                minutes = [now_minute]
+            catchup = [m.strftime('%H:%M') for m in minutes if m != now_minute]
+            if catchup:
+                print(f"[{current_time_str}] 補發漏掉的分鐘: {catchup}")
+            
+            # 查詢每一分鐘的到期提醒，並一次認領
+            due_by_minute = []
+            for minute in minutes:
+                if sharded:
+                    rows = DB.get_reminders_for_scheduler(minute.strftime("%H:%M"), shard, shard_count)
+                else:
+                    rows = DB.get_reminders_for_scheduler(minute.strftime("%H:%M"))
+                due_by_minute.append((minute, rows))
+            
+            claim_id = None
+            if use_ledger:
+                keys = []
+                for minute, rows in due_by_minute:
+                    minute_of_day = minute.hour * 60 + minute.minute
+                    for r in rows:
+                        keys.append((r['id'], _slot_for_minute(r, minute_of_day), minute.date(), minute_of_day))
+                claim_id, claimed = DB.claim_reminder_dispatches(keys)
+                if claimed is None:
+                    print(f"[{current_time_str}]{log_prefix} 無法寫入發送紀錄，本次不發送，下次執行時補發")
+                    return None
+                if len(claimed) < len(keys):
+                    print(f"[{current_time_str}] 略過 {len(keys) - len(claimed)} 筆已處理過的提醒")
+                due_by_minute = [
+                    (minute, [
+                        r for r in rows
+                        if (r['id'], _slot_for_minute(r, minute.hour * 60 + minute.minute),
+                            minute.date(), minute.hour * 60 + minute.minute) in claimed
+                    ])
+                    for minute, rows in due_by_minute
+                ]
             
-            if reminders:
-                app.logger.info(f"[{current_time_str}] 找到 {len(reminders)} 筆到期提醒，準備發送...")
-                for i, r in enumerate(reminders, 1):
-                    print(f"[{current_time_str}] 處理第 {i} 筆提醒...")
-                    send_reminder_logic(r, current_time_str, bot_api)
+            reminder_count = sum(len(rows) for _, rows in due_by_minute)
+            print(f"[{current_time_str}] 找到 {reminder_count} 筆到期提醒")
+            
+            report = None
+            if reminder_count:
+                app.logger.info(f"[{current_time_str}] 找到 {reminder_count} 筆到期提醒，準備發送...")
+                jobs = []
+                for minute, rows in due_by_minute:
+                    minute_jobs = build_reminder_push_jobs(rows, minute.strftime("%H:%M"))
+                    for job in minute_jobs:
+                        job.meta = {'local_date': minute.date(), 'minute_of_day': minute.hour * 60 + minute.minute}
+                    jobs.extend(minute_jobs)
+                
+                report = get_push_dispatcher(app).dispatch(
+                    bot_api, jobs,
+                    deadline_seconds=app.config.get('PUSH_TICK_DEADLINE_SECONDS', 55)
+                )
+                summary = (f"[{current_time_str}]{log_prefix} 提醒發送完成：{reminder_count} 筆提醒合併為 {report['total']} 個請求"
+                           f"（{report['recipients']} 位收件者），成功 {report['sent']}，"
+                           f"失敗 {report['failed']}，逾時送達 {report['late']}，重試 {report['retries']} 次，"
+                           f"耗時 {report['elapsed_ms']}ms")
+                print(summary)
+                app.logger.info(summary)
+                for failure in report['failures']:
+                    print(f"    - ❌ 發送 [{failure['kind']}] 給 {failure['to']} 失敗: {failure['error']}")
+                
+                if claim_id:
+                    failed = {}
+                    for failure in report['failures']:
+                        meta = failure['meta']
+                        for rid in failure['reminder_ids']:
+                            failed[(rid, meta.get('local_date'), meta.get('minute_of_day'))] = failure['error']
+                    DB.finish_reminder_dispatches(claim_id, failed)
             else:
                 print(f"[{current_time_str}] 沒有到期的提醒")
+            
+            if use_ledger:
+                failed_minutes = set()
+                if report:
+                    for failure in report['failures']:
+                        meta = failure['meta']
+                        failed_minutes.add((meta.get('local_date'), meta.get('minute_of_day')))
+                DB.mark_dispatch_ticks_processed(
+                    [m for m in minutes if (m.date(), m.hour * 60 + m.minute) not in failed_minutes], shard_key)
+            return report
                 
         except Exception as e:
             error_msg = f"排程器執行時發生錯誤： {str(e)}"
@@ -385,50 +512,105 @@ def check_and_send_reminders(app):
             app.logger.error(error_msg)
             traceback.print_exc()
 
-def send_reminder_logic(reminder_data: dict, current_time_str: str, bot_api=None):
+# LINE 限制：單一請求最多 5 則訊息，multicast 最多 500 位收件者
+MAX_MESSAGES_PER_REQUEST = 5
+MAX_MULTICAST_RECIPIENTS = 500
+
+def _reminder_targets(reminder_data: dict):
     """
-    發送提醒的核心邏輯。
+    決定一筆提醒要通知誰：回傳 [(收件者, 類型, 成員名稱, 藥品名稱)]。
     採用更嚴謹的判斷，確保只通知設定者與被設定者。
     """
-    api = bot_api or line_bot_api
-    if api is None:
-        print(f"    - 錯誤：line_bot_api 未正確初始化")
-        return
-    
-    # 調試資訊
-    print(f"    - 調試：reminder_data keys: {list(reminder_data.keys())}")
-    print(f"    - 調試：recorder_id: '{reminder_data.get('recorder_id')}'")
-    print(f"    - 調試：bound_recipient_line_id: '{reminder_data.get('bound_recipient_line_id')}')")
-    
     recorder_id = reminder_data.get('recorder_id')
     member_name = reminder_data.get('member')
-    drug_name = reminder_data.get('drug_name', '未命名藥品')
+    drug_name = reminder_data.get('drug_name') or '未命名藥品'
     recipient_line_id = reminder_data.get('bound_recipient_line_id')
 
-    party_msg_text = f"⏰ 用藥提醒！\n\nHi {member_name}，該吃藥囉！\n藥品：{drug_name}\n時間：{current_time_str}"
-    creator_msg_text = f"🔔 您為「{member_name}」設定的提醒已發送。\n藥品：{drug_name}\n時間：{current_time_str}"
-    
     # 情況一: 有綁定關係的家人提醒 (且不是幫自己設)
     if recipient_line_id and recipient_line_id != recorder_id:
-        print(f"  -> 雙向通知: 設定者[{recorder_id[:6]}..] -> 家人[{recipient_line_id[:6]}..] ({member_name})")
-        try:
-            api.push_message(recipient_line_id, TextSendMessage(text=party_msg_text))
-            print(f"    - ✅ 成功發送 [家人提醒] 給 {recipient_line_id}")
-        except Exception as e:
-            print(f"    - ❌ 發送 [家人提醒] 給 {recipient_line_id} 失敗: {e}")
-        try:
-            api.push_message(recorder_id, TextSendMessage(text=creator_msg_text))
-            print(f"    - ✅ 成功發送 [備忘提醒] 給 {recorder_id}")
-        except Exception as e:
-            print(f"    - ❌ 發送 [備忘提醒] 給 {recorder_id} 失敗: {e}")
+        return [
+            (recipient_line_id, '家人提醒', member_name, drug_name),
+            (recorder_id, '備忘提醒', member_name, drug_name),
+        ]
     # 情況二: 幫自己設定的提醒，或幫一個未綁定的本地 Profile 設定
-    else:
-        print(f"  -> 單向通知: 設定者[{recorder_id[:6]}..] -> 自己 ({member_name})")
+    return [(recorder_id, '個人提醒', member_name, drug_name)]
+
+def _format_reminder_text(kind: str, member_name: str, drug_names: list, current_time_str: str):
+    drugs_text = "、".join(drug_names)
+    if kind == '備忘提醒':
+        return f"🔔 您為「{member_name}」設定的提醒已發送。\n藥品：{drugs_text}\n時間：{current_time_str}"
+    return f"⏰ 用藥提醒！\n\nHi {member_name}，該吃藥囉！\n藥品：{drugs_text}\n時間：{current_time_str}"
+
+def build_reminder_push_jobs(reminders: list, current_time_str: str):
+    """
+    將同一分鐘到期的提醒組成最少的推播請求：
+    1. 同一收件者、同一成員、同類型的多種藥品合併為一則訊息
+    2. 同一收件者的多則訊息合併為一個請求（每個請求最多 5 則）
+    3. 訊息內容完全相同的收件者改用 multicast（每個請求最多 500 人）
+    """
+    # 1. 依 (收件者, 類型, 成員) 合併藥品
+    coalesced = {}
+    for r in reminders:
+        for to, kind, member_name, drug_name in _reminder_targets(r):
+            if not to:
+                continue
+            entry = coalesced.setdefault((to, kind, member_name), {'drugs': [], 'reminder_ids': []})
+            if drug_name not in entry['drugs']:
+                entry['drugs'].append(drug_name)
+            entry['reminder_ids'].append(r.get('id'))
+
+    # 2. 依收件者整理訊息，每 5 則切成一份 payload
+    per_recipient = {}
+    for (to, kind, member_name), entry in coalesced.items():
+        item = per_recipient.setdefault(to, {'texts': [], 'kinds': [], 'reminder_ids': []})
+        item['texts'].append(_format_reminder_text(kind, member_name, entry['drugs'], current_time_str))
+        item['kinds'].append(kind)
+        item['reminder_ids'].append(entry['reminder_ids'])   # 與 texts 一一對應
+
+    # 3. 內容相同的 payload 合併收件者
+    by_payload = {}
+    for to, item in per_recipient.items():
+        for i in range(0, len(item['texts']), MAX_MESSAGES_PER_REQUEST):
+            payload = tuple(item['texts'][i:i + MAX_MESSAGES_PER_REQUEST])
+            group = by_payload.setdefault(payload, {'recipients': [], 'kinds': set(), 'reminder_ids': []})
+            group['recipients'].append(to)
+            group['kinds'].update(item['kinds'][i:i + MAX_MESSAGES_PER_REQUEST])
+            # 與 recipients 一一對應：此收件者這份 payload 涵蓋的提醒
+            group['reminder_ids'].append(
+                [rid for ids in item['reminder_ids'][i:i + MAX_MESSAGES_PER_REQUEST] for rid in ids])
+
+    jobs = []
+    for payload, group in by_payload.items():
+        kind = '、'.join(sorted(group['kinds']))
+        recipients = group['recipients']
+        for i in range(0, len(recipients), MAX_MULTICAST_RECIPIENTS):
+            chunk = recipients[i:i + MAX_MULTICAST_RECIPIENTS]
+            to = chunk[0] if len(chunk) == 1 else chunk
+            # 只帶這一批收件者的提醒，某一批失敗不會把其他已送達批次的提醒標記為失敗
+            reminder_ids = sorted({rid for ids in group['reminder_ids'][i:i + MAX_MULTICAST_RECIPIENTS]
+                                   for rid in ids if rid is not None})
+            jobs.append(PushJob(to, [TextSendMessage(text=t) for t in payload], kind=kind, reminder_ids=reminder_ids))
+    return jobs
+
+def send_reminder_logic(reminder_data: dict, current_time_str: str, bot_api=None):
+    """
+    逐筆發送單一提醒（測試端點使用；排程器走 check_and_send_reminders 的並行發送）。
+    """
+    api = bot_api or line_bot_api
+    if api is None:
+        print(f"    - 錯誤：line_bot_api 未正確初始化")
+        return
+    
+    recorder_id = reminder_data.get('recorder_id')
+    for job in build_reminder_push_jobs([reminder_data], current_time_str):
         try:
-            api.push_message(recorder_id, TextSendMessage(text=party_msg_text))
-            print(f"    - ✅ 成功發送 [個人提醒] 給 {recorder_id}")
+            if isinstance(job.to, list):
+                api.multicast(job.to, job.messages)
+            else:
+                api.push_message(job.to, job.messages)
+            print(f"    - ✅ 成功發送 [{job.kind}] 給 {job.to}")
         except Exception as e:
-            print(f"    - ❌ 發送 [個人提醒] 給 {recorder_id} 失敗: {e}")
+            print(f"    - ❌ 發送 [{job.kind}] 給 {job.to} 失敗: {e}")
             # 詳細錯誤資訊
             if hasattr(e, 'status_code'):
                 print(f"      狀態碼: {e.status_code}")
@@ -445,17 +627,14 @@ def send_reminder_logic(reminder_data: dict, current_time_str: str, bot_api=None
                 print(f"      ⚠️  可能的問題: user_id 格式不正確 '{recorder_id}'")
 
 def run_scheduler(app):
-    """啟動背景排程的函式"""
-    print("背景排程器已啟動，每分鐘檢查一次。")
-    print(f"當前時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    
-    # 添加更詳細的日誌
-    schedule.every().minute.at(":00").do(check_and_send_reminders, app=app)
+    """
+    啟動本地背景排程：由記憶體內的 ReminderTimer 在有提醒到期的分鐘準時喚醒，
+    沒有提醒的分鐘不會查詢資料庫。
+    """
+    from .reminder_timer import ReminderTimer
     
-    # 立即執行一次檢查（用於測試）
-    print("執行初始提醒檢查...")
-    check_and_send_reminders(app)
+    print("背景排程器已啟動（記憶體計時器，僅在提醒到期時喚醒）。")
+    print(f"當前時間: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
\ No newline at end of file
+    timer = ReminderTimer(app, lambda has_due: check_and_send_reminders(app, has_due=has_due))
+    timer.run()
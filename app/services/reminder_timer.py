@@ -0,0 +1,170 @@
+# app/services/reminder_timer.py
+
+"""
+本地背景排程器使用的記憶體內提醒計時器。
+
+啟動時從 medicine_schedule 一次載入所有提醒時段，建立「一天中的第幾分鐘 -> 提醒 id」索引，
+並以 min-heap 保存每個有提醒的分鐘的下一次觸發時間。執行緒只在最近一次到期時間醒來，
+沒有提醒的分鐘不會查詢資料庫。
+
+提醒的新增/修改/刪除會透過 DB 的變更通知標記為 dirty，由計時器執行緒重新載入該提醒的時段。
+"""
+
+import heapq
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+
+import pytz
+
+from ..utils.db import DB, add_schedule_change_listener
+
+TAIPEI_TZ = pytz.timezone('Asia/Taipei')
+
+
+class ReminderTimer:
+    def __init__(self, app, on_due):
+        """
+        on_due(has_due) 在有提醒到期的分鐘被呼叫；has_due(minute_of_day) 可用來判斷某分鐘是否有提醒。
+        """
+        self.app = app
+        self.on_due = on_due
+
+        self._cond = threading.Condition()
+        self._minutes = {}        # minute_of_day -> set(schedule_id)
+        self._by_schedule = {}    # schedule_id -> set(minute_of_day)
+        self._heap = []           # (觸發時間 epoch 秒, minute_of_day)
+        self._in_heap = set()     # 已在 heap 中的 minute_of_day
+        self._dirty = set()
+        self._full_reload = True
+
+    # --- 變更通知 ---
+    def notify_changed(self, schedule_ids=None):
+        """DB 變更通知的 listener；實際重新載入交給計時器執行緒處理。"""
+        with self._cond:
+            if schedule_ids is None:
+                self._full_reload = True
+            else:
+                self._dirty.update(schedule_ids)
+            self._cond.notify()
+
+    def has_minute(self, minute_of_day):
+        with self._cond:
+            return bool(self._minutes.get(minute_of_day))
+
+    # --- 索引維護（需持有鎖） ---
+    @staticmethod
+    def _next_fire_at(minute_of_day, now_ts):
+        """回傳 minute_of_day 在 now_ts 之後的下一次觸發時間（epoch 秒）。"""
+        now_local = datetime.fromtimestamp(now_ts, TAIPEI_TZ)
+        midnight = now_local.replace(hour=0, minute=0, second=0, microsecond=0)
+        fire_at = midnight + timedelta(minutes=minute_of_day)
+        if fire_at.timestamp() <= now_ts:
+            fire_at += timedelta(days=1)
+        return fire_at.timestamp()
+
+    def _schedule_minute(self, minute_of_day, now_ts):
+        if minute_of_day in self._in_heap:
+            return
+        heapq.heappush(self._heap, (self._next_fire_at(minute_of_day, now_ts), minute_of_day))
+        self._in_heap.add(minute_of_day)
+
+    def _set_schedule_minutes(self, schedule_id, minutes, now_ts):
+        for minute in self._by_schedule.pop(schedule_id, set()):
+            ids = self._minutes.get(minute)
+            if ids:
+                ids.discard(schedule_id)
+                if not ids:
+                    del self._minutes[minute]
+        if minutes:
+            self._by_schedule[schedule_id] = set(minutes)
+            for minute in minutes:
+                self._minutes.setdefault(minute, set()).add(schedule_id)
+                self._schedule_minute(minute, now_ts)
+
+    def _reload(self):
+        """處理待重新載入的提醒（在計時器執行緒、不持有鎖時呼叫）。"""
+        with self._cond:
+            full = self._full_reload
+            dirty = set(self._dirty)
+            self._full_reload = False
+            self._dirty.clear()
+        if not full and not dirty:
+            return
+
+        with self.app.app_context():
+            rows = DB.get_reminder_slot_minutes(None if full else sorted(dirty))
+        if rows is None:
+            # 資料庫暫時無法連線，稍後再試
+            with self._cond:
+                self._full_reload = self._full_reload or full
+                self._dirty.update(dirty)
+            raise RuntimeError("無法從資料庫載入提醒時段")
+
+        grouped = {}
+        for schedule_id, minute in rows:
+            if minute is not None:
+                grouped.setdefault(schedule_id, set()).add(minute)
+
+        now_ts = time.time()
+        with self._cond:
+            if full:
+                self._minutes.clear()
+                self._by_schedule.clear()
+                self._heap.clear()
+                self._in_heap.clear()
+                targets = grouped.keys()
+            else:
+                targets = dirty
+            for schedule_id in targets:
+                self._set_schedule_minutes(schedule_id, grouped.get(schedule_id), now_ts)
+        if full:
+            print(f"提醒計時器已載入 {len(grouped)} 筆提醒，共 {len(self._minutes)} 個觸發分鐘")
+
+    # --- 主迴圈 ---
+    def _wait_for_next_due(self):
+        """阻塞直到下一個有提醒的分鐘到來；有變更通知時提早返回 False。"""
+        with self._cond:
+            while True:
+                if self._full_reload or self._dirty:
+                    return False
+                # 丟棄已沒有提醒的分鐘
+                while self._heap and not self._minutes.get(self._heap[0][1]):
+                    _, minute = heapq.heappop(self._heap)
+                    self._in_heap.discard(minute)
+                if not self._heap:
+                    self._cond.wait()
+                    continue
+                fire_at, minute = self._heap[0]
+                delay = fire_at - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+                heapq.heappop(self._heap)
+                self._in_heap.discard(minute)
+                self._schedule_minute(minute, fire_at + 1)
+                return True
+
+    def run(self):
+        add_schedule_change_listener(self.notify_changed)
+        loaded = False
+        while True:
+            try:
+                self._reload()
+            except Exception as e:
+                print(f"提醒計時器載入失敗，30 秒後重試: {e}")
+                time.sleep(30)
+                continue
+            if not loaded:
+                # 首次載入完成後，先補發停機期間漏掉的提醒
+                loaded = True
+                self._safe_call_due()
+            if self._wait_for_next_due():
+                self._safe_call_due()
+
+    def _safe_call_due(self):
+        try:
+            self.on_due(self.has_minute)
+        except Exception:
+            traceback.print_exc()
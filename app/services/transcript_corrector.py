@@ -0,0 +1,261 @@
+# app/services/transcript_corrector.py
+
+"""
+語音轉文字結果的本地校正引擎，取代逐一 str.replace 與「含有『藥』『點』就送 Gemini」的判斷。
+
+- 常見辨識錯誤以字典樹（trie）一次掃描、最長匹配取代，取代後的文字不會再被其他規則改寫
+- 容量單位 cc / CC / 西西 只在數字後面才改寫為 ml，英文藥名中的 cc（例如 succinate）不受影響
+- 中文數字轉阿拉伯數字：十二、二十五、一百零五、兩點半、三點十五分；
+  只轉換後面接時間或劑量單位的數字，「一起」「十分」「一天三次」等詞不受影響
+- 藥名以藥品目錄的 DrugMatcher（trigram + 拼音）校正，同音異字也能修正為目錄中的正式名稱
+- 依校正結果計算信心分數，低於 VOICE_AI_ENHANCE_THRESHOLD 才需要交給 Gemini
+"""
+
+import re
+
+from config import Config
+
+# 語音辨識常見錯誤 -> 正確用語
+DEFAULT_CORRECTIONS = {
+    '亮血壓': '量血壓',
+    '血壓要': '血壓藥',
+    '血糖要': '血糖藥',
+    '胃要': '胃藥',
+    '血唐': '血糖',
+    '血鴨': '血壓',
+    '用要提醒': '用藥提醒',
+    '吃要提醒': '吃藥提醒',
+    '題醒': '提醒',
+    '提行': '提醒',
+    '藥丹': '藥單',
+    '藥蛋': '藥單',
+    '掃瞄': '掃描',
+    '邦定': '綁定',
+    '幫定': '綁定',
+    '飯候': '飯後',
+    '睡錢': '睡前',
+}
+
+_DIGITS = {'零': 0, '〇': 0, '一': 1, '二': 2, '兩': 2, '三': 3, '四': 4,
+           '五': 5, '六': 6, '七': 7, '八': 8, '九': 9}
+_UNITS = {'十': 10, '百': 100, '千': 1000}
+_NUMERAL = '[零〇一二兩三四五六七八九十百千]+'
+
+# 只轉換後面接這些單位的中文數字（「次」「天」保留中文，提醒解析以「一天一次」「三次」判斷頻率）
+# 「一點點」「一點兒」是份量而非時間，不轉換
+_QUANTITY_RE = re.compile(
+    rf'({_NUMERAL})(?=點(?![點兒])|顆|粒|錠|片|包|匙|滴|毫克|公克|毫升|mg|ml|cc|CC|西西|公斤|度|歲|小時|個小時|號|月|週|周)')
+_MINUTE_RE = re.compile(rf'(?<=\d點)({_NUMERAL})(?=分)')
+_VOLUME_UNIT_RE = re.compile(r'(?<=\d)\s*(?:cc|CC|西西)(?![A-Za-z])')
+
+# 可能是藥名的片段：中文名 + 劑型，或英文藥名
+_ZH_DRUG_RE = re.compile(r'([\u4e00-\u9fff]{1,8}?)(膜衣錠|持續性藥效錠|錠|膠囊|糖漿|口服液|藥水|藥膏)')
+_EN_DRUG_RE = re.compile(r'[A-Za-z][A-Za-z\-]{3,}')
+# 常見的藥物類別說法，不需要對應到目錄中的單一藥品
+_GENERIC_DRUGS = ('血壓藥', '血糖藥', '胃藥', '感冒藥', '止痛藥', '維他命', '鈣片', '血脂藥', '心臟藥',
+                  '安眠藥', '藥單', '藥品', '藥物', '吃藥', '用藥')
+
+# 常用指令與用語；完全由這些組成的短句不需要 AI
+_KNOWN_PHRASES = ('選單', '主選單', '藥單辨識', '藥品辨識', '用藥提醒', '健康紀錄', '家人綁定',
+                  '查詢本人', '查詢家人', '新增提醒', '設定提醒', '我的提醒', '這是什麼藥')
+
+
+def chinese_to_int(text):
+    """將中文數字轉為整數，例如 十二 -> 12、二十五 -> 25、一百零五 -> 105、一五 -> 15；無法解析時回傳 None。"""
+    if not text:
+        return None
+    if not any(ch in _UNITS for ch in text):
+        # 逐位數字（一五 -> 15）
+        if all(ch in _DIGITS for ch in text):
+            return int(''.join(str(_DIGITS[ch]) for ch in text))
+        return None
+    total = 0
+    current = None
+    for ch in text:
+        if ch in _DIGITS:
+            if current is not None and _DIGITS[ch] != 0:
+                return None     # 例如「三四十」，交給其他流程處理
+            current = _DIGITS[ch] if _DIGITS[ch] != 0 else None
+        elif ch in _UNITS:
+            total += (1 if current is None else current) * _UNITS[ch]
+            current = None
+        else:
+            return None
+    return total + (current or 0)
+
+
+def convert_numerals(text):
+    """只轉換接在時間 / 劑量單位前的中文數字，例如 兩點半 -> 2點半、三點十五分 -> 3點15分、二十五毫克 -> 25毫克。"""
+    def to_arabic(match):
+        value = chinese_to_int(match.group(1))
+        return str(value) if value is not None else match.group(1)
+    text = _QUANTITY_RE.sub(to_arabic, text)
+    return _MINUTE_RE.sub(to_arabic, text)
+
+
+def normalize_units(text):
+    """將數字後面的 cc / CC / 西西 改寫為 ml，例如 5西西 -> 5ml、10 cc -> 10ml。"""
+    return _VOLUME_UNIT_RE.sub('ml', text)
+
+
+class _ReplacementTrie:
+    """以字典樹做一次掃描的最長匹配取代。"""
+
+    _END = object()
+
+    def __init__(self, replacements):
+        self.root = {}
+        for wrong, correct in replacements.items():
+            if not wrong or wrong == correct:
+                continue
+            node = self.root
+            for ch in wrong:
+                node = node.setdefault(ch, {})
+            node[self._END] = correct
+
+    def replace(self, text):
+        """回傳 (取代後文字, [(原字串, 新字串)])。"""
+        output = []
+        changes = []
+        i = 0
+        length = len(text)
+        while i < length:
+            node = self.root
+            j = i
+            match_end, match_value = None, None
+            while j < length and text[j] in node:
+                node = node[text[j]]
+                j += 1
+                if self._END in node:
+                    match_end, match_value = j, node[self._END]
+            if match_end is None:
+                output.append(text[i])
+                i += 1
+            else:
+                changes.append((text[i:match_end], match_value))
+                output.append(match_value)
+                i = match_end
+        return ''.join(output), changes
+
+
+class CorrectionResult:
+    __slots__ = ('original', 'text', 'score', 'changes', 'reasons')
+
+    def __init__(self, original, text, score, changes, reasons):
+        self.original = original
+        self.text = text
+        self.score = score
+        self.changes = changes
+        self.reasons = reasons
+
+    def needs_ai(self, threshold=None):
+        if threshold is None:
+            threshold = Config.VOICE_AI_ENHANCE_THRESHOLD
+        return self.score < threshold
+
+
+class TranscriptCorrector:
+    def __init__(self, corrections=None, drug_accept_score=0.85, drug_min_score=0.6):
+        self.drug_accept_score = drug_accept_score
+        self.drug_min_score = drug_min_score
+        self._trie = _ReplacementTrie(corrections or DEFAULT_CORRECTIONS)
+
+    @staticmethod
+    def _get_matcher():
+        """取得藥品目錄的 DrugMatcher；不在 app context 或資料庫不可用時回傳 None。"""
+        try:
+            from .drug_matcher import get_drug_matcher
+            from ..utils.drug_catalog import drug_catalog
+            snapshot = drug_catalog.snapshot()
+            return get_drug_matcher(snapshot) if len(snapshot) else None
+        except Exception:
+            return None
+
+    def _best_drug_match(self, matcher, candidates, lang):
+        """在候選片段中找分數最高的藥品；回傳 (片段, drug_id, score)。"""
+        best = (None, None, 0.0)
+        for fragment in candidates:
+            drug_id, score, _, _ = matcher.match(name_zh=fragment if lang == 'zh' else None,
+                                                 name_en=fragment if lang == 'en' else None, top_k=1)
+            if drug_id is not None and score > best[2]:
+                best = (fragment, drug_id, score)
+        return best
+
+    def _correct_drug_names(self, text, changes, reasons):
+        """以藥品目錄校正藥名；回傳 (文字, 疑似藥名但無法確定的片段數)。"""
+        spans = []
+        for match in _ZH_DRUG_RE.finditer(text):
+            # 劑型前最多 8 個中文字，藥名起點未知，由短到長逐一嘗試（「我吃脈優錠」-> 脈優錠、吃脈優錠…）
+            window, form = match.group(1), match.group(2)
+            candidates = [window[-k:] + form for k in range(2, len(window) + 1)
+                          if window[-k:] + form not in _GENERIC_DRUGS]
+            if candidates:
+                spans.append((match.end() - len(form), match.end(), candidates, 'zh'))
+        for match in _EN_DRUG_RE.finditer(text):
+            if match.group(0).lower() not in ('ml', 'mg'):
+                spans.append((match.start(), match.end(), [match.group(0)], 'en'))
+        if not spans:
+            return text, 0
+
+        matcher = self._get_matcher()
+        if matcher is None:
+            reasons.append('drug_catalog_unavailable')
+            return text, 0
+
+        unresolved = 0
+        for start, end, candidates, lang in sorted(spans, key=lambda span: span[0], reverse=True):
+            fragment, drug_id, score = self._best_drug_match(matcher, candidates, lang)
+            if score < self.drug_accept_score:
+                # 分數介於最低門檻與接受門檻之間才視為需要確認的藥名；更低的多半不是藥名
+                if score >= self.drug_min_score:
+                    unresolved += 1
+                continue
+            if lang == 'zh':
+                start = end - len(fragment)
+            record = matcher.drugs[drug_id]
+            name = (record.drug_name_zh if lang == 'zh' else record.drug_name_en) or fragment
+            if name != fragment and score < 1.0:
+                changes.append((fragment, name))
+                text = text[:start] + name + text[end:]
+        return text, unresolved
+
+    def correct(self, transcript):
+        """校正語音轉文字結果並計算信心分數（0~1）。"""
+        original = transcript or ''
+        reasons = []
+        text, changes = self._trie.replace(original.strip())
+
+        converted = normalize_units(convert_numerals(text))
+        if converted != text:
+            changes.append((text, converted))
+            text = converted
+
+        text, unresolved = self._correct_drug_names(text, changes, reasons)
+
+        compact = re.sub(r'[\s，。、,.!?！？]', '', text)
+        score = 1.0
+        if any(phrase in compact for phrase in _KNOWN_PHRASES) and len(compact) <= 12:
+            reasons.append('known_command')
+        else:
+            if unresolved:
+                score -= 0.3 * unresolved
+                reasons.append(f'unresolved_drug_names:{unresolved}')
+            if 'drug_catalog_unavailable' in reasons:
+                # 有疑似藥名卻無法比對目錄，交給 Gemini 校正
+                score -= 0.5
+            if re.search(_NUMERAL + '(?=點(?![點兒])|顆|粒|錠|毫克)', text):
+                score -= 0.2
+                reasons.append('ambiguous_numeral')
+            if re.search(r'(.)\1\1', compact):
+                score -= 0.3
+                reasons.append('repeated_characters')
+            if len(compact) > 40:
+                score -= 0.2
+                reasons.append('long_transcript')
+        return CorrectionResult(original, text, max(0.0, round(score, 2)), changes, reasons)
+
+
+transcript_corrector = TranscriptCorrector(
+    drug_accept_score=Config.DRUG_MATCH_ACCEPT_SCORE,
+    drug_min_score=Config.DRUG_MATCH_MIN_SCORE
+)
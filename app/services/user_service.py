@@ -1,26 +1,145 @@
 # app/services/user_service.py
 
+import copy
+from flask import g, has_app_context
 from ..utils.db import DB
-from app import line_bot_api
+from .profile_cache import profile_cache
+
+
+class UserEventContext:
+    """
+    單一 Webhook 事件期間的使用者狀態快取。
+
+    事件開始時一次載入使用者資料、簡單狀態與複雜狀態，
+    事件中所有 handler 都從記憶體讀寫，事件結束時再把有變動的狀態寫回資料庫。
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.user_exists = False
+        self.user_name = None
+        self._simple_state = None
+        self._complex_state = {"state_info": {}, "last_task": {}}
+        # 待寫回的操作：None / 'save' / 'delete'（簡單狀態），None / 'set' / 'clear'（複雜狀態）
+        self._simple_op = None
+        self._simple_minutes = 10
+        self._complex_op = None
+
+    def load(self):
+        data = DB.load_user_event_state(self.user_id)
+        if data is None:
+            return False
+        self.user_exists = data['user_exists']
+        self.user_name = data['user_name']
+        self._simple_state = data['simple_state']
+        self._complex_state = data['complex_state']
+        return True
+
+    # --- 複雜狀態 ---
+    def get_complex_state(self):
+        # 回傳副本，避免 handler 修改後未呼叫 set 卻影響後續讀取
+        return copy.deepcopy(self._complex_state)
+
+    def set_complex_state(self, state_data):
+        self._complex_state = copy.deepcopy(state_data)
+        self._complex_op = 'set'
+
+    def clear_complex_state(self):
+        self._complex_state = {"state_info": {}, "last_task": {}}
+        self._complex_op = 'clear'
+
+    # --- 簡單狀態 ---
+    def get_simple_state(self):
+        return self._simple_state
+
+    def save_simple_state(self, state, minutes):
+        self._simple_state = state
+        self._simple_minutes = minutes
+        self._simple_op = 'save'
+
+    def delete_simple_state(self):
+        self._simple_state = None
+        self._simple_op = 'delete'
+
+    def flush(self):
+        """將有變動的狀態寫回資料庫。"""
+        if self._complex_op == 'set':
+            if not self.user_exists:
+                DB.get_or_create_user(self.user_id, self.user_name or f"User_{self.user_id[:8]}")
+                self.user_exists = True
+            DB.set_complex_state(self.user_id, self._complex_state)
+        elif self._complex_op == 'clear':
+            DB.clear_complex_state(self.user_id)
+        self._complex_op = None
+
+        if self._simple_op == 'save':
+            DB.save_simple_state(self.user_id, self._simple_state, minutes_to_expire=self._simple_minutes)
+        elif self._simple_op == 'delete':
+            DB.delete_simple_state(self.user_id)
+        self._simple_op = None
+
+
+def _event_context(user_id):
+    """取得目前事件中屬於 user_id 的狀態快取；不在事件中或非同一使用者時回傳 None。"""
+    if not has_app_context():
+        return None
+    ctx = g.get('user_event_ctx')
+    if ctx is not None and ctx.user_id == user_id:
+        return ctx
+    return None
+
 
 class UserService:
     """處理使用者、成員和狀態相關的業務邏輯"""
 
+    # --- 單一事件狀態快取 ---
+    @staticmethod
+    def begin_event(user_id: str):
+        """在事件開始時一次載入使用者與狀態；載入失敗時退回逐次查詢資料庫。"""
+        ctx = UserEventContext(user_id)
+        try:
+            if ctx.load():
+                g.user_event_ctx = ctx
+                return ctx
+        except Exception as e:
+            print(f"載入事件狀態快取失敗: {e}")
+        return None
+
+    @staticmethod
+    def flush_event_state():
+        """提前將事件中變動的狀態寫回資料庫（例如進入耗時流程前，讓 LIFF 頁面可讀到最新狀態）。"""
+        ctx = g.get('user_event_ctx') if has_app_context() else None
+        if ctx is not None:
+            try:
+                ctx.flush()
+            except Exception as e:
+                print(f"寫回事件狀態失敗: {e}")
+
+    @staticmethod
+    def end_event():
+        """事件結束：寫回變動的狀態並移除快取。"""
+        UserService.flush_event_state()
+        if has_app_context():
+            g.pop('user_event_ctx', None)
+
     # --- 複雜狀態管理 (藥單流程) ---
     @staticmethod
     def get_user_complex_state(user_id: str):
+        ctx = _event_context(user_id)
+        if ctx:
+            return ctx.get_complex_state()
         return DB.get_complex_state(user_id)
 
     @staticmethod
     def set_user_complex_state(user_id: str, state_data: dict):
         """設置用戶複雜狀態，自動確保用戶存在"""
+        ctx = _event_context(user_id)
+        if ctx:
+            ctx.set_complex_state(state_data)
+            return True
         try:
             # 【核心修復】確保用戶在資料庫中存在
-            try:
-                user_profile = line_bot_api.get_profile(user_id)
-                user_name = user_profile.display_name if user_profile else f"User_{user_id[:8]}"
-            except Exception:
-                user_name = f"User_{user_id[:8]}"
+            user_name = profile_cache.get_display_name(user_id, default=f"User_{user_id[:8]}")
             
             result = DB.get_or_create_user(user_id, user_name)
             if not result:
@@ -36,32 +155,51 @@ class UserService:
 
     @staticmethod
     def clear_user_complex_state(user_id: str):
+        ctx = _event_context(user_id)
+        if ctx:
+            ctx.clear_complex_state()
+            return
         DB.clear_complex_state(user_id)
 
     # --- 簡單狀態管理 (通用) ---
     @staticmethod
     def get_user_simple_state(user_id: str):
+        ctx = _event_context(user_id)
+        if ctx:
+            return ctx.get_simple_state()
         return DB.get_simple_state(user_id)
 
     @staticmethod
     def save_user_simple_state(user_id: str, state: str, minutes: int = 10):
+        ctx = _event_context(user_id)
+        if ctx:
+            ctx.save_simple_state(state, minutes)
+            return
         DB.save_simple_state(user_id, state, minutes_to_expire=minutes)
 
     @staticmethod
     def delete_user_simple_state(user_id: str):
+        ctx = _event_context(user_id)
+        if ctx:
+            ctx.delete_simple_state()
+            return
         DB.delete_simple_state(user_id)
         
     # --- 使用者與成員 ---
     @staticmethod
     def get_or_create_user(user_id: str):
         """如果使用者不存在，則建立使用者並回傳 display name"""
-        try:
-            profile = line_bot_api.get_profile(user_id)
-            user_name = profile.display_name
-        except Exception:
-            user_name = "使用者" # 預設名稱
+        ctx = _event_context(user_id)
+        if ctx and ctx.user_exists:
+            # 事件快取已確認使用者存在，省略 LINE Profile API 與資料庫查詢
+            return ctx.user_name or "使用者"
+
+        user_name = profile_cache.get_display_name(user_id, default="使用者") # 預設名稱
         
-        DB.get_or_create_user(user_id, user_name)
+        result = DB.get_or_create_user(user_id, user_name)
+        if ctx and result:
+            ctx.user_exists = True
+            ctx.user_name = user_name
         return user_name
 
     @staticmethod
@@ -0,0 +1,209 @@
+# app/services/voice_cache.py
+
+"""
+語音處理結果快取（LRU + TTL + 位元組上限）。
+
+- 依用途分成不同 namespace，各自有 TTL：wav（音檔轉換結果）、transcript（語音轉文字）、quick_cmd（快速指令）
+- 以位元組總量（VOICE_CACHE_MAX_BYTES）與筆數（VOICE_CACHE_MAX_ENTRIES）雙重上限做 LRU 淘汰，
+  WAV 音檔很大，只限制筆數仍可能吃光記憶體；單筆超過 VOICE_CACHE_MAX_ITEM_BYTES 的值不快取
+- 設定 VOICE_CACHE_REDIS_URL 時另以 Redis 作為跨 worker / 跨實例共用的第二層：
+  本地未命中才查 Redis，命中後回填本地；Redis 連線失敗時暫停使用 VOICE_CACHE_REDIS_COOLDOWN 秒，只用本地快取
+- 命中、未命中、淘汰與過期次數可由 /api/health-detailed 查看
+"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from config import Config
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+
+class _Namespace:
+    __slots__ = ('name', 'ttl', 'binary', 'hits', 'shared_hits', 'misses')
+
+    def __init__(self, name, ttl, binary):
+        self.name = name
+        self.ttl = ttl
+        self.binary = binary
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+
+
+class VoiceCache:
+    def __init__(self, namespaces, max_bytes=32 * 1024 * 1024, max_entries=512, max_item_bytes=4 * 1024 * 1024,
+                 redis_url=None, redis_prefix='voice:', redis_cooldown=30):
+        """namespaces 為 {名稱: (ttl 秒數, 是否為 bytes)}。"""
+        self.namespaces = {name: _Namespace(name, ttl, binary) for name, (ttl, binary) in namespaces.items()}
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_item_bytes = max_item_bytes
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # (namespace, key) -> (value, size, expires_at)
+        self._bytes = 0
+
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+
+        self._redis = None
+        self._redis_prefix = redis_prefix
+        self._redis_cooldown = redis_cooldown
+        self._redis_down_until = 0.0
+        self.redis_errors = 0
+        if redis_url:
+            if redis is None:
+                print("[VoiceCache] 已設定 VOICE_CACHE_REDIS_URL 但未安裝 redis 套件，只使用本地快取")
+            else:
+                self._redis = redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    @staticmethod
+    def audio_key(audio_bytes):
+        """音檔內容的快取鍵值。"""
+        return hashlib.md5(audio_bytes).hexdigest()
+
+    @staticmethod
+    def _size(value):
+        return len(value) if isinstance(value, (bytes, bytearray)) else len(value.encode('utf-8'))
+
+    def _drop(self, entry_key):
+        """移除一筆（需持有鎖）。"""
+        _, size, _ = self._entries.pop(entry_key)
+        self._bytes -= size
+
+    def _shared(self):
+        if self._redis is None or time.monotonic() < self._redis_down_until:
+            return None
+        return self._redis
+
+    def _shared_failed(self, error):
+        with self._lock:
+            self.redis_errors += 1
+            self._redis_down_until = time.monotonic() + self._redis_cooldown
+        print(f"[VoiceCache] Redis 無法使用，{self._redis_cooldown} 秒內只使用本地快取: {error}")
+
+    def _put_local(self, namespace, key, value, size, ttl):
+        entry_key = (namespace.name, key)
+        with self._lock:
+            if entry_key in self._entries:
+                self._drop(entry_key)
+            self._entries[entry_key] = (value, size, time.monotonic() + ttl)
+            self._bytes += size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                oldest, _ = next(iter(self._entries.items()))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def get(self, namespace_name, key, default=None):
+        """查詢快取；本地未命中時查共用的 Redis，命中後回填本地。"""
+        namespace = self.namespaces[namespace_name]
+        entry_key = (namespace_name, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is not None:
+                value, _, expires_at = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(entry_key)
+                    namespace.hits += 1
+                    return value
+                self._drop(entry_key)
+                self.expirations += 1
+
+        shared = self._shared()
+        if shared is not None:
+            redis_key = f"{self._redis_prefix}{namespace_name}:{key}"
+            try:
+                raw, ttl = shared.pipeline().get(redis_key).ttl(redis_key).execute()
+            except Exception as e:
+                self._shared_failed(e)
+                raw = None
+            if raw is not None:
+                value = raw if namespace.binary else raw.decode('utf-8')
+                remaining = ttl if ttl and ttl > 0 else namespace.ttl
+                self._put_local(namespace, key, value, len(raw), min(remaining, namespace.ttl))
+                with self._lock:
+                    namespace.shared_hits += 1
+                return value
+
+        with self._lock:
+            namespace.misses += 1
+        return default
+
+    def set(self, namespace_name, key, value):
+        """寫入快取；None 或超過單筆上限的值不快取。"""
+        if value is None:
+            return
+        namespace = self.namespaces[namespace_name]
+        size = self._size(value)
+        if size > self.max_item_bytes:
+            with self._lock:
+                self.rejected += 1
+            return
+        self._put_local(namespace, key, value, size, namespace.ttl)
+
+        shared = self._shared()
+        if shared is not None:
+            raw = value if namespace.binary else value.encode('utf-8')
+            try:
+                shared.setex(f"{self._redis_prefix}{namespace_name}:{key}", int(namespace.ttl), raw)
+            except Exception as e:
+                self._shared_failed(e)
+
+    def purge_expired(self):
+        """清除所有已過期的本地項目，回傳清除筆數。"""
+        now = time.monotonic()
+        with self._lock:
+            expired = [entry_key for entry_key, (_, _, expires_at) in self._entries.items() if expires_at < now]
+            for entry_key in expired:
+                self._drop(entry_key)
+            self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'rejected': self.rejected,
+                'shared_backend': 'redis' if self._redis is not None else None,
+                'redis_errors': self.redis_errors,
+                'namespaces': {
+                    name: {
+                        'ttl': ns.ttl,
+                        'hits': ns.hits,
+                        'shared_hits': ns.shared_hits,
+                        'misses': ns.misses,
+                    }
+                    for name, ns in self.namespaces.items()
+                },
+            }
+
+
+voice_cache = VoiceCache(
+    namespaces={
+        'wav': (Config.VOICE_CACHE_WAV_TTL, True),
+        'transcript': (Config.VOICE_CACHE_TRANSCRIPT_TTL, False),
+        'quick_cmd': (Config.VOICE_CACHE_COMMAND_TTL, False),
+    },
+    max_bytes=Config.VOICE_CACHE_MAX_BYTES,
+    max_entries=Config.VOICE_CACHE_MAX_ENTRIES,
+    max_item_bytes=Config.VOICE_CACHE_MAX_ITEM_BYTES,
+    redis_url=Config.VOICE_CACHE_REDIS_URL or None,
+    redis_cooldown=Config.VOICE_CACHE_REDIS_COOLDOWN
+)
@@ -3,10 +3,10 @@ import tempfile
 import traceback
 import asyncio
 import concurrent.futures
+import queue
 import threading
 from io import BytesIO
 from typing import Optional, Tuple
-import hashlib
 import time
 
 from google.cloud import speech
@@ -15,21 +15,23 @@ from pydub.exceptions import CouldntDecodeError
 import pymysql
 
 from ..utils.db import DB
+from .voice_cache import voice_cache
+from .client_registry import get_speech_client, get_gemini_model
+from .transcript_corrector import transcript_corrector
+from .audio_stream import SAMPLE_RATE, CHUNK_SIZE, DownloadError, StreamedAudio, get_ffmpeg_path, stream_to_pcm
 from flask import current_app
 
+from config import Config
+
 # 全域變數來追蹤 FFmpeg 警告是否已顯示
 _ffmpeg_warning_shown = False
 
-# 語音快取系統
-_voice_cache = {}
-_cache_lock = threading.Lock()
-CACHE_EXPIRY_SECONDS = 300  # 5分鐘快取
-
 class VoiceService:
     """語音輸入處理服務"""
     
     def __init__(self):
-        self.speech_client = speech.SpeechClient()
+        # 行程共用的 SpeechClient，不再每則語音訊息重建 gRPC channel
+        self.speech_client = get_speech_client()
     
     @staticmethod
     def download_audio_content(message_id: str, line_bot_api) -> Optional[bytes]:
@@ -67,6 +69,79 @@ class VoiceService:
             current_app.logger.error(f"下載語音檔案失敗: {e}")
             return None
     
+    @staticmethod
+    def download_audio_stream(message_id: str, line_bot_api, language_code: str = "zh-TW") -> Optional[StreamedAudio]:
+        """
+        從LINE串流下載語音檔案，下載的同時送入 ffmpeg 轉為 16kHz 單聲道 LINEAR16；
+        啟用 VOICE_STREAMING_RECOGNITION 時，轉換出的 PCM 同步送進串流語音辨識，
+        下載、轉換與辨識重疊進行，結果放在 StreamedAudio.transcript
+        
+        Args:
+            message_id: LINE消息ID
+            line_bot_api: LINE Bot API實例
+            language_code: 語言代碼，預設為繁體中文
+            
+        Returns:
+            StreamedAudio（ffmpeg 轉換失敗時 pcm 為 None，由 process_voice_input 改走備用轉換），下載失敗時返回None
+        """
+        streaming = Config.VOICE_STREAMING_RECOGNITION
+        pcm_queue = None
+        recognition = {}
+        recognizer = None
+        try:
+            start_time = time.time()
+            message_content = line_bot_api.get_message_content(message_id)
+            api_call_time = time.time() - start_time
+            
+            if streaming:
+                voice_service = VoiceService()
+                pcm_queue = queue.Queue()
+                
+                def recognize():
+                    # 背景執行緒沒有 app context，結果交回主執行緒記錄
+                    try:
+                        recognition['result'] = voice_service._recognize_stream(
+                            VoiceService._drain_queue(pcm_queue), language_code)
+                    except Exception as e:
+                        recognition['error'] = e
+                
+                recognizer = threading.Thread(target=recognize, daemon=True)
+                recognizer.start()
+            
+            try:
+                audio = stream_to_pcm(message_content.iter_content(chunk_size=CHUNK_SIZE),
+                                      on_pcm=pcm_queue.put if pcm_queue is not None else None)
+            finally:
+                if pcm_queue is not None:
+                    pcm_queue.put(None)
+            convert_time = time.time() - start_time
+            
+            if audio.pcm is not None:
+                current_app.logger.info(f"[語音下載] API呼叫: {api_call_time:.3f}秒, 串流下載+轉換: {convert_time:.3f}秒, 原始大小: {audio.source_size} bytes, PCM: {len(audio.pcm)} bytes")
+            else:
+                current_app.logger.warning(f"[語音下載] 串流轉換失敗，改用備用轉換: {audio.error}，下載耗時: {convert_time:.3f}秒, 大小: {audio.source_size} bytes")
+            
+            # 轉換失敗時部分辨識結果不可信，交給備用轉換後的一般辨識
+            if recognizer is not None and audio.pcm is not None:
+                recognizer.join(Config.VOICE_STREAMING_TIMEOUT)
+                if 'error' in recognition:
+                    current_app.logger.warning(f"[串流辨識] 失敗，改用一般辨識: {recognition['error']}")
+                elif 'result' in recognition:
+                    transcript, confidence = recognition['result']
+                    current_app.logger.info(f"[串流辨識] '{transcript}' (信心度: {confidence:.2f})，下載完成後等待: {time.time() - start_time - convert_time:.3f}秒")
+                    if transcript and confidence > 0.2:
+                        audio.transcript = transcript
+                        voice_cache.set('transcript', voice_cache.audio_key(audio.pcm), transcript)
+                else:
+                    current_app.logger.warning("[串流辨識] 逾時，改用一般辨識")
+            return audio
+        except DownloadError as e:
+            current_app.logger.error(f"下載語音檔案失敗: {e}")
+            return None
+        except Exception as e:
+            current_app.logger.error(f"下載語音檔案失敗: {e}")
+            return None
+    
     @staticmethod
     def convert_audio_format(audio_bytes: bytes) -> Optional[bytes]:
         """
@@ -79,15 +154,24 @@ class VoiceService:
             轉換後的wav格式bytes，失敗時返回None
         """
         # 產生快取鍵值
-        cache_key = hashlib.md5(audio_bytes).hexdigest()
+        cache_key = voice_cache.audio_key(audio_bytes)
         
         # 檢查快取
-        with _cache_lock:
-            if cache_key in _voice_cache:
-                cached_data, timestamp = _voice_cache[cache_key]
-                if time.time() - timestamp < CACHE_EXPIRY_SECONDS:
-                    current_app.logger.info("使用快取的音檔轉換結果")
-                    return cached_data
+        cached_data = voice_cache.get('wav', cache_key)
+        if cached_data is not None:
+            current_app.logger.info("使用快取的音檔轉換結果")
+            return cached_data
+        
+        # 優先以 ffmpeg 管線直接轉為 LINEAR16，不經 pydub 整檔解碼
+        if get_ffmpeg_path():
+            try:
+                streamed = stream_to_pcm([audio_bytes])
+                if streamed.pcm is not None:
+                    voice_cache.set('wav', cache_key, streamed.pcm)
+                    return streamed.pcm
+                current_app.logger.warning(f"ffmpeg 串流轉換失敗，改用 pydub: {streamed.error}")
+            except DownloadError:
+                pass
         try:
             # 首先嘗試使用 pydub 進行轉換
             try:
@@ -105,14 +189,7 @@ class VoiceService:
                 result = wav_buffer.getvalue()
                 
                 # 儲存到快取
-                with _cache_lock:
-                    _voice_cache[cache_key] = (result, time.time())
-                    # 清理過期快取
-                    current_time = time.time()
-                    expired_keys = [k for k, (_, ts) in _voice_cache.items() 
-                                  if current_time - ts >= CACHE_EXPIRY_SECONDS]
-                    for k in expired_keys:
-                        del _voice_cache[k]
+                voice_cache.set('wav', cache_key, result)
                 
                 return result
                 
@@ -151,8 +228,7 @@ class VoiceService:
                     result = wav_buffer.getvalue()
                     
                     # 儲存到快取
-                    with _cache_lock:
-                        _voice_cache[cache_key] = (result, time.time())
+                    voice_cache.set('wav', cache_key, result)
                     
                     return result
                 except:
@@ -167,18 +243,58 @@ class VoiceService:
             current_app.logger.error(f"音頻格式轉換失敗: {e}")
             return None
     
+    @staticmethod
+    def _drain_queue(pcm_queue):
+        """把 PCM 佇列轉成 iterator，遇到 None 結束。"""
+        while True:
+            chunk = pcm_queue.get()
+            if chunk is None:
+                return
+            yield chunk
+    
+    def _recognize_stream(self, pcm_chunks, language_code: str = "zh-TW") -> Tuple[Optional[str], float]:
+        """
+        以 streaming_recognize 辨識邊轉換邊產生的 PCM 區塊（在背景執行緒執行，不使用 current_app）
+        
+        Returns:
+            (辨識文字或None, 各段最終結果中最低的信心度)
+        """
+        config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                sample_rate_hertz=SAMPLE_RATE,
+                language_code=language_code,
+                enable_automatic_punctuation=False,
+                max_alternatives=1,
+                use_enhanced=False
+            ),
+            interim_results=False,
+            single_utterance=Config.VOICE_STREAMING_SINGLE_UTTERANCE
+        )
+        requests = (speech.StreamingRecognizeRequest(audio_content=chunk) for chunk in pcm_chunks)
+        responses = self.speech_client.streaming_recognize(
+            config, requests, timeout=Config.VOICE_STREAMING_TIMEOUT)
+        
+        parts = []
+        confidences = []
+        for response in responses:
+            for result in response.results:
+                if result.is_final and result.alternatives:
+                    parts.append(result.alternatives[0].transcript)
+                    confidences.append(result.alternatives[0].confidence)
+        transcript = ''.join(parts).strip()
+        return (transcript or None), (min(confidences) if confidences else 0.0)
+    
     def transcribe_audio_fast(self, audio_bytes: bytes, language_code: str = "zh-TW") -> Optional[str]:
         """
         超快速語音識別，極簡化配置
         """
         # 檢查轉錄快取
-        cache_key = f"transcript_{hashlib.md5(audio_bytes).hexdigest()}"
-        with _cache_lock:
-            if cache_key in _voice_cache:
-                cached_data, timestamp = _voice_cache[cache_key]
-                if time.time() - timestamp < CACHE_EXPIRY_SECONDS:
-                    current_app.logger.info("使用快取的語音轉錄結果")
-                    return cached_data
+        cache_key = voice_cache.audio_key(audio_bytes)
+        cached_data = voice_cache.get('transcript', cache_key)
+        if cached_data is not None:
+            current_app.logger.info("使用快取的語音轉錄結果")
+            return cached_data
 
         try:
             # 最簡化配置，不檢測格式，直接使用最通用設定
@@ -205,8 +321,7 @@ class VoiceService:
                 if confidence > 0.2:  # 進一步降低信心度閾值加快速度
                     result = transcript.strip()
                     # 儲存轉錄結果到快取
-                    with _cache_lock:
-                        _voice_cache[cache_key] = (result, time.time())
+                    voice_cache.set('transcript', cache_key, result)
                     return result
                     
         except Exception as e:
@@ -214,26 +329,6 @@ class VoiceService:
         
         return None
     
-    def _get_best_encoding_attempt(self, audio_bytes: bytes) -> dict:
-        """
-        根據音檔特徵選擇最佳的編碼格式（單一選擇）
-        """
-        is_wav_format = audio_bytes.startswith(b'RIFF') and b'WAVE' in audio_bytes[:20]
-        
-        if is_wav_format:
-            return {
-                'encoding': speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                'sample_rate_hertz': 16000,
-                'description': 'WAV/LINEAR16'
-            }
-        else:
-            # 非WAV格式，使用最通用的編碼
-            return {
-                'encoding': speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                'sample_rate_hertz': 16000,
-                'description': 'LINEAR16_FAST'
-            }
-
     def transcribe_audio(self, audio_bytes: bytes, language_code: str = "zh-TW") -> Optional[str]:
         """
         優化的語音轉文字，使用智能格式選擇和快取
@@ -246,117 +341,114 @@ class VoiceService:
             轉換後的文字，失敗時返回None
         """
         # 檢查轉錄快取
-        cache_key = f"transcript_{hashlib.md5(audio_bytes).hexdigest()}"
-        with _cache_lock:
-            if cache_key in _voice_cache:
-                cached_data, timestamp = _voice_cache[cache_key]
-                if time.time() - timestamp < CACHE_EXPIRY_SECONDS:
-                    current_app.logger.info("使用快取的語音轉錄結果")
-                    return cached_data
-        # 智能格式檢測和優化的編碼嘗試順序
-        encoding_attempts = self._get_optimal_encoding_attempts(audio_bytes)
+        cache_key = voice_cache.audio_key(audio_bytes)
+        cached_data = voice_cache.get('transcript', cache_key)
+        if cached_data is not None:
+            current_app.logger.info("使用快取的語音轉錄結果")
+            return cached_data
+        # 依檔頭決定編碼；不支援的容器（m4a）先轉為 LINEAR16
+        attempt = self._detect_encoding(audio_bytes)
+        if attempt is None:
+            converted = self.convert_audio_format(audio_bytes)
+            attempt = self._detect_encoding(converted) if converted else None
+            if attempt is None:
+                current_app.logger.error("無法轉換為語音識別支援的音頻格式")
+                return None
+            audio_bytes = converted
         
-        # 嘗試每種編碼格式
-        for attempt in encoding_attempts:
-            try:
-                current_app.logger.info(f"嘗試使用 {attempt['description']} 格式進行語音識別")
-                
-                # 建立配置
-                config_params = {
-                    'encoding': attempt['encoding'],
-                    'language_code': language_code,
-                    'enable_automatic_punctuation': True,
-                    'max_alternatives': 1,
-                    'profanity_filter': True,
-                    'speech_contexts': [
-                        speech.SpeechContext(phrases=[
-                            # 健康指標
-                            "血壓", "血糖", "體重", "體溫", "血氧", "心跳", "心率",
-                            
-                            # 時間與頻率
-                            "早上", "中午", "下午", "晚上", "睡前", "凌晨", "半夜",
-                            "每天", "每週", "每月", "一天一次", "一天兩次", "一天三次", "一天四次",
-                            "飯前", "飯後", "空腹", "隨餐", "每六小時", "每八小時", "每十二小時",
-                            "點", "點半", "分",
-                            
-                            # 單位
-                            "毫克", "mg", "公克", "g", "單位", "IU", "毫升", "ml", "cc",
-                            "公斤", "kg", "度", "°C", "百分比", "%", "bpm",
-                            "一顆", "一粒", "一錠", "一包", "一瓶", "一劑", "一次",
-                            
-                            # 藥物與動作
-                            "藥物", "藥品", "處方", "藥水", "藥膏", "膠囊", "錠劑",
-                            "服用", "使用", "塗抹", "注射", "吸入", "吃藥",
-                            "提醒", "設定", "新增", "查詢", "刪除", "修改",
-                            
-                            # 家庭成員與關係
-                            "爸爸", "媽媽", "兒子", "女兒", "家人", "自己", "本人",
-                            "爺爺", "奶奶", "外公", "外婆", "孫子", "孫女",
-                            
-                            # 主要功能指令
-                            "藥單辨識", "掃描藥單", "拍藥單",
-                            "藥品辨識", "掃描藥品", "拍藥品", "這是什麼藥",
-                            "用藥提醒", "設定提醒", "吃藥提醒",
-                            "家人綁定", "新增家人",
-                            "健康紀錄", "記錄血壓", "記錄血糖",
-                            "我的藥歷", "查詢藥歷"
-                        ], boost=15) # 增加權重
-                    ]
-                }
-                
-                # 只有在有sample_rate_hertz時才添加
-                if attempt['sample_rate_hertz']:
-                    config_params['sample_rate_hertz'] = attempt['sample_rate_hertz']
-                
-                config = speech.RecognitionConfig(**config_params)
-                audio = speech.RecognitionAudio(content=audio_bytes)
+        try:
+            current_app.logger.info(f"使用 {attempt['description']} 格式進行語音識別")
+            
+            # 建立配置
+            config_params = {
+                'encoding': attempt['encoding'],
+                'language_code': language_code,
+                'enable_automatic_punctuation': True,
+                'max_alternatives': 1,
+                'profanity_filter': True,
+                'speech_contexts': [
+                    speech.SpeechContext(phrases=[
+                        # 健康指標
+                        "血壓", "血糖", "體重", "體溫", "血氧", "心跳", "心率",
+                        
+                        # 時間與頻率
+                        "早上", "中午", "下午", "晚上", "睡前", "凌晨", "半夜",
+                        "每天", "每週", "每月", "一天一次", "一天兩次", "一天三次", "一天四次",
+                        "飯前", "飯後", "空腹", "隨餐", "每六小時", "每八小時", "每十二小時",
+                        "點", "點半", "分",
+                        
+                        # 單位
+                        "毫克", "mg", "公克", "g", "單位", "IU", "毫升", "ml", "cc",
+                        "公斤", "kg", "度", "°C", "百分比", "%", "bpm",
+                        "一顆", "一粒", "一錠", "一包", "一瓶", "一劑", "一次",
+                        
+                        # 藥物與動作
+                        "藥物", "藥品", "處方", "藥水", "藥膏", "膠囊", "錠劑",
+                        "服用", "使用", "塗抹", "注射", "吸入", "吃藥",
+                        "提醒", "設定", "新增", "查詢", "刪除", "修改",
+                        
+                        # 家庭成員與關係
+                        "爸爸", "媽媽", "兒子", "女兒", "家人", "自己", "本人",
+                        "爺爺", "奶奶", "外公", "外婆", "孫子", "孫女",
+                        
+                        # 主要功能指令
+                        "藥單辨識", "掃描藥單", "拍藥單",
+                        "藥品辨識", "掃描藥品", "拍藥品", "這是什麼藥",
+                        "用藥提醒", "設定提醒", "吃藥提醒",
+                        "家人綁定", "新增家人",
+                        "健康紀錄", "記錄血壓", "記錄血糖",
+                        "我的藥歷", "查詢藥歷"
+                    ], boost=15) # 增加權重
+                ]
+            }
+            
+            # 只有在有sample_rate_hertz時才添加
+            if attempt['sample_rate_hertz']:
+                config_params['sample_rate_hertz'] = attempt['sample_rate_hertz']
+            
+            config = speech.RecognitionConfig(**config_params)
+            audio = speech.RecognitionAudio(content=audio_bytes)
+            
+            # 執行語音識別
+            response = self.speech_client.recognize(config=config, audio=audio)
+            
+            if response.results:
+                # 回傳第一個識別結果
+                transcript = response.results[0].alternatives[0].transcript
+                confidence = response.results[0].alternatives[0].confidence
                 
-                # 執行語音識別
-                response = self.speech_client.recognize(config=config, audio=audio)
+                current_app.logger.info(f"語音識別成功 ({attempt['description']}): '{transcript}' (信心度: {confidence:.2f})")
                 
-                if response.results:
-                    # 回傳第一個識別結果
-                    transcript = response.results[0].alternatives[0].transcript
-                    confidence = response.results[0].alternatives[0].confidence
-                    
-                    current_app.logger.info(f"語音識別成功 ({attempt['description']}): '{transcript}' (信心度: {confidence:.2f})")
-                    
-                    # 只有信心度夠高才回傳結果
-                    if confidence > 0.6:
-                        result = transcript.strip()
-                        # 儲存轉錄結果到快取
-                        with _cache_lock:
-                            _voice_cache[cache_key] = (result, time.time())
-                        return result
-                    else:
-                        current_app.logger.warning(f"語音識別信心度過低: {confidence:.2f}, 內容: '{transcript.strip()}', 編碼: {attempt['description']}")
-                        continue  # 嘗試下一種編碼
-                else:
-                    current_app.logger.warning(f"{attempt['description']} 格式語音識別沒有結果")
-                    continue  # 嘗試下一種編碼
-                    
-            except Exception as e:
-                error_msg = str(e)
-                if "sample rate" in error_msg.lower() and "0" in error_msg:
-                    current_app.logger.warning(f"{attempt['description']} 格式語音識別失敗: 採樣率問題 - {e}")
-                elif "invalid recognition" in error_msg.lower():
-                    current_app.logger.warning(f"{attempt['description']} 格式語音識別失敗: 格式不支援 - {e}")
+                # 只有信心度夠高才回傳結果
+                if confidence > 0.6:
+                    result = transcript.strip()
+                    # 儲存轉錄結果到快取
+                    voice_cache.set('transcript', cache_key, result)
+                    return result
                 else:
-                    current_app.logger.warning(f"{attempt['description']} 格式語音識別失敗: {e}")
-                continue  # 嘗試下一種編碼格式
+                    current_app.logger.warning(f"語音識別信心度過低: {confidence:.2f}, 內容: '{transcript.strip()}', 編碼: {attempt['description']}")
+            else:
+                current_app.logger.warning(f"{attempt['description']} 格式語音識別沒有結果")
+                
+        except Exception as e:
+            error_msg = str(e)
+            if "sample rate" in error_msg.lower() and "0" in error_msg:
+                current_app.logger.warning(f"{attempt['description']} 格式語音識別失敗: 採樣率問題 - {e}")
+            elif "invalid recognition" in error_msg.lower():
+                current_app.logger.warning(f"{attempt['description']} 格式語音識別失敗: 格式不支援 - {e}")
+            else:
+                current_app.logger.warning(f"{attempt['description']} 格式語音識別失敗: {e}")
         
-        # 所有編碼都失敗了
-        current_app.logger.error("所有音頻編碼格式都無法識別語音")
         return None
-    
+
     @staticmethod
-    def process_voice_input(user_id: str, audio_bytes: bytes, line_bot_api) -> Tuple[bool, str, dict]:
+    def process_voice_input(user_id: str, audio_bytes, line_bot_api) -> Tuple[bool, str, dict]:
         """
         激進優化的語音輸入處理流程，目標 < 3秒
         
         Args:
             user_id: 用戶ID
-            audio_bytes: 語音檔案bytes
+            audio_bytes: 語音檔案bytes，或 download_audio_stream 回傳的 StreamedAudio（已轉好 PCM）
             line_bot_api: LINE Bot API實例
             
         Returns:
@@ -372,28 +464,35 @@ class VoiceService:
         
         voice_service = VoiceService()
         
-        # 1. 並行處理：音檔轉換 + AI優化準備
+        # 1. 音檔轉換（串流下載時已由 ffmpeg 轉好，只有失敗時才走備用轉換）
         format_start = time.time()
-        wav_bytes = voice_service.convert_audio_format(audio_bytes)
+        if isinstance(audio_bytes, StreamedAudio):
+            wav_bytes = audio_bytes.pcm or voice_service.convert_audio_format(audio_bytes.source_bytes)
+        else:
+            wav_bytes = voice_service.convert_audio_format(audio_bytes)
         if not wav_bytes:
             return False, "無法處理此語音格式，請重新錄製", {}
         format_time = time.time() - format_start
         
-        # 2. 使用更快的語音識別設定
+        # 2. 使用更快的語音識別設定（串流下載時通常已完成串流辨識）
         transcript_start = time.time()
-        transcript = voice_service.transcribe_audio_fast(wav_bytes)
+        transcript = (audio_bytes.transcript if isinstance(audio_bytes, StreamedAudio) else None) \
+            or voice_service.transcribe_audio_fast(wav_bytes)
         if not transcript:
             return False, "無法識別語音內容，請重新錄製", {}
         transcript_time = time.time() - transcript_start
         
-        # 3. 最小化AI處理 - 只對複雜指令使用
+        # 3. 本地校正（錯字字典、中文數字、藥名），只有校正後信心仍不足才交給 AI
         enhance_start = time.time()
-        if VoiceService._should_enhance_with_ai(transcript):
-            # 使用更快的AI優化
-            enhanced_transcript = VoiceService._enhance_with_gemini_fast(transcript)
-            final_transcript = enhanced_transcript or transcript
+        correction = transcript_corrector.correct(transcript)
+        if correction.needs_ai():
+            current_app.logger.info(f"本地校正信心度 {correction.score:.2f} ({', '.join(correction.reasons)})，改用 AI 優化")
+            enhanced_transcript = VoiceService._enhance_with_gemini_fast(correction.text)
+            final_transcript = enhanced_transcript or correction.text
         else:
-            final_transcript = VoiceService._local_text_optimization(transcript)
+            if correction.changes:
+                current_app.logger.info(f"本地語音校正: '{transcript}' → '{correction.text}' (信心度: {correction.score:.2f})")
+            final_transcript = correction.text
         enhance_time = time.time() - enhance_start
         
         # 4. 非同步記錄（不計入主要時間）
@@ -416,7 +515,7 @@ class VoiceService:
             }
             
             # 快取簡單指令結果
-            if len(audio_bytes) < 50000:
+            if VoiceService._audio_identity(audio_bytes)[1] < 50000:
                 VoiceService.cache_quick_command(audio_bytes, menu_command)
             
             current_app.logger.info(f"用戶 {user_id} 語音呼叫: {menu_command}")
@@ -430,27 +529,6 @@ class VoiceService:
         
         return True, final_transcript, extra_data
     
-    @staticmethod
-    def _should_enhance_with_ai(transcript: str) -> bool:
-        """
-        判斷是否需要使用AI優化，避免對簡單指令的不必要API呼叫
-        """
-        # 如果是常見的簡單指令，不需要AI優化
-        simple_commands = [
-            "選單", "主選單", "藥單辨識", "藥品辨識", "用藥提醒", 
-            "健康紀錄", "家人綁定", "查詢本人", "查詢家人", "新增提醒"
-        ]
-        
-        transcript_clean = transcript.replace(" ", "").replace("，", "").replace("。", "")
-        
-        for cmd in simple_commands:
-            if cmd in transcript_clean:
-                return False
-        
-        # 如果包含複雜的藥物或時間資訊，則使用AI優化
-        complex_keywords = ["每天", "早上", "晚上", "顆", "粒", "錠", "藥", "點"]
-        return any(keyword in transcript for keyword in complex_keywords)
-
     @staticmethod
     def _enhance_with_gemini_fast(transcript: str) -> str:
         """
@@ -464,8 +542,7 @@ class VoiceService:
             if not api_key:
                 return VoiceService._local_text_optimization(transcript)
             
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-2.5-flash')
+            model = get_gemini_model('gemini-2.5-flash', api_key)
             
             # 最簡化的提示詞
             prompt = f"修正錯字: {transcript}"
@@ -516,8 +593,7 @@ class VoiceService:
             
             
             # 初始化Gemini
-            genai.configure(api_key=api_key)
-            model = genai.GenerativeModel('gemini-2.5-flash')  # 使用更穩定的模型版本
+            model = get_gemini_model('gemini-2.5-flash', api_key)  # 使用更穩定的模型版本
             
             # 建立語音優化提示
             prompt = f"""請修正以下語音識別結果中的錯字和語法問題，特別注意用藥相關詞彙：
@@ -589,41 +665,7 @@ class VoiceService:
         本地文字優化，當 Gemini API 失敗時使用
         """
         try:
-            import re
-            
-            # 基本的文字優化
-            optimized = transcript
-            
-            # 1. 中文數字轉阿拉伯數字
-            chinese_numbers = {
-                '一': '1', '二': '2', '三': '3', '四': '4', '五': '5',
-                '六': '6', '七': '7', '八': '8', '九': '9', '十': '10',
-                '兩': '2', '零': '0'
-            }
-            
-            for chinese, arabic in chinese_numbers.items():
-                optimized = optimized.replace(f'{chinese}點', f'{arabic}點')
-                optimized = optimized.replace(f'{chinese}顆', f'{arabic}顆')
-                optimized = optimized.replace(f'{chinese}粒', f'{arabic}粒')
-                optimized = optimized.replace(f'{chinese}錠', f'{arabic}錠')
-                optimized = optimized.replace(f'{chinese}次', f'{arabic}次')
-            
-            # 2. 常見錯字修正
-            corrections = {
-                '亮血壓': '量血壓',
-                '記體重': '記體重',
-                '血壓要': '血壓藥',
-                '血糖要': '血糖藥',
-                '胃要': '胃藥'
-            }
-            
-            for wrong, correct in corrections.items():
-                optimized = optimized.replace(wrong, correct)
-            
-            # 3. 單位標準化
-            optimized = optimized.replace('西西', 'ml')
-            optimized = optimized.replace('CC', 'ml')
-            
+            optimized = transcript_corrector.correct(transcript).text
             current_app.logger.info(f"本地語音優化: '{transcript}' → '{optimized}'")
             return optimized
             
@@ -631,54 +673,36 @@ class VoiceService:
             current_app.logger.error(f"本地語音優化失敗: {e}")
             return transcript
 
-    def _get_optimal_encoding_attempts(self, audio_bytes: bytes) -> list:
-        """
-        根據音檔特徵選擇最佳的編碼嘗試順序
+    @staticmethod
+    def _detect_encoding(audio_bytes: bytes) -> Optional[dict]:
         """
-        # 檢測音頻格式
-        is_wav_format = audio_bytes.startswith(b'RIFF') and b'WAVE' in audio_bytes[:20]
-        is_m4a_format = audio_bytes[4:8] == b'ftyp'
+        依檔頭一次決定 Speech API 的編碼與採樣率，不再逐一嘗試多種編碼重送整個音檔
         
-        if is_wav_format:
-            # WAV格式，直接使用LINEAR16
-            return [{
+        Returns:
+            編碼設定；m4a 等 Speech API 不支援的容器返回None（需先轉換）
+        """
+        if audio_bytes.startswith(b'RIFF') and audio_bytes[8:12] == b'WAVE':
+            sample_rate = int.from_bytes(audio_bytes[24:28], 'little') or 16000
+            return {
                 'encoding': speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                'sample_rate_hertz': 16000,
-                'description': 'WAV/LINEAR16'
-            }]
-        elif is_m4a_format:
-            # M4A格式（LINE常用），優先嘗試這些編碼
-            return [
-                {
-                    'encoding': speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                    'sample_rate_hertz': 16000,
-                    'description': 'M4A_TO_LINEAR16'
-                },
-                {
-                    'encoding': speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED,
-                    'sample_rate_hertz': None,
-                    'description': 'M4A_AUTO_DETECT'
-                }
-            ]
-        else:
-            # 其他格式，使用通用嘗試列表
-            return [
-                {
-                    'encoding': speech.RecognitionConfig.AudioEncoding.ENCODING_UNSPECIFIED,
-                    'sample_rate_hertz': None,
-                    'description': 'AUTO_DETECT'
-                },
-                {
-                    'encoding': speech.RecognitionConfig.AudioEncoding.LINEAR16,
-                    'sample_rate_hertz': 16000,
-                    'description': 'LINEAR16_16K'
-                },
-                {
-                    'encoding': speech.RecognitionConfig.AudioEncoding.FLAC,
-                    'sample_rate_hertz': 16000,
-                    'description': 'FLAC'
-                }
-            ]
+                'sample_rate_hertz': sample_rate,
+                'description': f'WAV/LINEAR16 {sample_rate}Hz'
+            }
+        if audio_bytes.startswith(b'fLaC'):
+            # FLAC 檔頭已含採樣率，由 API 自行讀取
+            return {
+                'encoding': speech.RecognitionConfig.AudioEncoding.FLAC,
+                'sample_rate_hertz': None,
+                'description': 'FLAC'
+            }
+        if audio_bytes[4:8] == b'ftyp':
+            return None
+        # 無檔頭：convert_audio_format / 串流轉換輸出的 16kHz 單聲道 PCM
+        return {
+            'encoding': speech.RecognitionConfig.AudioEncoding.LINEAR16,
+            'sample_rate_hertz': 16000,
+            'description': 'PCM/LINEAR16 16000Hz'
+        }
 
     @staticmethod
     def _log_voice_recognition_async(user_id: str, transcript: str, original_transcript: str = None):
@@ -801,47 +825,51 @@ class VoiceService:
             # 不影響主要功能，繼續執行
     
     @staticmethod
-    def quick_command_detection(audio_bytes: bytes) -> str:
+    def _audio_identity(audio) -> Tuple[str, int]:
+        """回傳原始音檔的 (快取鍵值, 大小)；StreamedAudio 已在下載時計算，不需合併區塊。"""
+        if isinstance(audio, StreamedAudio):
+            return audio.source_key, audio.source_size
+        return voice_cache.audio_key(audio), len(audio)
+    
+    @staticmethod
+    def quick_command_detection(audio_bytes) -> str:
         """
         快速指令檢測，適用於短音檔
         
         Args:
-            audio_bytes: 音檔bytes
+            audio_bytes: 音檔bytes 或 StreamedAudio
             
         Returns:
             如果檢測到快速指令則返回指令，否則返回None
         """
+        cache_key, audio_size = VoiceService._audio_identity(audio_bytes)
+        
         # 檢查音檔大小，小於50KB的音檔可能是短指令
-        if len(audio_bytes) > 50000:
+        if audio_size > 50000:
             return None
             
         # 檢查快取中是否有這個音檔的結果
-        cache_key = f"quick_cmd_{hashlib.md5(audio_bytes).hexdigest()}"
-        with _cache_lock:
-            if cache_key in _voice_cache:
-                cached_data, timestamp = _voice_cache[cache_key]
-                if time.time() - timestamp < CACHE_EXPIRY_SECONDS:
-                    current_app.logger.info("使用快取的快速指令結果")
-                    return cached_data
+        cached_data = voice_cache.get('quick_cmd', cache_key)
+        if cached_data is not None:
+            current_app.logger.info("使用快取的快速指令結果")
+            return cached_data
         
         # 對於非常短的音檔（小於15KB），跳過處理加快速度
-        if len(audio_bytes) < 15000:
+        if audio_size < 15000:
             return None
             
         return None  # 暫時返回None，讓主要流程處理
     
     @staticmethod
-    def cache_quick_command(audio_bytes: bytes, command: str):
+    def cache_quick_command(audio_bytes, command: str):
         """
         快取快速指令結果
         
         Args:
-            audio_bytes: 音檔bytes
+            audio_bytes: 音檔bytes 或 StreamedAudio
             command: 檢測到的指令
         """
-        cache_key = f"quick_cmd_{hashlib.md5(audio_bytes).hexdigest()}"
-        with _cache_lock:
-            _voice_cache[cache_key] = (command, time.time())
+        voice_cache.set('quick_cmd', VoiceService._audio_identity(audio_bytes)[0], command)
 
     @staticmethod  
     def detect_menu_command_fast(transcript: str) -> str:
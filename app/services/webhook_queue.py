@@ -0,0 +1,223 @@
+# app/services/webhook_queue.py
+
+"""
+LINE Webhook 非同步處理佇列。
+
+/callback 只負責驗證簽章並把事件丟進佇列，立即回覆 200；
+實際的事件處理交給背景 worker 執行。
+
+- 每個 worker 擁有自己的有界佇列，事件依 user_id 雜湊分配，
+  因此同一位使用者的事件一定由同一個 worker 依序處理。
+- 一次 Webhook 請求中的事件全部入列或全部不入列，避免 LINE 重送整批時部分事件被處理兩次。
+- 事件處理函式以 register_event_handler 註冊，同時登記到 LINE WebhookHandler（同步模式）與佇列（非同步模式）。
+- 提供佇列深度與處理延遲（lag）統計，供健康檢查端點使用。
+
+注意：gunicorn 目前為單一 worker process，佇列存在於該行程記憶體中。
+在 Cloud Run 上需開啟「CPU 一律分配」，背景 worker 才能在回應後繼續執行。
+"""
+
+import queue
+import threading
+import time
+import traceback
+import zlib
+
+from linebot.models import MessageEvent
+
+
+class WebhookQueueFullError(Exception):
+    """佇列已滿，無法在時限內放入事件。"""
+
+
+# 事件處理函式：key 與 WebhookHandler 相同（Event 或 Event_Message 類別名稱）
+_event_handlers = {}
+
+def register_event_handler(line_handler, event, message=None):
+    """
+    註冊事件處理函式的 decorator，用法與 line_handler.add 相同。
+    同步模式由 line_handler 處理，非同步模式由 WebhookDispatcher 依此表分派。
+    """
+    def decorator(func):
+        line_handler.add(event, message=message)(func)
+        if message is None:
+            _event_handlers[event.__name__] = func
+        else:
+            messages = message if isinstance(message, (list, tuple)) else [message]
+            for message_class in messages:
+                _event_handlers[f"{event.__name__}_{message_class.__name__}"] = func
+        return func
+    return decorator
+
+
+class WebhookDispatcher:
+    """以 user_id 分片的有界事件佇列與 worker 池。"""
+
+    def __init__(self, app, line_handler, num_workers=4, queue_size=100, enqueue_timeout=2.0):
+        self.app = app
+        self.line_handler = line_handler
+        self.num_workers = max(1, num_workers)
+        self.queue_size = queue_size
+        self.enqueue_timeout = enqueue_timeout
+
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(self.num_workers)]
+        # 入列只在持有此鎖時進行；worker 只會取出事件，所以檢查到的剩餘空間在放入前不會變少
+        self._submit_lock = threading.Lock()
+        self._threads = []
+        self._started = False
+        self._start_lock = threading.Lock()
+
+        # 統計資料
+        self._stats_lock = threading.Lock()
+        self._enqueued = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._lag_last = 0.0
+        self._lag_max = 0.0
+        self._lag_total = 0.0
+
+    def start(self):
+        """啟動背景 worker（重複呼叫不會重複啟動）。"""
+        with self._start_lock:
+            if self._started:
+                return
+            for index in range(self.num_workers):
+                t = threading.Thread(target=self._worker_loop, args=(index,),
+                                     name=f"webhook-worker-{index}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            self._started = True
+            print(f"Webhook 佇列已啟動：{self.num_workers} 個 worker，每個佇列上限 {self.queue_size}")
+
+    # --- 入列 ---
+    @staticmethod
+    def _ordering_key(event):
+        source = getattr(event, 'source', None)
+        if source is None:
+            return ''
+        return (getattr(source, 'user_id', None)
+                or getattr(source, 'group_id', None)
+                or getattr(source, 'room_id', None)
+                or '')
+
+    def _shard_for(self, key):
+        return zlib.crc32(key.encode('utf-8')) % self.num_workers
+
+    def submit(self, body, signature):
+        """
+        驗證簽章並將事件放入佇列。
+        簽章錯誤時拋出 InvalidSignatureError；佇列已滿時拋出 WebhookQueueFullError。
+        整批事件全部入列或全部不入列：任一分片空間不足時整批拒絕，LINE 重送時不會重複處理已入列的事件。
+        """
+        payload = self.line_handler.parser.parse(body, signature, as_payload=True)
+        by_shard = {}
+        for event in payload.events:
+            by_shard.setdefault(self._shard_for(self._ordering_key(event)), []).append(event)
+        if not by_shard:
+            return 0
+
+        deadline = time.monotonic() + self.enqueue_timeout
+        while True:
+            with self._submit_lock:
+                short = [shard for shard, events in by_shard.items()
+                         if self.queue_size - self._queues[shard].qsize() < len(events)]
+                if not short:
+                    now = time.monotonic()
+                    for shard, events in by_shard.items():
+                        for event in events:
+                            self._queues[shard].put_nowait((now, event, payload.destination))
+                    with self._stats_lock:
+                        self._enqueued += len(payload.events)
+                    return len(payload.events)
+            # 單一分片的事件數超過佇列上限時永遠放不下，不必等待
+            if time.monotonic() >= deadline or any(len(by_shard[shard]) > self.queue_size for shard in short):
+                with self._stats_lock:
+                    self._rejected += len(payload.events)
+                raise WebhookQueueFullError(f"Webhook 佇列 {short} 已滿（上限 {self.queue_size}）")
+            time.sleep(0.05)
+
+    # --- 處理 ---
+    @staticmethod
+    def _find_handler_func(event):
+        """與 WebhookHandler.handle 相同的對應規則：先找 Event_Message，再找 Event。"""
+        func = None
+        if isinstance(event, MessageEvent):
+            func = _event_handlers.get(f"{event.__class__.__name__}_{event.message.__class__.__name__}")
+        if func is None:
+            func = _event_handlers.get(event.__class__.__name__)
+        return func
+
+    def _worker_loop(self, index):
+        q = self._queues[index]
+        while True:
+            enqueued_at, event, destination = q.get()
+            lag = time.monotonic() - enqueued_at
+            with self._stats_lock:
+                self._lag_last = lag
+                self._lag_max = max(self._lag_max, lag)
+                self._lag_total += lag
+            try:
+                func = self._find_handler_func(event)
+                if func is None:
+                    print(f"Webhook 事件沒有對應的處理函式: {event.__class__.__name__}")
+                else:
+                    with self.app.app_context():
+                        func(event)
+                with self._stats_lock:
+                    self._processed += 1
+            except Exception as e:
+                with self._stats_lock:
+                    self._failed += 1
+                print(f"背景處理 Webhook 事件時發生錯誤: {e}")
+                traceback.print_exc()
+            finally:
+                q.task_done()
+
+    def stats(self):
+        """回傳佇列深度與延遲統計。"""
+        now = time.monotonic()
+        depths = []
+        oldest = []
+        for q in self._queues:
+            with q.mutex:
+                depths.append(len(q.queue))
+                if q.queue:
+                    oldest.append(now - q.queue[0][0])
+        with self._stats_lock:
+            dequeued = self._processed + self._failed
+            return {
+                'workers': self.num_workers,
+                'queue_size': self.queue_size,
+                'depth': sum(depths),
+                'depth_per_worker': depths,
+                'enqueued': self._enqueued,
+                'processed': self._processed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'lag_last_ms': round(self._lag_last * 1000, 2),
+                'lag_max_ms': round(self._lag_max * 1000, 2),
+                'lag_avg_ms': round(self._lag_total / dequeued * 1000, 2) if dequeued else 0.0,
+                'oldest_pending_ms': round(max(oldest) * 1000, 2) if oldest else 0.0,
+            }
+
+
+_dispatcher = None
+
+def init_webhook_queue(app, line_handler):
+    """建立並啟動行程共用的 WebhookDispatcher；若設定為同步模式則不建立。"""
+    global _dispatcher
+    if not app.config.get('WEBHOOK_ASYNC_ENABLED', True):
+        return None
+    if _dispatcher is None:
+        _dispatcher = WebhookDispatcher(
+            app,
+            line_handler,
+            num_workers=app.config.get('WEBHOOK_WORKERS', 4),
+            queue_size=app.config.get('WEBHOOK_QUEUE_SIZE', 100),
+            enqueue_timeout=app.config.get('WEBHOOK_ENQUEUE_TIMEOUT', 2.0)
+        )
+        _dispatcher.start()
+    return _dispatcher
+
+def get_webhook_dispatcher():
+    return _dispatcher
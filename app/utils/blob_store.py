@@ -0,0 +1,175 @@
+# app/utils/blob_store.py
+
+"""
+以內容定址（SHA-256）的圖片暫存區。
+
+藥單照片不再以 base64 塞進 user_temp_state 的 JSON，而是原始 bytes 存在這裡，
+狀態中只保留雜湊值（state["last_task"]["image_refs"]）。
+
+- FileSystemBlobStore：本地檔案系統；適合本地開發或單一實例
+- GCSBlobStore：Google Cloud Storage；Cloud Run 多實例時 LIFF 上傳與 webhook 可能落在不同實例，需使用此後端
+
+透過環境變數選擇：BLOB_STORE_BACKEND=fs|gcs（預設：Cloud Run 且有設定 bucket 時用 gcs，否則 fs）
+
+鍵值是內容雜湊，同一張照片在多個任務（重傳、家人共用同一張藥單照片）中共用同一個鍵，
+因此分析完成後不主動刪除，一律依保存時間清除：
+- fs：超過 BLOB_STORE_MAX_AGE_SECONDS 後自動清除
+- gcs：每次存入都會更新物件的 customTime；請在 bucket 設定生命週期規則，
+  刪除 BLOB_STORE_PREFIX 下 customTime 超過 1 天的物件，例如
+  gsutil lifecycle set lifecycle.json gs://<bucket>，lifecycle.json：
+  {"rule": [{"action": {"type": "Delete"}, "condition": {"daysSinceCustomTime": 1, "matchesPrefix": ["prescription_blobs/"]}}]}
+"""
+
+import abc
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class BlobStore(abc.ABC):
+    """Blob store 介面。"""
+
+    @staticmethod
+    def digest(data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    @abc.abstractmethod
+    def put(self, data: bytes) -> str:
+        """存入內容並回傳其雜湊值。"""
+
+    @abc.abstractmethod
+    def get(self, key: str):
+        """取回內容；不存在時回傳 None。"""
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        """刪除內容；不存在時不做任何事。"""
+
+
+class FileSystemBlobStore(BlobStore):
+    def __init__(self, root, max_age_seconds=24 * 3600, prune_interval=600):
+        self.root = root
+        self.max_age_seconds = max_age_seconds
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+        self._prune_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def put(self, data: bytes) -> str:
+        key = self.digest(data)
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # 先寫入暫存檔再 rename，避免其他執行緒讀到寫一半的檔案
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+        else:
+            # 重複上傳同一張圖時更新時間，避免被清理
+            os.utime(path, None)
+        self._maybe_prune()
+        return key
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def delete(self, key: str):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _maybe_prune(self):
+        """定期清除超過保存時間的檔案。"""
+        now = time.time()
+        if now - self._last_prune < self.prune_interval or not self._prune_lock.acquire(blocking=False):
+            return
+        try:
+            self._last_prune = now
+            cutoff = now - self.max_age_seconds
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    path = os.path.join(dirpath, name)
+                    try:
+                        if os.path.getmtime(path) < cutoff:
+                            os.remove(path)
+                    except OSError:
+                        pass
+        finally:
+            self._prune_lock.release()
+
+
+class GCSBlobStore(BlobStore):
+    def __init__(self, bucket_name, prefix='prescription_blobs/'):
+        from google.cloud import storage
+        self._bucket = storage.Client().bucket(bucket_name)
+        self.prefix = prefix
+
+    def put(self, data: bytes) -> str:
+        key = self.digest(data)
+        blob = self._bucket.blob(f"{self.prefix}{key}")
+        blob.custom_time = datetime.now(timezone.utc)
+        if not blob.exists():
+            blob.upload_from_string(data, content_type='application/octet-stream')
+        else:
+            # 重複上傳同一張圖時更新 customTime，生命週期規則以此計算保存時間，避免被提早刪除
+            blob.patch()
+        return key
+
+    def get(self, key: str):
+        from google.api_core.exceptions import NotFound
+        try:
+            return self._bucket.blob(f"{self.prefix}{key}").download_as_bytes()
+        except NotFound:
+            return None
+
+    def delete(self, key: str):
+        from google.api_core.exceptions import NotFound
+        try:
+            self._bucket.blob(f"{self.prefix}{key}").delete()
+        except NotFound:
+            pass
+
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_blob_store() -> BlobStore:
+    """取得行程共用的 blob store。"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                bucket = os.environ.get('BLOB_STORE_BUCKET') or os.environ.get('GCS_BUCKET_NAME')
+                is_cloud_run = os.environ.get('K_SERVICE') is not None
+                default_backend = 'gcs' if bucket and is_cloud_run else 'fs'
+                backend = os.environ.get('BLOB_STORE_BACKEND', default_backend).lower()
+                if backend != 'gcs' and is_cloud_run:
+                    print("⚠️ Blob store 警告：Cloud Run 上使用本地檔案系統，圖片只存在於單一實例，"
+                          "LIFF 上傳與 webhook 落在不同實例時會找不到圖片；請設定 BLOB_STORE_BUCKET")
+                if backend == 'gcs':
+                    _store = GCSBlobStore(bucket, prefix=os.environ.get('BLOB_STORE_PREFIX', 'prescription_blobs/'))
+                else:
+                    _store = FileSystemBlobStore(
+                        os.environ.get('BLOB_STORE_PATH', os.path.join(tempfile.gettempdir(), 'prescription_blobs')),
+                        max_age_seconds=int(os.environ.get('BLOB_STORE_MAX_AGE_SECONDS', 24 * 3600))
+                    )
+                print(f"Blob store 後端: {backend}")
+    return _store
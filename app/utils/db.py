@@ -9,47 +9,281 @@ from zoneinfo import ZoneInfo
 import random
 import string
 import time
+import threading
+import uuid
+from collections import deque
 import pytz
 from typing import Optional, Dict, Any
 
 # --- 資料庫連線管理 ---
 
+def _build_connect_kwargs():
+    """依執行環境組出 pymysql.connect 的參數（Cloud Run 走 Unix socket，其餘走 TCP）。"""
+    socket_path = os.environ.get("DB_SOCKET_PATH")
+    is_cloud_run = os.environ.get('K_SERVICE') is not None
+
+    kwargs = dict(
+        user=os.environ.get('DB_USER'),
+        password=os.environ.get('DB_PASS'),
+        database=os.environ.get('DB_NAME'),
+        charset='utf8mb4',
+        cursorclass=pymysql.cursors.DictCursor,
+        connect_timeout=10,
+        autocommit=False
+    )
+    if socket_path and is_cloud_run:
+        # 在 Cloud Run 中使用 Cloud SQL Auth Proxy 的 Unix socket
+        kwargs['unix_socket'] = socket_path
+    else:
+        # 使用 TCP 連線（本地開發或其他環境）
+        kwargs['host'] = os.environ.get('DB_HOST', 'localhost')
+        kwargs['port'] = int(os.environ.get('DB_PORT', 3306))
+    return kwargs
+
+
+class PoolTimeoutError(Exception):
+    """在等待時間內無法從連線池取得連線。"""
+
+
+class ConnectionPool:
+    """
+    執行緒安全的 MySQL 連線池。
+
+    - pool_size: 常駐（可閒置保留）的連線數上限
+    - max_overflow: 尖峰時可額外建立的連線數，歸還後直接關閉
+    - timeout: 連線全數借出時最多等待的秒數
+    - recycle: 連線最長存活秒數，超過即汰換
+    - idle_timeout: 閒置超過此秒數的連線會被回收
+    - pre_ping_after: 閒置超過此秒數的連線在借出前先 ping 檢查
+    """
+
+    def __init__(self, connect_kwargs, pool_size=5, max_overflow=3, timeout=10,
+                 recycle=1800, idle_timeout=300, pre_ping_after=30):
+        self._connect_kwargs = connect_kwargs
+        self.pool_size = pool_size
+        self.max_overflow = max_overflow
+        self.timeout = timeout
+        self.recycle = recycle
+        self.idle_timeout = idle_timeout
+        self.pre_ping_after = pre_ping_after
+
+        self._cond = threading.Condition(threading.Lock())
+        self._idle = deque()   # (conn, created_at, last_used)
+        self._meta = {}        # id(conn) -> created_at（僅記錄借出中的連線）
+        self._total = 0        # 目前存在的連線總數（閒置 + 借出）
+        self._waiters = 0
+
+        # 統計資料
+        self._checkouts = 0
+        self._wait_count = 0
+        self._wait_time_total = 0.0
+        self._wait_time_max = 0.0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+
+    # --- 內部工具 ---
+    def _new_connection(self):
+        conn = pymysql.connect(**self._connect_kwargs)
+        self._created += 1
+        return conn
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def _reap_idle_locked(self, now):
+        """移除閒置過久或超過存活時間的連線（需持有鎖）。"""
+        expired = []
+        kept = deque()
+        for conn, created_at, last_used in self._idle:
+            if now - last_used > self.idle_timeout or now - created_at > self.recycle:
+                expired.append(conn)
+            else:
+                kept.append((conn, created_at, last_used))
+        self._idle = kept
+        self._total -= len(expired)
+        self._discarded += len(expired)
+        return expired
+
+    def _is_healthy(self, conn, created_at, last_used, now):
+        if now - created_at > self.recycle:
+            return False
+        if now - last_used > self.pre_ping_after:
+            try:
+                conn.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    # --- 對外介面 ---
+    def acquire(self):
+        """借出一條連線；若池已滿則等待，逾時拋出 PoolTimeoutError。"""
+        start = time.monotonic()
+        waited = False
+        while True:
+            with self._cond:
+                expired = self._reap_idle_locked(time.monotonic())
+                candidate = None
+                if self._idle:
+                    # 後進先出，優先使用最近歸還（最可能仍存活）的連線
+                    candidate = self._idle.pop()
+                elif self._total < self.pool_size + self.max_overflow:
+                    self._total += 1
+                else:
+                    remaining = self.timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeoutError(
+                            f"等待資料庫連線逾時 ({self.timeout}s)，使用中 {self._total}/{self.pool_size + self.max_overflow}"
+                        )
+                    waited = True
+                    self._waiters += 1
+                    try:
+                        self._cond.wait(remaining)
+                    finally:
+                        self._waiters -= 1
+                    for conn in expired:
+                        self._close_quietly(conn)
+                    continue
+
+            for conn in expired:
+                self._close_quietly(conn)
+
+            if candidate is not None:
+                conn, created_at, last_used = candidate
+                if not self._is_healthy(conn, created_at, last_used, time.monotonic()):
+                    self._close_quietly(conn)
+                    with self._cond:
+                        self._total -= 1
+                        self._discarded += 1
+                    continue
+            else:
+                # 已預留名額，於鎖外建立新連線
+                try:
+                    conn = self._new_connection()
+                except Exception:
+                    with self._cond:
+                        self._total -= 1
+                        self._cond.notify()
+                    raise
+                created_at = time.monotonic()
+
+            with self._cond:
+                self._meta[id(conn)] = created_at
+                self._checkouts += 1
+                if waited:
+                    elapsed = time.monotonic() - start
+                    self._wait_count += 1
+                    self._wait_time_total += elapsed
+                    self._wait_time_max = max(self._wait_time_max, elapsed)
+            return conn
+
+    def release(self, conn):
+        """歸還連線；未提交的交易會先 rollback，超出常駐數量的連線直接關閉。"""
+        healthy = True
+        try:
+            if conn.open:
+                conn.rollback()
+            else:
+                healthy = False
+        except Exception:
+            healthy = False
+
+        now = time.monotonic()
+        with self._cond:
+            created_at = self._meta.pop(id(conn), now)
+            if healthy and len(self._idle) < self.pool_size and now - created_at <= self.recycle:
+                self._idle.append((conn, created_at, now))
+                conn = None
+            else:
+                self._total -= 1
+                self._discarded += 1
+            self._cond.notify()
+
+        if conn is not None:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """回傳連線池目前的使用狀況與等待統計。"""
+        with self._cond:
+            idle = len(self._idle)
+            return {
+                'size': self.pool_size,
+                'max_overflow': self.max_overflow,
+                'total': self._total,
+                'idle': idle,
+                'in_use': self._total - idle,
+                'waiters': self._waiters,
+                'checkouts': self._checkouts,
+                'created': self._created,
+                'discarded': self._discarded,
+                'timeouts': self._timeouts,
+                'wait_count': self._wait_count,
+                'wait_time_avg_ms': round(self._wait_time_total / self._wait_count * 1000, 2) if self._wait_count else 0.0,
+                'wait_time_max_ms': round(self._wait_time_max * 1000, 2),
+            }
+
+    def dispose(self):
+        """關閉所有閒置連線（借出中的連線會在歸還時關閉）。"""
+        with self._cond:
+            idle = [item[0] for item in self._idle]
+            self._idle.clear()
+            self._total -= len(idle)
+            self.pool_size = 0
+        for conn in idle:
+            self._close_quietly(conn)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """取得（必要時建立）行程共用的連線池。"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                from config import Config
+                _pool = ConnectionPool(
+                    _build_connect_kwargs(),
+                    pool_size=Config.DB_POOL_SIZE,
+                    max_overflow=Config.DB_POOL_MAX_OVERFLOW,
+                    timeout=Config.DB_POOL_TIMEOUT,
+                    recycle=Config.DB_POOL_RECYCLE,
+                    idle_timeout=Config.DB_POOL_IDLE_TIMEOUT,
+                    pre_ping_after=Config.DB_POOL_PRE_PING_AFTER
+                )
+    return _pool
+
+# --- 提醒變更通知 ---
+# 排程器等模組可註冊 listener，在提醒新增/修改/刪除並 commit 之後收到通知。
+# listener(schedule_ids) 的 schedule_ids 為受影響的提醒 id 列表；None 代表無法確定範圍，需全部重新載入。
+_schedule_change_listeners = []
+
+def add_schedule_change_listener(listener):
+    if listener not in _schedule_change_listeners:
+        _schedule_change_listeners.append(listener)
+
+def _notify_schedule_change(schedule_ids=None):
+    for listener in list(_schedule_change_listeners):
+        try:
+            listener(schedule_ids)
+        except Exception as e:
+            print(f"提醒變更通知失敗: {e}")
+
 def get_db_connection():
-    """從 Flask 的 g 物件取得資料庫連線，若不存在則建立新連線。"""
+    """從 Flask 的 g 物件取得資料庫連線，若不存在則從連線池借出一條。"""
     try:
         if 'db' not in g:
-            # 檢查是否在 Cloud Run 環境中使用 Unix socket
-            socket_path = os.environ.get("DB_SOCKET_PATH")
-            is_cloud_run = os.environ.get('K_SERVICE') is not None
-            
-            if socket_path and is_cloud_run:
-                # 在 Cloud Run 中使用 Cloud SQL Auth Proxy 的 Unix socket
-                g.db = pymysql.connect(
-                    user=os.environ.get('DB_USER'),
-                    password=os.environ.get('DB_PASS'),
-                    database=os.environ.get('DB_NAME'),
-                    unix_socket=socket_path,
-                    charset='utf8mb4',
-                    cursorclass=pymysql.cursors.DictCursor,
-                    connect_timeout=10
-                )
-            else:
-                # 使用 TCP 連線（本地開發或其他環境）
-                db_host = os.environ.get('DB_HOST', 'localhost')
-                db_port = int(os.environ.get('DB_PORT', 3306))
-                
-                g.db = pymysql.connect(
-                    host=db_host,
-                    user=os.environ.get('DB_USER'),
-                    password=os.environ.get('DB_PASS'),
-                    database=os.environ.get('DB_NAME'),
-                    port=db_port,
-                    charset='utf8mb4',
-                    cursorclass=pymysql.cursors.DictCursor,
-                    connect_timeout=10,
-                    autocommit=False
-                )
+            g.db = get_pool().acquire()
         return g.db
+    except PoolTimeoutError as e:
+        print(f"資料庫連線池已滿: {e}")
+        return None
     except pymysql.MySQLError as e:
         print(f"資料庫連線錯誤: {e}")
         print(f"連線參數: host={os.environ.get('DB_HOST')}, port={os.environ.get('DB_PORT')}, user={os.environ.get('DB_USER')}, database={os.environ.get('DB_NAME')}")
@@ -59,10 +293,10 @@ def get_db_connection():
         return None
 
 def close_db_connection(e=None):
-    """關閉 g 物件中儲存的資料庫連線。"""
+    """將 g 物件中儲存的資料庫連線歸還給連線池。"""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_pool().release(db)
 
 def init_app(app):
     """註冊資料庫關閉函式到 Flask app。"""
@@ -140,6 +374,37 @@ class DB:
             cursor.execute("DELETE FROM user_temp_state WHERE recorder_id = %s", (user_id,))
             db.commit()
 
+    @staticmethod
+    def load_user_event_state(user_id):
+        """
+        一次查詢取得使用者資料、簡單狀態與複雜狀態，供單一事件的快取使用。
+        回傳 {'user_exists', 'user_name', 'simple_state', 'complex_state'}；連線失敗時回傳 None。
+        """
+        db = get_db_connection()
+        if not db: return None
+        with db.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    (SELECT user_name FROM users WHERE recorder_id = %s) AS user_name,
+                    EXISTS(SELECT 1 FROM users WHERE recorder_id = %s) AS user_exists,
+                    (SELECT state FROM state WHERE recorder_id = %s AND expires_at > UTC_TIMESTAMP()) AS simple_state,
+                    (SELECT state_data FROM user_temp_state WHERE recorder_id = %s) AS state_data
+            """, (user_id, user_id, user_id, user_id))
+            row = cursor.fetchone() or {}
+
+        complex_state = {"state_info": {}, "last_task": {}}
+        if row.get('state_data'):
+            try:
+                complex_state = json.loads(row['state_data'])
+            except (json.JSONDecodeError, TypeError):
+                pass
+        return {
+            'user_exists': bool(row.get('user_exists')),
+            'user_name': row.get('user_name'),
+            'simple_state': row.get('simple_state'),
+            'complex_state': complex_state
+        }
+
     # --- 使用者與成員管理 (整合) ---
     @staticmethod
     def get_or_create_user(user_id, user_name):
@@ -365,6 +630,7 @@ class DB:
         """删除家人绑定关系並清理相關資料"""
         db = get_db_connection()
         if not db: return 0
+        DB.ensure_reminder_slots_table()
         with db.cursor() as cursor:
             # 獲取綁定關係資訊
             cursor.execute("SELECT relation_type FROM invitation_recipients WHERE recorder_id = %s AND recipient_line_id = %s", (user_id, recipient_id))
@@ -391,11 +657,14 @@ class DB:
                 cursor.execute("DELETE FROM medication_main WHERE recorder_id = %s AND member = %s", (user_id, relation_type))
                 
                 # 2. 刪除相關的用藥提醒
+                DB._delete_reminder_slots_for_member(cursor, user_id, relation_type)
                 cursor.execute("DELETE FROM medicine_schedule WHERE recorder_id = %s AND member = %s", (user_id, relation_type))
             
             # 刪除綁定關係
             cursor.execute("DELETE FROM invitation_recipients WHERE recorder_id = %s AND recipient_line_id = %s", (user_id, recipient_id))
             db.commit()
+            if binding:
+                _notify_schedule_change(None)
             return cursor.rowcount
 
     # --- 藥單與藥歷 (來自您) ---
@@ -535,12 +804,121 @@ class DB:
             if med_details: result['days_supply'] = med_details[0].get('days')
             return result
 
+    # --- 提醒時段索引 (reminder_slots) ---
+    # medicine_schedule 的 time_slot_1~5 攤平成 (minute_of_day, schedule_id)，
+    # 讓排程器每分鐘的查詢走索引，而不是對整張表做 DATE_FORMAT 掃描。
+    # 所有行程的寫入端只要資料表存在就一定同步更新索引；ensure 會以 medicine_schedule 完整校正一次，
+    # 因此本行程 ensure 成功後，索引即為完整，讀取端才會使用，否則退回舊的全表查詢。
+    _reminder_slots_ready = False
+
+    _SLOT_PROJECTION_SQL = """
+        SELECT id AS schedule_id, HOUR(time_slot_1) * 60 + MINUTE(time_slot_1) AS minute_of_day FROM medicine_schedule WHERE {where} AND time_slot_1 IS NOT NULL
+        UNION ALL SELECT id, HOUR(time_slot_2) * 60 + MINUTE(time_slot_2) FROM medicine_schedule WHERE {where} AND time_slot_2 IS NOT NULL
+        UNION ALL SELECT id, HOUR(time_slot_3) * 60 + MINUTE(time_slot_3) FROM medicine_schedule WHERE {where} AND time_slot_3 IS NOT NULL
+        UNION ALL SELECT id, HOUR(time_slot_4) * 60 + MINUTE(time_slot_4) FROM medicine_schedule WHERE {where} AND time_slot_4 IS NOT NULL
+        UNION ALL SELECT id, HOUR(time_slot_5) * 60 + MINUTE(time_slot_5) FROM medicine_schedule WHERE {where} AND time_slot_5 IS NOT NULL
+    """
+
+    @staticmethod
+    def ensure_reminder_slots_table():
+        """
+        建立 reminder_slots 表並與 medicine_schedule 完整校正（每個行程成功一次即可，失敗時下次呼叫會重試）。
+        此函式會 commit，必須在呼叫端開始寫入之前呼叫。
+        """
+        if DB._reminder_slots_ready:
+            return True
+        db = get_db_connection()
+        if not db: return False
+        try:
+            with db.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS reminder_slots (
+                        minute_of_day SMALLINT UNSIGNED NOT NULL COMMENT '一天中的第幾分鐘 (0-1439)',
+                        schedule_id INT NOT NULL COMMENT 'medicine_schedule.id',
+                        PRIMARY KEY (minute_of_day, schedule_id),
+                        INDEX idx_schedule_id (schedule_id)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+                """)
+                # 補上缺少的時段，並清除與目前時段不符（提醒已刪除或時間已變更）的索引
+                cursor.execute(
+                    "INSERT IGNORE INTO reminder_slots (schedule_id, minute_of_day) "
+                    + DB._SLOT_PROJECTION_SQL.format(where="1 = 1")
+                )
+                cursor.execute(
+                    "DELETE rs FROM reminder_slots rs LEFT JOIN ("
+                    + DB._SLOT_PROJECTION_SQL.format(where="1 = 1")
+                    + ") p ON p.schedule_id = rs.schedule_id AND p.minute_of_day = rs.minute_of_day "
+                    "WHERE p.schedule_id IS NULL"
+                )
+            db.commit()
+            DB._reminder_slots_ready = True
+            return True
+        except Exception as e:
+            print(f"建立 reminder_slots 索引表失敗: {e}")
+            db.rollback()
+            return False
+
+    @staticmethod
+    def _execute_slot_maintenance(cursor, sql, params):
+        """
+        在呼叫端的交易中更新 reminder_slots。
+        不論本行程的 ensure 是否成功都會執行，只有資料表尚未建立時才略過（建表時會完整補齊）；
+        其他錯誤照常拋出，讓整筆寫入回滾，避免其他行程讀到過期的索引。
+        """
+        try:
+            cursor.execute(sql, params)
+        except pymysql.err.ProgrammingError as e:
+            if DB._reminder_slots_ready or e.args[0] != 1146:   # 1146: Table doesn't exist
+                raise
+
+    @staticmethod
+    def _sync_reminder_slots(cursor, schedule_id):
+        """依 medicine_schedule 目前的時段重建單一提醒的索引（與呼叫端同一個交易）。"""
+        DB._execute_slot_maintenance(cursor, "DELETE FROM reminder_slots WHERE schedule_id = %s", (schedule_id,))
+        DB._execute_slot_maintenance(
+            cursor,
+            "INSERT IGNORE INTO reminder_slots (schedule_id, minute_of_day) "
+            + DB._SLOT_PROJECTION_SQL.format(where="id = %s"),
+            (schedule_id,) * 5
+        )
+
+    @staticmethod
+    def _delete_reminder_slots_for_member(cursor, user_id, member_name):
+        """刪除某成員所有提醒的時段索引（需在刪除 medicine_schedule 之前呼叫）。"""
+        DB._execute_slot_maintenance(cursor, """
+            DELETE rs FROM reminder_slots rs
+            INNER JOIN medicine_schedule ms ON ms.id = rs.schedule_id
+            WHERE ms.recorder_id = %s AND ms.member = %s
+        """, (user_id, member_name))
+
+    @staticmethod
+    def get_reminder_slot_minutes(schedule_ids=None):
+        """
+        直接從 medicine_schedule 攤平出 (schedule_id, minute_of_day)。
+        schedule_ids 為 None 時回傳全部提醒。
+        """
+        db = get_db_connection()
+        if not db: return None
+        with db.cursor() as cursor:
+            if schedule_ids is None:
+                cursor.execute(DB._SLOT_PROJECTION_SQL.format(where="1 = 1"))
+            else:
+                if not schedule_ids:
+                    return []
+                placeholders = ", ".join(["%s"] * len(schedule_ids))
+                cursor.execute(
+                    DB._SLOT_PROJECTION_SQL.format(where=f"id IN ({placeholders})"),
+                    tuple(schedule_ids) * 5
+                )
+            return [(row['schedule_id'], row['minute_of_day']) for row in cursor.fetchall()]
+
     # --- 提醒 (Reminder) 相關 (來自組員) ---
     @staticmethod
     def create_reminder(data):
         # 整合組員的 create 和 update 邏輯
         db = get_db_connection()
         if not db: return None
+        DB.ensure_reminder_slots_table()
         
         # 添加調試日誌
         print(f"[DEBUG] 創建提醒資料: {data}")
@@ -573,8 +951,10 @@ class DB:
                 print(f"[DEBUG] 更新 SQL 參數: {update_params}")
                 try:
                     cursor.execute(update_sql, update_params)
+                    DB._sync_reminder_slots(cursor, existing_reminder['id'])
                     db.commit()
                     reminder_id = existing_reminder['id']
+                    _notify_schedule_change([reminder_id])
                     print(f"[DEBUG] 更新的提醒 ID: {reminder_id}")
                     return reminder_id
                 except Exception as e:
@@ -600,8 +980,10 @@ class DB:
                 print(f"[DEBUG] 插入 SQL 參數: {insert_params}")
                 try:
                     cursor.execute(insert_sql, insert_params)
-                    db.commit()
                     reminder_id = cursor.lastrowid
+                    DB._sync_reminder_slots(cursor, reminder_id)
+                    db.commit()
+                    _notify_schedule_change([reminder_id])
                     print(f"[DEBUG] 創建的提醒 ID: {reminder_id}")
                     return reminder_id
                 except Exception as e:
@@ -645,6 +1027,7 @@ class DB:
         """更新指定提醒"""
         db = get_db_connection()
         if not db: return None
+        DB.ensure_reminder_slots_table()
         try:
             with db.cursor() as cursor:
                 # 構建更新 SQL
@@ -664,10 +1047,15 @@ class DB:
                     reminder_data.get('time_slot_5'), reminder_id, reminder_data.get('recorder_id')
                 )
                 cursor.execute(sql, params)
+                updated = cursor.rowcount
+                if updated > 0:
+                    DB._sync_reminder_slots(cursor, reminder_id)
                 db.commit()
+                if updated > 0:
+                    _notify_schedule_change([reminder_id])
                 
                 # 返回更新的行數，如果大於0表示成功
-                if cursor.rowcount > 0:
+                if updated > 0:
                     return reminder_id
                 else:
                     return None
@@ -681,11 +1069,16 @@ class DB:
         """删除指定提醒"""
         db = get_db_connection()
         if not db: return 0
+        DB.ensure_reminder_slots_table()
         with db.cursor() as cursor:
             query = "DELETE FROM medicine_schedule WHERE id = %s"
             cursor.execute(query, (reminder_id,))
+            deleted = cursor.rowcount
+            DB._execute_slot_maintenance(cursor, "DELETE FROM reminder_slots WHERE schedule_id = %s", (reminder_id,))
             db.commit()
-            return cursor.rowcount
+            if deleted:
+                _notify_schedule_change([reminder_id])
+            return deleted
 
     @staticmethod
     def get_member_by_id(member_id):
@@ -712,11 +1105,21 @@ class DB:
         """删除指定成员的所有提醒"""
         db = get_db_connection()
         if not db: return 0
+        DB.ensure_reminder_slots_table()
         with db.cursor() as cursor:
+            cursor.execute(
+                "SELECT id FROM medicine_schedule WHERE recorder_id = %s AND member = %s",
+                (user_id, member_name)
+            )
+            schedule_ids = [row['id'] for row in cursor.fetchall()]
+            DB._delete_reminder_slots_for_member(cursor, user_id, member_name)
             query = "DELETE FROM medicine_schedule WHERE recorder_id = %s AND member = %s"
             cursor.execute(query, (user_id, member_name))
+            deleted = cursor.rowcount
             db.commit()
-            return cursor.rowcount
+            if schedule_ids:
+                _notify_schedule_change(schedule_ids)
+            return deleted
 
     @staticmethod
     def get_prescription_for_liff(mm_id):
@@ -852,11 +1255,9 @@ class DB:
     # --- 藥物資料庫相關 (來自您) ---
     @staticmethod
     def get_all_drug_info():
-        db = get_db_connection()
-        if not db: return []
-        with db.cursor() as cursor:
-            cursor.execute("SELECT drug_id, drug_name_zh, drug_name_en, main_use, side_effects FROM drug_info")
-            return cursor.fetchall()
+        """回傳所有藥品的基本資訊（來自行程內的藥品目錄快取）。"""
+        from .drug_catalog import drug_catalog
+        return [record.to_info_dict() for record in drug_catalog.snapshot().records()]
 
     @staticmethod
     def get_frequency_map():
@@ -869,89 +1270,40 @@ class DB:
     # --- 药丸辨识相关 (集成0705功能) ---
     @staticmethod
     def get_pills_details_by_ids(drug_ids):
-        """从数据库查询多个药丸的详细信息"""
+        """从药品目录快取查询多个药丸的详细信息"""
         if not drug_ids:
             return []
         
-        db = get_db_connection()
-        if not db:
-            return []
-            
-        try:
-            with db.cursor() as cursor:
-                # 构建 IN 查询
-                placeholders = ', '.join(['%s'] * len(drug_ids))
-                sql = f"""
-                    SELECT drug_id, drug_name_en, drug_name_zh, main_use, side_effects, 
-                           shape, color, food_drug_interactions, image_url 
-                    FROM drug_info WHERE drug_id IN ({placeholders})
-                """
-                
-                cursor.execute(sql, drug_ids)
-                results = cursor.fetchall()
-                
-                # 转换字段名以匹配0705的格式
-                details_list = []
-                for row in results:
-                    details_list.append({
-                        'drug_id': row.get('drug_id'),
-                        'drug_name_en': row.get('drug_name_en'),
-                        'drug_name_zh': row.get('drug_name_zh'),
-                        'uses': row.get('main_use'),  # 将 main_use 映射为 uses
-                        'side_effects': row.get('side_effects'),
-                        'shape': row.get('shape'),
-                        'color': row.get('color'),
-                        'interactions': row.get('food_drug_interactions'),  # 映射字段名
-                        'image_url': row.get('image_url')
-                    })
-                
-                return details_list
-                
-        except Exception as e:
-            print(f"查询药品信息失败: {e}")
-            return []
+        from .drug_catalog import drug_catalog
+        by_id = drug_catalog.snapshot().by_id
+        details_list = []
+        for drug_id in dict.fromkeys(drug_ids):
+            record = by_id.get(drug_id)
+            if record:
+                details_list.append(record.to_pill_detail())
+        return details_list
     
     @staticmethod
     def get_pills_details_by_prefix(prefix):
-        """根據藥品ID前綴查詢藥品詳細資訊"""
+        """根據藥品ID前綴查詢藥品詳細資訊（等同 drug_id LIKE 'prefix%'）"""
         if not prefix:
             return []
         
-        db = get_db_connection()
-        if not db:
-            return []
-            
-        try:
-            with db.cursor() as cursor:
-                sql = """
-                    SELECT drug_id, drug_name_en, drug_name_zh, main_use, side_effects, 
-                           shape, color, food_drug_interactions, image_url 
-                    FROM drug_info WHERE drug_id LIKE %s
-                """
-                
-                cursor.execute(sql, (f"{prefix}%",))
-                results = cursor.fetchall()
-                
-                # 轉換字段名以匹配格式
-                details_list = []
-                for row in results:
-                    details_list.append({
-                        'drug_id': row.get('drug_id'),
-                        'drug_name_en': row.get('drug_name_en'),
-                        'drug_name_zh': row.get('drug_name_zh'),
-                        'uses': row.get('main_use'),
-                        'side_effects': row.get('side_effects'),
-                        'shape': row.get('shape'),
-                        'color': row.get('color'),
-                        'interactions': row.get('food_drug_interactions'),
-                        'image_url': row.get('image_url')
-                    })
-                
-                return details_list
-                
-        except Exception as e:
-            print(f"根據前綴查詢藥品信息失敗: {e}")
-            return []
+        from .drug_catalog import drug_catalog
+        return [record.to_pill_detail() for record in drug_catalog.snapshot().find_by_prefix(prefix)]
+
+    @staticmethod
+    def get_pills_details_by_prefixes(prefixes):
+        """
+        一次解析多個藥品ID前綴，回傳 {prefix: [藥品詳細資訊, ...]}。
+        每個前綴的結果等同 get_pills_details_by_prefix(prefix)，查無資料的前綴對應空列表。
+        """
+        from .drug_catalog import drug_catalog
+        snapshot = drug_catalog.snapshot()
+        return {
+            prefix: [record.to_pill_detail() for record in snapshot.find_by_prefix(prefix)]
+            for prefix in dict.fromkeys(prefixes) if prefix
+        }
 
     @staticmethod
     def add_drug_info(drug_id, drug_name_en, drug_name_zh, main_use, side_effects, shape, color, interactions, image_url):
@@ -983,7 +1335,9 @@ class DB:
                     shape, color, interactions, image_url
                 ))
                 db.commit()
-                return True
+            from .drug_catalog import drug_catalog
+            drug_catalog.invalidate()
+            return True
                 
         except Exception as e:
             print(f"新增/更新药品信息失败: {e}")
@@ -991,9 +1345,36 @@ class DB:
     
     # --- 排程器專用查詢 ---
     @staticmethod
-    def get_reminders_for_scheduler(current_time_str):
+    def get_reminders_for_scheduler(current_time_str, shard=None, shard_count=None):
+        """
+        查詢某分鐘到期的提醒。指定 shard / shard_count 時，只回傳
+        CRC32(recorder_id) % shard_count == shard 的提醒，讓多個實例分攤同一分鐘的工作。
+        """
         db = get_db_connection()
         if not db: return []
+
+        shard_sql = ""
+        shard_params = ()
+        if shard_count and shard_count > 1:
+            shard_sql = " AND CRC32(ms.recorder_id) %% %s = %s"
+            shard_params = (shard_count, shard)
+
+        if DB.ensure_reminder_slots_table():
+            hour, minute = current_time_str.split(':')
+            minute_of_day = int(hour) * 60 + int(minute)
+            with db.cursor() as cursor:
+                sql = """
+                    SELECT ms.*, 
+                           ir.recipient_line_id as bound_recipient_line_id
+                    FROM reminder_slots rs
+                    INNER JOIN medicine_schedule ms ON ms.id = rs.schedule_id
+                    LEFT JOIN invitation_recipients ir ON ms.recorder_id = ir.recorder_id AND ms.member = ir.relation_type
+                    WHERE rs.minute_of_day = %s
+                """ + shard_sql
+                cursor.execute(sql, (minute_of_day,) + shard_params)
+                return cursor.fetchall()
+
+        # 索引表不可用時，退回全表掃描
         with db.cursor() as cursor:
             sql = """
                 SELECT ms.*, 
@@ -1007,8 +1388,198 @@ class DB:
                     DATE_FORMAT(ms.time_slot_4, '%%H:%%i'),
                     DATE_FORMAT(ms.time_slot_5, '%%H:%%i')
                 )
-            """
-            cursor.execute(sql, (current_time_str,))
+            """ + shard_sql
+            cursor.execute(sql, (current_time_str,) + shard_params)
+            return cursor.fetchall()
+
+    # --- 提醒發送紀錄 (dispatch ledger) ---
+    # reminder_dispatch_log 以 (schedule_id, slot, local_date, minute_of_day) 為主鍵，
+    # 同一分鐘被重複處理（Cloud Scheduler 重試、本地排程器啟動時的檢查）時，INSERT IGNORE 會直接略過。
+    # reminder_dispatch_ticks 記錄已處理過的分鐘，用來找出停機期間漏掉的分鐘。
+    # 補發視窗內重新處理某分鐘時，status 為 failed 或認領逾時仍為 claimed 的紀錄會被重新認領。
+    _dispatch_ledger_ready = False
+    _dispatch_tick_shards = set()   # 已確認有 tick 紀錄的分片
+    DISPATCH_RECLAIM_SECONDS = 120  # 認領超過此秒數仍未完成，視為該批次已中斷
+
+    @staticmethod
+    def ensure_dispatch_ledger_tables():
+        """建立提醒發送紀錄相關資料表（每個行程只執行一次）。"""
+        if DB._dispatch_ledger_ready:
+            return True
+        db = get_db_connection()
+        if not db: return False
+        try:
+            with db.cursor() as cursor:
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS reminder_dispatch_log (
+                        schedule_id INT NOT NULL COMMENT 'medicine_schedule.id',
+                        slot TINYINT UNSIGNED NOT NULL COMMENT '第幾個時段 (1-5)',
+                        local_date DATE NOT NULL COMMENT '台北時間日期',
+                        minute_of_day SMALLINT UNSIGNED NOT NULL COMMENT '一天中的第幾分鐘 (0-1439)',
+                        claim_id CHAR(36) NOT NULL COMMENT '認領此筆的排程執行批次',
+                        status VARCHAR(16) NOT NULL DEFAULT 'claimed' COMMENT 'claimed / sent / failed',
+                        error VARCHAR(255) DEFAULT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        sent_at TIMESTAMP NULL DEFAULT NULL,
+                        PRIMARY KEY (schedule_id, slot, local_date, minute_of_day),
+                        INDEX idx_claim_id (claim_id),
+                        INDEX idx_local_date_status (local_date, status)
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+                """)
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS reminder_dispatch_ticks (
+                        tick_minute DATETIME NOT NULL PRIMARY KEY COMMENT '台北時間，精確到分鐘',
+                        processed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+                """)
+                DB._migrate_dispatch_ticks_shard_key(cursor)
+            db.commit()
+            DB._dispatch_ledger_ready = True
+            return True
+        except Exception as e:
+            print(f"建立提醒發送紀錄表失敗: {e}")
+            db.rollback()
+            return False
+
+    @staticmethod
+    def _migrate_dispatch_ticks_shard_key(cursor):
+        """為 reminder_dispatch_ticks 加上 shard_key 欄位，主鍵改為 (tick_minute, shard_key)；已遷移過則略過。"""
+        cursor.execute("""
+            SELECT COUNT(*) AS cnt FROM information_schema.COLUMNS
+            WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'reminder_dispatch_ticks' AND COLUMN_NAME = 'shard_key'
+        """)
+        if cursor.fetchone()['cnt']:
+            return
+        # 既有的紀錄都是未分片時寫入的，以預設值 all 保留
+        cursor.execute("""
+            ALTER TABLE reminder_dispatch_ticks
+                ADD COLUMN shard_key VARCHAR(16) NOT NULL DEFAULT 'all' COMMENT '分片，例如 0/4；未分片為 all' AFTER tick_minute,
+                DROP PRIMARY KEY,
+                ADD PRIMARY KEY (tick_minute, shard_key)
+        """)
+        print("reminder_dispatch_ticks 已加入 shard_key 欄位")
+
+    @staticmethod
+    def get_processed_dispatch_ticks(start_minute, end_minute, shard_key='all'):
+        """
+        回傳某分片在 [start_minute, end_minute] 之間已處理過的分鐘（naive datetime 集合）。
+        該分片從未記錄過任何分鐘（首次部署或新的分片設定）或查詢失敗時回傳 None，呼叫端不應補發。
+        """
+        db = get_db_connection()
+        if not db: return None
+        try:
+            with db.cursor() as cursor:
+                if shard_key not in DB._dispatch_tick_shards:
+                    cursor.execute("SELECT 1 FROM reminder_dispatch_ticks WHERE shard_key = %s LIMIT 1", (shard_key,))
+                    if cursor.fetchone() is None:
+                        return None
+                    DB._dispatch_tick_shards.add(shard_key)
+                cursor.execute(
+                    "SELECT tick_minute FROM reminder_dispatch_ticks "
+                    "WHERE tick_minute BETWEEN %s AND %s AND shard_key = %s",
+                    (start_minute, end_minute, shard_key)
+                )
+                return {row['tick_minute'] for row in cursor.fetchall()}
+        except Exception as e:
+            print(f"查詢已處理的提醒分鐘失敗: {e}")
+            return None
+
+    @staticmethod
+    def mark_dispatch_ticks_processed(tick_minutes, shard_key='all'):
+        db = get_db_connection()
+        if not db or not tick_minutes: return
+        with db.cursor() as cursor:
+            cursor.executemany(
+                "INSERT IGNORE INTO reminder_dispatch_ticks (tick_minute, shard_key) VALUES (%s, %s)",
+                [(m, shard_key) for m in tick_minutes]
+            )
+            db.commit()
+
+    @staticmethod
+    def claim_reminder_dispatches(keys):
+        """
+        批次認領要發送的提醒。keys 為 [(schedule_id, slot, local_date, minute_of_day)]。
+        已發送或正由其他批次處理中的會被略過；先前發送失敗、或認領超過 DISPATCH_RECLAIM_SECONDS
+        仍未完成（批次中斷）的紀錄會被重新認領。
+        回傳 (claim_id, 本批次成功認領的 key 集合)；資料庫失敗時集合為 None。
+        """
+        claim_id = str(uuid.uuid4())
+        if not keys: return claim_id, set()
+        db = get_db_connection()
+        if not db: return claim_id, None
+        try:
+            with db.cursor() as cursor:
+                cursor.executemany(
+                    "INSERT IGNORE INTO reminder_dispatch_log (schedule_id, slot, local_date, minute_of_day, claim_id) "
+                    "VALUES (%s, %s, %s, %s, %s)",
+                    [(*key, claim_id) for key in keys]
+                )
+                # created_at 記錄最近一次認領的時間
+                cursor.executemany(
+                    "UPDATE reminder_dispatch_log SET claim_id = %s, status = 'claimed', error = NULL, created_at = NOW() "
+                    "WHERE schedule_id = %s AND slot = %s AND local_date = %s AND minute_of_day = %s "
+                    "AND (status = 'failed' OR (status = 'claimed' AND created_at < NOW() - INTERVAL %s SECOND))",
+                    [(claim_id, *key, DB.DISPATCH_RECLAIM_SECONDS) for key in keys]
+                )
+                db.commit()
+                cursor.execute(
+                    "SELECT schedule_id, slot, local_date, minute_of_day FROM reminder_dispatch_log WHERE claim_id = %s",
+                    (claim_id,)
+                )
+                claimed = {
+                    (row['schedule_id'], row['slot'], row['local_date'], row['minute_of_day'])
+                    for row in cursor.fetchall()
+                }
+            return claim_id, claimed
+        except Exception as e:
+            print(f"認領提醒發送紀錄失敗: {e}")
+            db.rollback()
+            return claim_id, None
+
+    @staticmethod
+    def finish_reminder_dispatches(claim_id, failed=None):
+        """
+        將本批次認領的提醒標記為已發送；failed 為 {(schedule_id, local_date, minute_of_day): 錯誤訊息}。
+        """
+        db = get_db_connection()
+        if not db: return
+        try:
+            with db.cursor() as cursor:
+                cursor.execute(
+                    "UPDATE reminder_dispatch_log SET status = 'sent', sent_at = NOW() WHERE claim_id = %s",
+                    (claim_id,)
+                )
+                if failed:
+                    cursor.executemany(
+                        "UPDATE reminder_dispatch_log SET status = 'failed', sent_at = NULL, error = %s "
+                        "WHERE claim_id = %s AND schedule_id = %s AND local_date = %s AND minute_of_day = %s",
+                        [((error or '')[:255], claim_id, schedule_id, local_date, minute_of_day)
+                         for (schedule_id, local_date, minute_of_day), error in failed.items()]
+                    )
+                db.commit()
+        except Exception as e:
+            print(f"更新提醒發送紀錄失敗: {e}")
+            db.rollback()
+
+    @staticmethod
+    def get_dispatch_stats(start_date, end_date):
+        """查詢日期區間內每日的提醒發送統計。"""
+        db = get_db_connection()
+        if not db: return []
+        if not DB.ensure_dispatch_ledger_tables(): return []
+        with db.cursor() as cursor:
+            cursor.execute("""
+                SELECT local_date,
+                       COUNT(*) AS total,
+                       SUM(status = 'sent') AS sent,
+                       SUM(status = 'failed') AS failed,
+                       SUM(status = 'claimed') AS pending,
+                       AVG(CASE WHEN status = 'sent' THEN TIMESTAMPDIFF(SECOND, created_at, sent_at) END) AS avg_send_seconds
+                FROM reminder_dispatch_log
+                WHERE local_date BETWEEN %s AND %s
+                GROUP BY local_date
+                ORDER BY local_date DESC
+            """, (start_date, end_date))
             return cursor.fetchall()
 
     # --- 健康記錄相關方法 ---
@@ -0,0 +1,185 @@
+# app/utils/drug_catalog.py
+
+"""
+行程內共用的 drug_info 藥品目錄快取。
+
+drug_info 是很少變動的參考資料，卻在每次檢視藥歷、藥單比對與藥丸辨識時被整表或逐筆查詢。
+這裡把整張表載入一次，建立 drug_id 與前十碼索引，之後的查詢都在記憶體中完成：
+
+- 每筆藥品以 __slots__ 物件保存，避免每筆一個 dict 的額外記憶體
+- 每 DRUG_CATALOG_CHECK_INTERVAL 秒最多檢查一次版本（CHECKSUM TABLE），版本改變才重新載入；
+  information_schema 的 UPDATE_TIME 在 MySQL 8 會被快取，筆數也無法反映內容修改，因此不採用；
+  另外每 DRUG_CATALOG_MAX_AGE 秒強制重新載入一次
+- DB.add_drug_info 寫入後呼叫 invalidate()，下一次查詢即重新載入
+- 直接向連線池借連線，不需要 Flask app context（排程器執行緒、語音校正也能載入）
+- 載入失敗或查無資料時沿用舊的快照；尚無快照時不快取空目錄，RETRY_SECONDS 秒後再試
+"""
+
+import bisect
+import threading
+import time
+
+from config import Config
+
+PREFIX_LENGTH = 10
+
+
+class DrugRecord:
+    __slots__ = ('drug_id', 'drug_name_en', 'drug_name_zh', 'main_use', 'side_effects',
+                 'shape', 'color', 'food_drug_interactions', 'image_url')
+
+    def __init__(self, row):
+        for field in self.__slots__:
+            setattr(self, field, row.get(field))
+
+    def to_info_dict(self):
+        """DB.get_all_drug_info 的欄位格式。"""
+        return {
+            'drug_id': self.drug_id,
+            'drug_name_zh': self.drug_name_zh,
+            'drug_name_en': self.drug_name_en,
+            'main_use': self.main_use,
+            'side_effects': self.side_effects,
+        }
+
+    def to_pill_detail(self):
+        """藥丸辨識使用的欄位格式（main_use -> uses、food_drug_interactions -> interactions）。"""
+        return {
+            'drug_id': self.drug_id,
+            'drug_name_en': self.drug_name_en,
+            'drug_name_zh': self.drug_name_zh,
+            'uses': self.main_use,
+            'side_effects': self.side_effects,
+            'shape': self.shape,
+            'color': self.color,
+            'interactions': self.food_drug_interactions,
+            'image_url': self.image_url,
+        }
+
+
+class CatalogSnapshot:
+    """某一版本的藥品目錄；建立後不再修改，可在多執行緒間共用。"""
+    __slots__ = ('version', 'loaded_at', 'by_id', 'by_prefix', 'sorted_ids')
+
+    def __init__(self, records, version):
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.by_id = {record.drug_id: record for record in records}
+        self.sorted_ids = sorted(self.by_id)
+        self.by_prefix = {}
+        for drug_id in self.sorted_ids:
+            self.by_prefix.setdefault(drug_id[:PREFIX_LENGTH], []).append(self.by_id[drug_id])
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def records(self):
+        return [self.by_id[drug_id] for drug_id in self.sorted_ids]
+
+    def find_by_prefix(self, prefix):
+        """等同 drug_id LIKE 'prefix%'，依 drug_id 排序。"""
+        if len(prefix) == PREFIX_LENGTH:
+            return list(self.by_prefix.get(prefix, ()))
+        start = bisect.bisect_left(self.sorted_ids, prefix)
+        matches = []
+        for drug_id in self.sorted_ids[start:]:
+            if not drug_id.startswith(prefix):
+                break
+            matches.append(self.by_id[drug_id])
+        return matches
+
+
+_EMPTY = CatalogSnapshot([], None)
+
+
+class DrugCatalog:
+    RETRY_SECONDS = 5   # 尚無快照且載入失敗時，距離下次重試的秒數
+
+    def __init__(self, check_interval=60, max_age=3600):
+        self.check_interval = check_interval
+        self.max_age = max_age
+        self._snapshot = None
+        self._checked_at = 0.0
+        self._failed_at = None
+        self._invalidated = False
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _read_version(cursor):
+        """以整張表的 checksum 作為版本；任何新增、刪除或修改（包含不經由本程式的匯入）都會改變。"""
+        cursor.execute("CHECKSUM TABLE drug_info")
+        row = cursor.fetchone()
+        return (row['Checksum'],) if row else None
+
+    def _load(self, current):
+        """檢查版本並在需要時重新載入；回傳最新的快照，失敗時回傳 current（需持有鎖）。"""
+        from .db import get_pool
+        try:
+            pool = get_pool()
+            db = pool.acquire()
+        except Exception as e:
+            print(f"[DrugCatalog] 無法取得資料庫連線，沿用{'舊的' if current else '空的'}藥品目錄: {e}")
+            return current
+        try:
+            with db.cursor() as cursor:
+                version = self._read_version(cursor)
+                expired = current is None or time.monotonic() - current.loaded_at >= self.max_age
+                if not expired and not self._invalidated and version == current.version:
+                    return current
+                cursor.execute("""
+                    SELECT drug_id, drug_name_en, drug_name_zh, main_use, side_effects,
+                           shape, color, food_drug_interactions, image_url
+                    FROM drug_info
+                """)
+                records = [DrugRecord(row) for row in cursor.fetchall() if row.get('drug_id')]
+            if not records:
+                print("[DrugCatalog] drug_info 查無資料，不更新藥品目錄")
+                return current
+            snapshot = CatalogSnapshot(records, version)
+            self._invalidated = False
+            print(f"[DrugCatalog] 已載入 {len(snapshot)} 筆藥品資料 (版本 {version})")
+            return snapshot
+        except Exception as e:
+            print(f"[DrugCatalog] 載入藥品目錄失敗: {e}")
+            return current
+        finally:
+            pool.release(db)
+
+    def snapshot(self):
+        """取得目前的藥品目錄快照；必要時（在 app context 中）檢查版本並重新載入。"""
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and not self._invalidated and now - self._checked_at < self.check_interval:
+            return snapshot
+        if snapshot is None and self._failed_at is not None and now - self._failed_at < self.RETRY_SECONDS:
+            return _EMPTY
+        with self._lock:
+            if self._snapshot is None or self._invalidated or time.monotonic() - self._checked_at >= self.check_interval:
+                self._snapshot = self._load(self._snapshot)
+                self._checked_at = time.monotonic()
+                # 尚無快照時記錄失敗時間，短暫等待後重試，而不是把空目錄當成已載入直到下次檢查
+                self._failed_at = self._checked_at if self._snapshot is None else None
+            return self._snapshot or _EMPTY
+
+    def invalidate(self):
+        """標記目錄已變更（例如 add_drug_info 之後），下一次查詢時重新載入。"""
+        self._invalidated = True
+
+    def get(self, drug_id):
+        return self.snapshot().by_id.get(drug_id)
+
+    def stats(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            return {'size': 0, 'version': None, 'age_seconds': None}
+        return {
+            'size': len(snapshot),
+            'version': list(snapshot.version) if snapshot.version else None,
+            'age_seconds': round(time.monotonic() - snapshot.loaded_at, 1),
+        }
+
+
+drug_catalog = DrugCatalog(
+    check_interval=Config.DRUG_CATALOG_CHECK_INTERVAL,
+    max_age=Config.DRUG_CATALOG_MAX_AGE
+)
@@ -0,0 +1,119 @@
+# app/utils/http_client.py
+
+"""
+對外 HTTP 呼叫共用的 client。
+
+- 單一 requests.Session，依 host 保留 keep-alive 連線池，避免每次請求都重新做 TCP + TLS 握手
+- 預設 (connect, read) 逾時；呼叫端只給一個數字時視為 read 逾時，connect 仍用預設值
+- 重試策略：連線失敗一律重試（請求尚未送出）；502/503/504 只對 GET/HEAD/OPTIONS 重試
+- 每個 host 的請求數、錯誤數與延遲統計，可由 /api/health-detailed 查看
+"""
+
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class _HostMetrics:
+    __slots__ = ('requests', 'errors', 'total_ms', 'max_ms')
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+
+class HttpClient:
+    def __init__(self, connect_timeout=3.05, read_timeout=30, pool_connections=16, pool_maxsize=16,
+                 connect_retries=2, status_retries=2, backoff_factor=0.3):
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        retry = Retry(
+            total=None,
+            connect=connect_retries,
+            read=0,
+            status=status_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET', 'HEAD', 'OPTIONS']),
+            raise_on_status=False,
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._metrics = {}
+        self._metrics_lock = threading.Lock()
+
+    def _timeout(self, timeout):
+        if timeout is None:
+            return (self.connect_timeout, self.read_timeout)
+        if isinstance(timeout, (int, float)):
+            return (min(self.connect_timeout, timeout), timeout)
+        return timeout
+
+    def _record(self, host, elapsed_ms, error):
+        with self._metrics_lock:
+            metrics = self._metrics.get(host)
+            if metrics is None:
+                metrics = self._metrics[host] = _HostMetrics()
+            metrics.requests += 1
+            metrics.total_ms += elapsed_ms
+            metrics.max_ms = max(metrics.max_ms, elapsed_ms)
+            if error:
+                metrics.errors += 1
+
+    def request(self, method, url, timeout=None, **kwargs):
+        host = urlsplit(url).netloc
+        started = time.monotonic()
+        error = True
+        try:
+            response = self.session.request(method, url, timeout=self._timeout(timeout), **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            self._record(host, (time.monotonic() - started) * 1000, error)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def stats(self):
+        with self._metrics_lock:
+            return {
+                host: {
+                    'requests': m.requests,
+                    'errors': m.errors,
+                    'avg_ms': round(m.total_ms / m.requests, 1) if m.requests else 0,
+                    'max_ms': round(m.max_ms, 1),
+                }
+                for host, m in self._metrics.items()
+            }
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_http_client():
+    """取得行程共用的 HttpClient。"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from config import Config
+                _client = HttpClient(
+                    connect_timeout=Config.HTTP_CONNECT_TIMEOUT,
+                    read_timeout=Config.HTTP_READ_TIMEOUT,
+                    pool_maxsize=Config.HTTP_POOL_MAXSIZE,
+                    connect_retries=Config.HTTP_CONNECT_RETRIES
+                )
+    return _client
@@ -0,0 +1,86 @@
+# app/utils/image_pipeline.py
+
+"""
+辨識用圖片的前處理：每張圖片最多解碼 / 縮圖 / 重新編碼一次，所有辨識後端共用同一份 bytes。
+
+- 原始圖片已是 JPEG、尺寸不超過上限且沒有 EXIF 旋轉標記時，直接使用下載的原始 bytes，不重新編碼
+- 否則只做一次 EXIF 轉正 + 轉 RGB + 縮圖（PILL_IMAGE_MAX_DIMENSION）+ JPEG 編碼
+- base64 字串在第一次需要時計算並快取
+- digest：jpeg_bytes 的 SHA-256，辨識結果快取以此比對完全相同的照片
+- dhash：64 位元的差異雜湊（perceptual hash），供辨識結果快取（有設定時）比對近似的照片
+"""
+
+import base64
+import hashlib
+import io
+
+from PIL import Image, ImageOps
+
+_EXIF_ORIENTATION = 0x0112
+
+
+class PreparedImage:
+    __slots__ = ('original_bytes', 'jpeg_bytes', 'width', 'height', 'reencoded', '_base64', '_digest', '_dhash')
+
+    def __init__(self, original_bytes, max_dimension=None, quality=85):
+        """max_dimension：最長邊上限（像素，呼叫端傳入 Config.PILL_IMAGE_MAX_DIMENSION）；None 表示不縮圖。"""
+        self.original_bytes = bytes(original_bytes)
+        self._base64 = None
+        self._digest = None
+        self._dhash = None
+
+        # Image.open 只讀取標頭，需要重新編碼時才會真正解碼像素
+        image = Image.open(io.BytesIO(self.original_bytes))
+        width, height = image.size
+        oriented = image.format == 'JPEG' and image.getexif().get(_EXIF_ORIENTATION, 1) != 1
+        too_large = max_dimension and max(width, height) > max_dimension
+
+        if image.format == 'JPEG' and image.mode in ('RGB', 'L') and not too_large and not oriented:
+            self.jpeg_bytes = self.original_bytes
+            self.reencoded = False
+        else:
+            # 重新編碼不會保留 EXIF，需先依旋轉標記把像素轉正，否則手機直拍的照片會變成橫躺
+            if oriented:
+                image = ImageOps.exif_transpose(image)
+            image = image.convert('RGB')
+            if too_large:
+                image.thumbnail((max_dimension, max_dimension))
+            buffer = io.BytesIO()
+            image.save(buffer, format='JPEG', quality=quality)
+            self.jpeg_bytes = buffer.getvalue()
+            self.reencoded = True
+            width, height = image.size
+
+        self.width = width
+        self.height = height
+
+    @property
+    def base64(self):
+        if self._base64 is None:
+            self._base64 = base64.b64encode(self.jpeg_bytes).decode('utf-8')
+        return self._base64
+
+    @property
+    def digest(self):
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.jpeg_bytes).hexdigest()
+        return self._digest
+
+    @property
+    def dhash(self):
+        """縮成 9x8 灰階後比較相鄰像素的 64 位元差異雜湊；重新壓縮或輕微縮放的照片雜湊幾乎相同。"""
+        if self._dhash is None:
+            image = Image.open(io.BytesIO(self.jpeg_bytes))
+            image.draft('L', (64, 64))  # JPEG 可直接以低解析度解碼
+            pixels = list(image.convert('L').resize((9, 8), Image.LANCZOS).getdata())
+            bits = 0
+            for row in range(8):
+                for col in range(8):
+                    left = pixels[row * 9 + col]
+                    bits = (bits << 1) | (left > pixels[row * 9 + col + 1])
+            self._dhash = bits
+        return self._dhash
+
+    def to_pil(self):
+        """需要 PIL 物件的舊介面使用；每次呼叫都會重新解碼。"""
+        return Image.open(io.BytesIO(self.jpeg_bytes)).convert('RGB')
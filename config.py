@@ -10,6 +10,25 @@ class Config:
     LINE_CHANNEL_SECRET = os.environ.get('LINE_CHANNEL_SECRET')
     YOUR_BOT_ID = os.environ.get('YOUR_BOT_ID')
     
+    # --- Webhook 非同步處理設定 ---
+    WEBHOOK_ASYNC_ENABLED = os.environ.get('WEBHOOK_ASYNC_ENABLED', 'true').lower() == 'true'
+    WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', 4))
+    WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', 100))
+    WEBHOOK_ENQUEUE_TIMEOUT = float(os.environ.get('WEBHOOK_ENQUEUE_TIMEOUT', 2.0))
+    
+    # --- LINE Profile 快取設定 ---
+    PROFILE_CACHE_SIZE = int(os.environ.get('PROFILE_CACHE_SIZE', 1000))
+    PROFILE_CACHE_TTL = int(os.environ.get('PROFILE_CACHE_TTL', 3600))
+    PROFILE_CACHE_NEGATIVE_TTL = int(os.environ.get('PROFILE_CACHE_NEGATIVE_TTL', 300))
+    
+    # --- 提醒推播發送設定 ---
+    PUSH_MAX_WORKERS = int(os.environ.get('PUSH_MAX_WORKERS', 8))
+    PUSH_RATE_PER_SEC = float(os.environ.get('PUSH_RATE_PER_SEC', 100))
+    PUSH_MAX_ATTEMPTS = int(os.environ.get('PUSH_MAX_ATTEMPTS', 4))
+    PUSH_TICK_DEADLINE_SECONDS = int(os.environ.get('PUSH_TICK_DEADLINE_SECONDS', 55))
+    # 停機後補發漏掉提醒的時間窗（分鐘）
+    REMINDER_CATCHUP_MINUTES = int(os.environ.get('REMINDER_CATCHUP_MINUTES', 5))
+    
     # --- LIFF 應用程式設定 ---
     LIFF_CHANNEL_ID = os.environ.get('LIFF_CHANNEL_ID')
     
@@ -34,12 +53,58 @@ class Config:
     # --- Google Gemini API 設定 ---
     GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
 
+    # --- 藥單 OCR 設定 ---
+    # 多張藥單圖片同時送出的上限（FastAPI OCR）
+    OCR_MAX_PARALLEL = int(os.environ.get('OCR_MAX_PARALLEL', 4))
+    # Flask OCR 的結果以 line_user_id 輪詢，同一使用者同時送出多張會互相覆蓋，預設不並行
+    OCR_API_MAX_PARALLEL = int(os.environ.get('OCR_API_MAX_PARALLEL', 1))
+    # 單張圖片的處理時間上限（秒）
+    OCR_IMAGE_TIMEOUT = float(os.environ.get('OCR_IMAGE_TIMEOUT', 90))
+    # Flask OCR 非同步結果的輪詢總時限（秒），與舊版固定輪詢的總等待時間（約 200 秒）相同；輪詢間隔自 0.5 秒起指數遞增至 5 秒
+    OCR_POLL_DEADLINE = float(os.environ.get('OCR_POLL_DEADLINE', 200))
+
+    # --- 藥名比對設定 ---
+    # 本地比對分數達 DRUG_MATCH_ACCEPT_SCORE 直接採用；低於此值才以前 DRUG_MATCH_TOP_K 名候選詢問 AI
+    DRUG_MATCH_ACCEPT_SCORE = float(os.environ.get('DRUG_MATCH_ACCEPT_SCORE', 0.85))
+    # 低於 DRUG_MATCH_MIN_SCORE 且 AI 無法確認時視為未匹配
+    DRUG_MATCH_MIN_SCORE = float(os.environ.get('DRUG_MATCH_MIN_SCORE', 0.6))
+    DRUG_MATCH_TOP_K = int(os.environ.get('DRUG_MATCH_TOP_K', 5))
+
+    # --- 藥品目錄快取設定 ---
+    # 每隔多久檢查一次 drug_info 是否變更（秒），以及不論版本的強制重新載入間隔（秒）
+    DRUG_CATALOG_CHECK_INTERVAL = int(os.environ.get('DRUG_CATALOG_CHECK_INTERVAL', 60))
+    DRUG_CATALOG_MAX_AGE = int(os.environ.get('DRUG_CATALOG_MAX_AGE', 3600))
+
     # --- Google Speech-to-Text API 設定 ---
     # Google Speech-to-Text 使用相同的服務帳戶憑證
     # Cloud Run 環境會自動處理認證，不需要指定檔案路徑
     GOOGLE_APPLICATION_CREDENTIALS = os.environ.get('GOOGLE_APPLICATION_CREDENTIALS')
     SPEECH_TO_TEXT_ENABLED = os.environ.get('SPEECH_TO_TEXT_ENABLED', 'true').lower() == 'true'
     SPEECH_LANGUAGE_CODE = os.environ.get('SPEECH_LANGUAGE_CODE', 'zh-TW')
+    # 語音串流轉換使用的 ffmpeg 執行檔與逾時（秒，含下載時間）
+    FFMPEG_BINARY = os.environ.get('FFMPEG_BINARY', 'ffmpeg')
+    VOICE_FFMPEG_TIMEOUT = float(os.environ.get('VOICE_FFMPEG_TIMEOUT', 20))
+    # 串流語音辨識：下載、轉換與辨識同時進行；single_utterance 會在偵測到說完時提早結束
+    VOICE_STREAMING_RECOGNITION = os.environ.get('VOICE_STREAMING_RECOGNITION', 'true').lower() == 'true'
+    VOICE_STREAMING_TIMEOUT = float(os.environ.get('VOICE_STREAMING_TIMEOUT', 10))
+    VOICE_STREAMING_SINGLE_UTTERANCE = os.environ.get('VOICE_STREAMING_SINGLE_UTTERANCE', 'false').lower() == 'true'
+    # 語音轉文字本地校正後的信心分數低於此值才交給 Gemini 優化
+    VOICE_AI_ENHANCE_THRESHOLD = float(os.environ.get('VOICE_AI_ENHANCE_THRESHOLD', 0.6))
+    # 啟動時在背景預先建立 Speech / Gemini client；Speech gRPC channel 的 keepalive 間隔（秒，0 為不設定）
+    PREWARM_AI_CLIENTS = os.environ.get('PREWARM_AI_CLIENTS', 'true').lower() == 'true'
+    SPEECH_KEEPALIVE_SECONDS = int(os.environ.get('SPEECH_KEEPALIVE_SECONDS', 300))
+    
+    # --- 語音快取設定 ---
+    # 本地快取的位元組 / 筆數上限與單筆上限；各類結果的 TTL（秒）
+    VOICE_CACHE_MAX_BYTES = int(os.environ.get('VOICE_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+    VOICE_CACHE_MAX_ENTRIES = int(os.environ.get('VOICE_CACHE_MAX_ENTRIES', 512))
+    VOICE_CACHE_MAX_ITEM_BYTES = int(os.environ.get('VOICE_CACHE_MAX_ITEM_BYTES', 4 * 1024 * 1024))
+    VOICE_CACHE_WAV_TTL = int(os.environ.get('VOICE_CACHE_WAV_TTL', 300))
+    VOICE_CACHE_TRANSCRIPT_TTL = int(os.environ.get('VOICE_CACHE_TRANSCRIPT_TTL', 1800))
+    VOICE_CACHE_COMMAND_TTL = int(os.environ.get('VOICE_CACHE_COMMAND_TTL', 1800))
+    # 設定後以 Redis 作為跨實例共用快取（例如 docker-compose 的 redis://redis:6379/0）
+    VOICE_CACHE_REDIS_URL = os.environ.get('VOICE_CACHE_REDIS_URL')
+    VOICE_CACHE_REDIS_COOLDOWN = int(os.environ.get('VOICE_CACHE_REDIS_COOLDOWN', 30))
     
         
     # --- YOLO 模型 API 設定 ---
@@ -51,6 +116,30 @@ class Config:
     # --- Kevin 模型 API 設定 ---
     KEVIN_API_URL = os.environ.get('KEVIN_API_URL')
     
+    # --- 藥丸辨識調度設定 ---
+    # 多模型共用執行緒池大小、延遲預算（秒，超過即回傳已完成的結果；不應小於模型端點 60 秒的請求逾時）
+    PILL_DETECT_WORKERS = int(os.environ.get('PILL_DETECT_WORKERS', 12))
+    PILL_DETECT_BUDGET_SECONDS = float(os.environ.get('PILL_DETECT_BUDGET_SECONDS', 65))
+    # 主要端點超過幾秒未回應就對 YOLO_V12_HEDGE_URL / YOLO_V11_HEDGE_URL 送出對沖請求（未設定則不對沖）
+    PILL_DETECT_HEDGE_AFTER = os.environ.get('PILL_DETECT_HEDGE_AFTER')
+    # 斷路器：連續失敗次數門檻與暫停秒數
+    PILL_DETECT_BREAKER_THRESHOLD = int(os.environ.get('PILL_DETECT_BREAKER_THRESHOLD', 3))
+    PILL_DETECT_BREAKER_RESET_SECONDS = float(os.environ.get('PILL_DETECT_BREAKER_RESET_SECONDS', 60))
+    # 上傳給辨識模型的圖片最長邊（像素）；原圖是未超過此尺寸的 JPEG 時直接沿用原始檔
+    PILL_IMAGE_MAX_DIMENSION = int(os.environ.get('PILL_IMAGE_MAX_DIMENSION', 1600))
+    # 辨識結果快取（以模型 + 圖片內容雜湊為鍵）；大小設為 0 可停用
+    PILL_RESULT_CACHE_SIZE = int(os.environ.get('PILL_RESULT_CACHE_SIZE', 256))
+    PILL_RESULT_CACHE_TTL = int(os.environ.get('PILL_RESULT_CACHE_TTL', 1800))
+    # 大於 0 時，perceptual hash 漢明距離在此值以內也視為同一張照片；預設 0 只接受內容完全相同的照片，調高可能把不同藥丸當成同一張
+    PILL_RESULT_CACHE_MAX_DISTANCE = int(os.environ.get('PILL_RESULT_CACHE_MAX_DISTANCE', 0))
+    
+    # --- 對外 HTTP 連線設定 ---
+    # 共用連線池的 connect / read 逾時（秒）、每個 host 的連線數上限與連線失敗重試次數
+    HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 3.05))
+    HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 30))
+    HTTP_POOL_MAXSIZE = int(os.environ.get('HTTP_POOL_MAXSIZE', 16))
+    HTTP_CONNECT_RETRIES = int(os.environ.get('HTTP_CONNECT_RETRIES', 2))
+    
     # --- MySQL 資料庫設定 ---
     DB_HOST = os.environ.get('DB_HOST')
     DB_USER = os.environ.get('DB_USER')
@@ -58,6 +147,15 @@ class Config:
     DB_NAME = os.environ.get('DB_NAME')
     DB_PORT = int(os.environ.get('DB_PORT', 3306))
 
+    # --- MySQL 連線池設定 ---
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 8))
+    DB_POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 4))
+    DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    DB_POOL_IDLE_TIMEOUT = int(os.environ.get('DB_POOL_IDLE_TIMEOUT', 300))
+    # 閒置超過此秒數的連線借出前先 ping 確認
+    DB_POOL_PRE_PING_AFTER = int(os.environ.get('DB_POOL_PRE_PING_AFTER', 30))
+
     @staticmethod
     def validate_config():
         """檢查所有必要的環境變數是否都已設定。"""
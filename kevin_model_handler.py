@@ -49,24 +49,27 @@ def _upload_to_gcs(image_bytes, suffix='annotated.jpg'):
         print(f"    - [Kevin模型] GCS 上傳失敗 (這不會影響辨識功能): {e}")
         return None
 
-def detect_pills(pil_image):
+def detect_pills(pil_image=None, image_bytes=None):
     """
-    主要辨識函式，接收 PIL 圖片，呼叫 Kevin 的 API，並回傳標準化格式的結果。
+    主要辨識函式，接收 PIL 圖片或已編碼的 JPEG bytes，呼叫 Kevin 的 API，並回傳標準化格式的結果。
+    有 image_bytes 時直接上傳，不再重新編碼。
     """
     start_time = time()
     print("    - [Kevin模型] 開始處理...")
 
-    # 將 PIL Image 轉換回 bytes
-    import io
-    img_byte_arr = io.BytesIO()
-    pil_image.save(img_byte_arr, format='JPEG')
-    image_bytes = img_byte_arr.getvalue()
+    if image_bytes is None:
+        # 將 PIL Image 轉換回 bytes
+        import io
+        img_byte_arr = io.BytesIO()
+        pil_image.save(img_byte_arr, format='JPEG')
+        image_bytes = img_byte_arr.getvalue()
 
     try:
         # 步驟 1: 呼叫 kevin_api.py 中定義的 API
         files = {"file": ("image.jpg", image_bytes, "image/jpeg")}
         print(f"    - [Kevin模型] 呼叫 API: {KEVIN_API_URL}")
-        api_resp = requests.post(KEVIN_API_URL, files=files, timeout=30)
+        from app.utils.http_client import get_http_client
+        api_resp = get_http_client().post(KEVIN_API_URL, files=files, timeout=30)
         api_resp.raise_for_status()
         result = api_resp.json()
         print(f"    - [Kevin模型] API 回應成功")
@@ -0,0 +1,28 @@
+# tests/conftest.py
+
+"""
+單元測試共用設定。
+
+app/__init__.py 會建立 Flask app 與 LINE Bot 用戶端，純函式模組改以檔案路徑直接載入，
+不經過 app 套件，未安裝 Flask / Pillow 時也能測試。
+"""
+
+import importlib.util
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def load_module(relative_path):
+    """以檔案路徑載入模組（模組內不可有相對匯入）。"""
+    name = 'tests_' + os.path.splitext(relative_path)[0].replace('/', '_')
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
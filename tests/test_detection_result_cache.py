@@ -0,0 +1,50 @@
+from conftest import load_module
+
+pd = load_module('app/services/pill_detection.py')
+
+
+def test_exact_hit_requires_same_digest():
+    cache = pd.DetectionResultCache()
+    cache.put('yolo', 'digest-a', 0xFFFF, {'pills': [1]})
+    assert cache.get('yolo', 'digest-a', 0xFFFF) == {'pills': [1]}
+    # 相同 dhash 但內容不同的照片不可命中
+    assert cache.get('yolo', 'digest-b', 0xFFFF) is None
+    assert cache.get('other', 'digest-a', 0xFFFF) is None
+    assert (cache.hits, cache.near_hits, cache.misses) == (1, 0, 2)
+
+
+def test_result_is_copied():
+    cache = pd.DetectionResultCache()
+    cache.put('yolo', 'digest-a', 0, {'pills': []})
+    cache.get('yolo', 'digest-a')['pills'].append('mutated')
+    assert cache.get('yolo', 'digest-a') == {'pills': []}
+
+
+def test_band_lookup_finds_near_duplicate():
+    cache = pd.DetectionResultCache(max_distance=3)
+    image_hash = 0x0123456789ABCDEF
+    cache.put('yolo', 'digest-a', image_hash, 'result')
+    # 三個位元不同，且分散在不同段落
+    near_hash = image_hash ^ (1 | (1 << 20) | (1 << 63))
+    assert cache.get('yolo', 'digest-b', near_hash) == 'result'
+    assert cache.near_hits == 1
+    # 超過 max_distance 不命中
+    far_hash = near_hash ^ (1 << 40)
+    assert cache.get('yolo', 'digest-c', far_hash) is None
+
+
+def test_band_index_cleaned_on_eviction():
+    cache = pd.DetectionResultCache(max_size=1, max_distance=2)
+    cache.put('yolo', 'digest-a', 0, 'a')
+    cache.put('yolo', 'digest-b', (1 << 64) - 1, 'b')
+    assert cache.get('yolo', 'digest-c', 1) is None
+    assert all('digest-a' not in digests for digests in cache._band_index.values())
+
+
+def test_expired_entry_is_miss(monkeypatch):
+    cache = pd.DetectionResultCache(ttl=10)
+    now = [1000.0]
+    monkeypatch.setattr(pd.time, 'monotonic', lambda: now[0])
+    cache.put('yolo', 'digest-a', 0, 'result')
+    now[0] += 11
+    assert cache.get('yolo', 'digest-a', 0) is None
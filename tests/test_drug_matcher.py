@@ -0,0 +1,46 @@
+from conftest import load_module
+
+dm = load_module('app/services/drug_matcher.py')
+
+
+class _Record:
+    def __init__(self, drug_id, drug_name_zh, drug_name_en):
+        self.drug_id = drug_id
+        self.drug_name_zh = drug_name_zh
+        self.drug_name_en = drug_name_en
+
+
+RECORDS = [
+    _Record('A001', '脈優錠', 'Norvasc 5mg Tablets'),
+    _Record('A002', '克憂果膜衣錠', 'Paxil F.C. Tablets'),
+    _Record('A003', '普拿疼錠', 'Panadol Tablets'),
+    _Record('', '無代碼藥品', 'No Id'),
+]
+
+
+def test_skips_records_without_id():
+    assert len(dm.DrugMatcher(RECORDS)) == 3
+
+
+def test_exact_names_match():
+    matcher = dm.DrugMatcher(RECORDS)
+    drug_id, score, _, _ = matcher.match(name_zh='普拿疼')
+    assert drug_id == 'A003'
+    assert score >= 0.85
+    drug_id, score, _, _ = matcher.match(name_en='norvasc')
+    assert drug_id == 'A001'
+    assert score >= 0.85
+
+
+def test_misspelled_name_still_ranks_first():
+    drug_id, _, _, candidates = dm.DrugMatcher(RECORDS).match(name_en='Paxill')
+    assert drug_id == 'A002'
+    assert [c[1] for c in candidates] == sorted((c[1] for c in candidates), reverse=True)
+
+
+def test_no_candidate():
+    assert dm.DrugMatcher(RECORDS).match(name_zh='', name_en='') == (None, 0.0, 'no_candidate', [])
+
+
+def test_top_k_limits_candidates():
+    assert len(dm.DrugMatcher(RECORDS).candidates(name_en='Tablets Norvasc Paxil Panadol', top_k=2)) <= 2
@@ -0,0 +1,28 @@
+import pytest
+
+pytest.importorskip('flask')
+pytest.importorskip('linebot')
+
+from app.services import reminder_service  # noqa: E402
+
+
+def _reminder(reminder_id, recorder_id, drug_name='脈優錠', member='本人'):
+    return {'id': reminder_id, 'recorder_id': recorder_id, 'member': member, 'drug_name': drug_name}
+
+
+def test_same_recipient_drugs_coalesced():
+    jobs = reminder_service.build_reminder_push_jobs(
+        [_reminder(1, 'U1', '脈優錠'), _reminder(2, 'U1', '普拿疼錠')], '08:00')
+    assert len(jobs) == 1
+    assert jobs[0].to == 'U1'
+    assert '脈優錠、普拿疼錠' in jobs[0].messages[0].text
+    assert jobs[0].reminder_ids == [1, 2]
+
+
+def test_multicast_chunks_carry_only_their_reminders():
+    limit = reminder_service.MAX_MULTICAST_RECIPIENTS
+    reminders = [_reminder(i, f'U{i}') for i in range(limit + 3)]
+    jobs = reminder_service.build_reminder_push_jobs(reminders, '08:00')
+    assert [job.recipient_count for job in jobs] == [limit, 3]
+    assert jobs[0].reminder_ids == list(range(limit))
+    assert jobs[1].reminder_ids == [limit, limit + 1, limit + 2]
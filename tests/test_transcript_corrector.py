@@ -0,0 +1,44 @@
+from conftest import load_module
+
+tc = load_module('app/services/transcript_corrector.py')
+
+
+def test_chinese_to_int():
+    assert tc.chinese_to_int('十二') == 12
+    assert tc.chinese_to_int('二十五') == 25
+    assert tc.chinese_to_int('一百零五') == 105
+    assert tc.chinese_to_int('一五') == 15
+    assert tc.chinese_to_int('兩') == 2
+    assert tc.chinese_to_int('三四十') is None
+    assert tc.chinese_to_int('') is None
+
+
+def test_convert_numerals_time_and_dose():
+    assert tc.convert_numerals('兩點半吃藥') == '2點半吃藥'
+    assert tc.convert_numerals('三點十五分') == '3點15分'
+    assert tc.convert_numerals('二十五毫克') == '25毫克'
+    assert tc.convert_numerals('一天三顆') == '一天3顆'
+
+
+def test_convert_numerals_keeps_frequency_and_amount_words():
+    assert tc.convert_numerals('一天一次') == '一天一次'
+    assert tc.convert_numerals('我要吃一點點藥') == '我要吃一點點藥'
+    assert tc.convert_numerals('吃一點兒就好') == '吃一點兒就好'
+
+
+def test_normalize_units():
+    assert tc.normalize_units('5西西') == '5ml'
+    assert tc.normalize_units('10 cc') == '10ml'
+    assert tc.normalize_units('ccc') == 'ccc'
+
+
+def test_replacement_trie_longest_match():
+    trie = tc._ReplacementTrie({'血壓要': '血壓藥', '血鴨': '血壓', '用要提醒': '用藥提醒', '同': '同'})
+    text, changes = trie.replace('血鴨高要吃血壓要，設定用要提醒')
+    assert text == '血壓高要吃血壓藥，設定用藥提醒'
+    assert changes == [('血鴨', '血壓'), ('血壓要', '血壓藥'), ('用要提醒', '用藥提醒')]
+
+
+def test_replacement_trie_partial_prefix_is_kept():
+    trie = tc._ReplacementTrie({'用要提醒': '用藥提醒'})
+    assert trie.replace('用要吃') == ('用要吃', [])
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip('linebot')
+
+from conftest import load_module  # noqa: E402
+
+wq = load_module('app/services/webhook_queue.py')
+
+
+class _Source:
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+
+class _Event:
+    def __init__(self, user_id):
+        self.source = _Source(user_id)
+
+
+class _Payload:
+    def __init__(self, events):
+        self.events = events
+        self.destination = 'bot'
+
+
+class _Parser:
+    def __init__(self, events):
+        self.events = events
+
+    def parse(self, body, signature, as_payload=False):
+        return _Payload(self.events)
+
+
+class _LineHandler:
+    def __init__(self, events):
+        self.parser = _Parser(events)
+
+
+def _dispatcher(events, **kwargs):
+    return wq.WebhookDispatcher(None, _LineHandler(events), enqueue_timeout=0, **kwargs)
+
+
+def test_same_user_goes_to_same_shard():
+    events = [_Event('U1'), _Event('U2'), _Event('U1'), _Event('U3'), _Event('U1')]
+    dispatcher = _dispatcher(events, num_workers=4)
+    assert dispatcher.submit('{}', 'sig') == 5
+    shard = dispatcher._shard_for('U1')
+    queued = [item[1] for item in dispatcher._queues[shard].queue]
+    assert [e for e in queued if e.source.user_id == 'U1'] == [events[0], events[2], events[4]]
+    assert dispatcher.stats()['depth'] == 5
+
+
+def test_batch_rejected_as_a_whole_when_a_shard_is_full():
+    events = [_Event('U1'), _Event('U1'), _Event('U2')]
+    dispatcher = _dispatcher(events, num_workers=2, queue_size=1)
+    with pytest.raises(wq.WebhookQueueFullError):
+        dispatcher.submit('{}', 'sig')
+    stats = dispatcher.stats()
+    assert stats['depth'] == 0
+    assert stats['rejected'] == 3